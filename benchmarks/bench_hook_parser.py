@@ -0,0 +1,121 @@
+"""
+Micro-benchmark for webhook request parsing.
+
+Compares the parameter lookup handle_webhook used to do on the Flask
+request (query args, then the path split on '/' and '&', then JSON, then
+form) with hook_parser.parse_hook_request, for the four payload shapes:
+path parameters (what Bitrix sends), query string, JSON body and form body,
+plus a name with an encoded '&' and an unrendered {{...}} template.
+
+    python benchmarks/bench_hook_parser.py [--number N]
+"""
+import argparse
+import io
+import os
+import sys
+import timeit
+from urllib.parse import quote
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from hook_parser import parse_hook_request  # noqa: E402
+
+NAME = "Заказ №12345"
+SUMMA = "12 500,00"
+
+SHAPES = {
+    'path': dict(method='GET', path=f"/hook7/name={quote(NAME)}&summa={quote(SUMMA)}"),
+    # An encoded '&' in the name: the legacy split cuts the name short
+    'path-amp': dict(method='GET', path=f"/hook7/name={quote('ООО Рога & Копыта')}&summa={quote(SUMMA)}"),
+    'query': dict(method='GET', path="/hook7/x", query_string={'name': NAME, 'summa': SUMMA}),
+    'json': dict(method='POST', path="/hook7/x", json={'name': NAME, 'summa': SUMMA}),
+    'form': dict(method='POST', path="/hook7/x", data={'name': NAME, 'summa': SUMMA}),
+    'unrendered': dict(method='GET', path=f"/hook7/name={quote('{{Название}}')}&summa={quote('{{Сумма}}')}"),
+}
+
+
+def legacy_parse(request, path):
+    """The lookup handle_webhook did before hook_parser, kept as the baseline"""
+    name = ''
+    summa = ''
+    raw_data = ''
+    if request.args:
+        name = request.args.get('name', '')
+        summa = request.args.get('summa', '')
+        raw_data = str(dict(request.args))
+    if not name and not summa and path:
+        path_parts = path.split('/')
+        if path_parts:
+            params = {}
+            for pair in path_parts[-1].split('&'):
+                if '=' in pair:
+                    key, value = pair.split('=', 1)
+                    params[key] = value
+            name = params.get('name', '')
+            summa = params.get('summa', '')
+            raw_data = str(params)
+    if not name and not summa and request.method == 'POST':
+        if request.is_json:
+            data = request.get_json()
+            name = data.get('name', '')
+            summa = data.get('summa', '')
+            raw_data = str(data)
+        else:
+            name = request.form.get('name', '')
+            summa = request.form.get('summa', '')
+            raw_data = str(dict(request.form))
+    return name, summa, raw_data
+
+
+def fresh_environ(environ, body):
+    environ = dict(environ)
+    environ['wsgi.input'] = io.BytesIO(body)
+    return environ
+
+
+def run_legacy(environ, body):
+    request = Request(fresh_environ(environ, body))
+    return legacy_parse(request, request.path.split('/', 2)[2])
+
+
+def run_parser(environ, body):
+    # The same request parts the handler passes from Flask's request
+    request = Request(fresh_environ(environ, body))
+    event = parse_hook_request(
+        7, request.path.split('/', 2)[2],
+        query_string=request.query_string,
+        raw_uri=environ.get('RAW_URI'),
+        method=request.method,
+        content_type=request.content_type or '',
+        body=request.get_data() if request.method == 'POST' else b'',
+    )
+    return event.name, event.summa, event.raw_data
+
+
+def bench(func, environ, body, number):
+    return timeit.timeit(lambda: func(environ, body), number=number) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help="iterations per payload shape")
+    args = parser.parse_args()
+
+    print(f"{'shape':<11} {'legacy ns':>10} {'parser ns':>10} {'speedup':>8}  result")
+    for shape, options in SHAPES.items():
+        builder = EnvironBuilder(**options)
+        environ = builder.get_environ()
+        body = environ['wsgi.input'].read()
+        legacy = run_legacy(environ, body)
+        current = run_parser(environ, body)
+        legacy_ns = bench(run_legacy, environ, body, args.number)
+        current_ns = bench(run_parser, environ, body, args.number)
+        marker = "same" if legacy[:2] == current[:2] else f"legacy={legacy[:2]!r} parser={current[:2]!r}"
+        print(f"{shape:<11} {legacy_ns:10.0f} {current_ns:10.0f} {legacy_ns / current_ns:7.2f}x  {marker}")
+
+
+if __name__ == '__main__':
+    main()
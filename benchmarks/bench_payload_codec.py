@@ -0,0 +1,71 @@
+"""
+Micro-benchmark for raw payload storage.
+
+Generates payloads the way the load test does (Cyrillic deal names, the
+usual summa formats, path/query/form shapes and /hooks/batch items) and
+compares the stored size of the old str(dict) repr, canonical JSON, plain
+zlib and payload_codec (raw DEFLATE with the preset dictionary), plus the
+time to encode and decode one payload.
+
+    python benchmarks/bench_payload_codec.py [--count N] [--seed S]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_bench import DEAL_NAMES, SUMMA_FORMATS  # noqa: E402
+from payload_codec import canonical_json, decode_payload, encode_payload  # noqa: E402
+
+
+def sample_payloads(count, seed):
+    rnd = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        value = rnd.randint(500, 250000)
+        params = {
+            'name': rnd.choice(DEAL_NAMES).format(n=rnd.randint(1, 99999)),
+            'summa': rnd.choice(SUMMA_FORMATS).format(v=value, v_space=f"{value:,}".replace(',', ' ')),
+        }
+        if i % 10 == 0:
+            # A /hooks/batch item
+            params.update(hook=rnd.randint(1, 25), ts=f"2026-10-{rnd.randint(1, 28):02d}T12:00:00+03:00",
+                          idempotency_key=f"{rnd.getrandbits(64):016x}")
+        payloads.append(params)
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=10000, help="payloads to generate")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    payloads = sample_payloads(args.count, args.seed)
+    texts = [canonical_json(params) for params in payloads]
+    encoded = [encode_payload(text) for text in texts]
+    assert all(decode_payload(blob) == text for blob, text in zip(encoded, texts))
+
+    sizes = {
+        'str(dict)': sum(len(str(params).encode('utf-8')) for params in payloads),
+        'json': sum(len(text.encode('utf-8')) for text in texts),
+        'zlib': sum(len(zlib.compress(text.encode('utf-8'), 9)) for text in texts),
+        'codec': sum(len(blob) for blob in encoded),
+    }
+    print(f"{'format':<10} {'avg bytes':>10} {'vs repr':>8}")
+    for name, total in sizes.items():
+        print(f"{name:<10} {total / args.count:10.1f} {total / sizes['str(dict)']:7.0%}")
+
+    number = min(args.count, 5000)
+    encode_ns = timeit.timeit(lambda: [encode_payload(text) for text in texts[:number]], number=1) / number * 1e9
+    decode_ns = timeit.timeit(lambda: [decode_payload(blob) for blob in encoded[:number]], number=1) / number * 1e9
+    print(f"encode {encode_ns:.0f} ns, decode {decode_ns:.0f} ns per payload")
+
+
+if __name__ == '__main__':
+    main()
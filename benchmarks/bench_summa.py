@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for summa parsing.
+
+Compares the per-character parser that used to run at ingest and on every
+time-filtered stats read with work.summa_to_int, over summa values as
+Bitrix actually sends them.
+
+    python benchmarks/bench_summa.py [--number N]
+"""
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from work import summa_to_int  # noqa: E402
+
+# Realistic values: plain integers, formatted amounts, unrendered or empty
+# Bitrix fields and trailing underscores from the webhook URL template
+SAMPLES = [
+    "1500",
+    "12 500,00",
+    "12500.00",
+    "1500_",
+    "__",
+    "",
+    "45 000 ₽",
+    "3 990,50",
+    "null",
+    "7990",
+    "125000",
+    "1,234.56",
+]
+
+
+def legacy_summa_to_int(summa):
+    """The original save_webhook conversion, kept here as the baseline"""
+    try:
+        if isinstance(summa, str):
+            summa = summa.rstrip('_')
+        if not summa or summa.lower() in ('__', 'none', 'null', ''):
+            return 0
+        summa_clean = ''.join(c for c in str(summa) if c.isdigit() or c in '.,')
+        summa_clean = summa_clean.replace(',', '.')
+        if summa_clean:
+            return int(float(summa_clean))
+        return 0
+    except (ValueError, TypeError, AttributeError):
+        return 0
+
+
+def bench(func, number):
+    seconds = timeit.timeit(lambda: [func(value) for value in SAMPLES], number=number)
+    return seconds / (number * len(SAMPLES)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help="iterations over the sample set")
+    args = parser.parse_args()
+
+    # Unparseable samples log a warning on every call; keep the output readable
+    logging.disable(logging.WARNING)
+
+    for value in SAMPLES:
+        legacy, current = legacy_summa_to_int(value), summa_to_int(value)
+        marker = "" if legacy == current else "  (differs)"
+        print(f"{value!r:>14} -> legacy={legacy:<8} summa_to_int={current}{marker}")
+
+    legacy_ns = bench(legacy_summa_to_int, args.number)
+    current_ns = bench(summa_to_int, args.number)
+    print()
+    print(f"legacy parser:  {legacy_ns:8.1f} ns/event")
+    print(f"summa_to_int:   {current_ns:8.1f} ns/event")
+    print(f"speedup:        {legacy_ns / current_ns:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Load test for the ingest and dashboard paths.
+
+Replays mixed webhook traffic over all /hook<N>/ URL shapes (path-encoded,
+query string, JSON and form bodies) at a configurable rate while reader
+threads hit the dashboard and the JSON APIs. By default the app runs
+in-process through Flask's test client against a fresh database in a
+temporary directory; --url drives an already running server instead.
+
+Reports p50/p95/p99 latency and throughput per request kind, the time
+spent in save_webhooks_batch and get_webhooks_by_filter, SQLite lock waits
+and database growth, and writes them as JSON (--output) so runs can be
+compared (--compare previous.json).
+
+    python benchmarks/load_bench.py --duration 20 --rate 200 --readers 4
+    python benchmarks/load_bench.py --url http://127.0.0.1:5001 --output run.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from urllib.parse import quote, urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Deal names as CRM users type them: Cyrillic, numbers, '&' and quotes
+DEAL_NAMES = [
+    "Заказ №{n}",
+    "Сделка с ООО «Ромашка» №{n}",
+    "Оптовая закупка {n}",
+    "ИП Иванов & партнёры {n}",
+    "Клиент Петров, заказ {n}",
+    "Разовая поставка #{n}",
+]
+SUMMA_FORMATS = ["{v}", "{v} ₽", "{v},00", "{v}.00", "{v}_", "{v_space}"]
+
+# Funnel-shaped traffic: early stages see most deals
+STAGE_WEIGHTS = [30, 4, 2, 2, 2, 2, 20, 8, 6, 6, 10, 3, 6, 3, 4, 5, 2, 3, 2, 2, 4, 2, 1, 1, 1]
+
+SHAPES = ('path', 'query', 'json', 'form')
+
+
+def parse_mix(text):
+    """'path=60,query=15,json=15,form=10' -> ([shape], [weight])"""
+    weights = {}
+    for part in text.split(','):
+        shape, _, weight = part.partition('=')
+        if shape not in SHAPES:
+            raise argparse.ArgumentTypeError(f"unknown shape {shape!r} (use {', '.join(SHAPES)})")
+        weights[shape] = float(weight or 1)
+    return list(weights), list(weights.values())
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    """Latency percentiles (ms) and throughput for one request kind"""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None,
+        'max_ms': round(values[-1] * 1000, 3) if values else None,
+    }
+
+
+class Recorder:
+    """Thread-safe latency samples and error counts per request kind"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, kind, seconds, status):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            self.statuses[kind][status] += 1
+            if status >= 500 or status == 0:
+                self.errors[kind] += 1
+
+
+class TestClientTransport:
+    """Requests through Flask's test client against the in-process app"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, url, data=None, json_body=None, content_type=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        if json_body is not None:
+            response = client.open(url, method=method, json=json_body)
+        else:
+            response = client.open(url, method=method, data=data, content_type=content_type)
+        response.close()
+        return response.status_code
+
+
+class HttpTransport:
+    """Requests over HTTP to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, data=None, json_body=None, content_type=None):
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            data = urlencode(data).encode()
+            headers['Content-Type'] = content_type or 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return 0
+
+    def processing_day(self):
+        """The server's current processing day (YYYY-MM-DD), after its own cutoff and timezone"""
+        with urllib.request.urlopen(self.base_url + '/api/kpis', timeout=30) as response:
+            date = json.load(response)['date']
+        return f"{date[6:10]}-{date[3:5]}-{date[0:2]}" if date[2] == '.' else date
+
+
+class TrafficGenerator:
+    """Random but reproducible webhooks across stages and URL shapes"""
+
+    def __init__(self, seed, shapes, weights, duplicate_rate, unrendered_rate):
+        self.random = random.Random(seed)
+        self.shapes = shapes
+        self.weights = weights
+        self.duplicate_rate = duplicate_rate
+        self.unrendered_rate = unrendered_rate
+        self.last = None
+
+    def next(self):
+        """(kind, method, url, kwargs) of the next webhook request"""
+        rnd = self.random
+        if self.last is not None and rnd.random() < self.duplicate_rate:
+            # A CRM retry of the previous delivery
+            return self.last
+        hook = rnd.choices(range(1, len(STAGE_WEIGHTS) + 1), STAGE_WEIGHTS)[0]
+        value = rnd.randint(500, 250000)
+        name = rnd.choice(DEAL_NAMES).format(n=rnd.randint(1, 99999))
+        summa = rnd.choice(SUMMA_FORMATS).format(v=value, v_space=f"{value:,}".replace(',', ' '))
+        if rnd.random() < self.unrendered_rate:
+            name, summa = "{{Название}}", "{{Сумма}}"
+        shape = rnd.choices(self.shapes, self.weights)[0]
+
+        if shape == 'path':
+            request = ('GET', f"/hook{hook}/name={quote(name)}&summa={quote(summa)}", {})
+        elif shape == 'query':
+            request = ('GET', f"/hook{hook}/x?{urlencode({'name': name, 'summa': summa})}", {})
+        elif shape == 'json':
+            request = ('POST', f"/hook{hook}/x", {'json_body': {'name': name, 'summa': summa}})
+        else:
+            request = ('POST', f"/hook{hook}/x", {'data': {'name': name, 'summa': summa},
+                                                  'content_type': 'application/x-www-form-urlencoded'})
+        self.last = (f"hook_{shape}",) + request
+        return self.last
+
+
+def reader_requests(day, rnd):
+    """(kind, url) of the next dashboard or API read"""
+    hour = rnd.randint(0, 22)
+    choices = [
+        ('dashboard', f"/?date={day}"),
+        ('dashboard_window', f"/?date={day}&timeFrom={hour:02d}:00&timeTo={hour + 1:02d}:30"),
+        ('api_stats', f"/api/stats?date={day}"),
+        ('api_kpis', f"/api/kpis?date={day}"),
+        ('api_webhooks', f"/api/webhooks?date={day}&limit=100"),
+        ('api_webhooks_stage', f"/api/webhooks?date={day}&hook_type=hook{rnd.randint(1, 25)}_count&limit=50"),
+        ('api_deals', f"/api/deals/{rnd.randint(1, 25)}?date={day}"),
+    ]
+    return rnd.choice(choices)
+
+
+def paced(rate, stop, step):
+    """Call step() about rate times per second (as fast as possible for 0) until stop is set"""
+    interval = 1.0 / rate if rate > 0 else 0
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        if interval:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+        step()
+
+
+def writer_loop(transport, recorder, generator, rate, stop):
+    def step():
+        kind, method, url, kwargs = generator.next()
+        started = time.perf_counter()
+        status = transport.request(method, url, **kwargs)
+        recorder.add(kind, time.perf_counter() - started, status)
+        recorder.add('hook_all', time.perf_counter() - started, status)
+    paced(rate, stop, step)
+
+
+def reader_loop(transport, recorder, day, seed, rate, stop):
+    rnd = random.Random(seed)
+
+    def step():
+        kind, url = reader_requests(day, rnd)
+        started = time.perf_counter()
+        status = transport.request('GET', url)
+        recorder.add(kind, time.perf_counter() - started, status)
+    paced(rate, stop, step)
+
+
+def instrument(work, recorder):
+    """Time save_webhooks_batch and get_webhooks_by_filter inside the app"""
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.add(f"fn_{name}", time.perf_counter() - started, 200)
+        return wrapper
+
+    work.save_webhooks_batch = timed('save_webhooks_batch', work.save_webhooks_batch)
+    work.get_webhooks_by_filter = timed('get_webhooks_by_filter', work.get_webhooks_by_filter)
+
+
+def database_size(directory):
+    """Bytes used by webhooks.db and its WAL"""
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for name in ('webhooks.db', 'webhooks.db-wal')
+        if os.path.exists(os.path.join(directory, name))
+    )
+
+
+def print_report(results, previous=None):
+    print(f"{'kind':<28} {'count':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+          + ("  p95 vs prev" if previous else ""))
+    for kind, row in sorted(results['requests'].items()):
+        line = (f"{kind:<28} {row['count']:>7} {row['errors']:>5} {row['throughput_rps'] or 0:>8.1f} "
+                f"{row['p50_ms'] or 0:>9.2f} {row['p95_ms'] or 0:>9.2f} {row['p99_ms'] or 0:>9.2f}")
+        old = (previous or {}).get('requests', {}).get(kind)
+        if old and old.get('p95_ms') and row['p95_ms']:
+            line += f"  {row['p95_ms'] / old['p95_ms']:>6.2f}x"
+        print(line)
+    if results.get('lock_waits'):
+        print("lock waits:", ", ".join(f"{key}={value}" for key, value in results['lock_waits'].items()))
+    if results.get('database'):
+        print("database:", ", ".join(f"{key}={value}" for key, value in results['database'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10, help="seconds of traffic")
+    parser.add_argument('--rate', type=float, default=100, help="webhooks per second over all writers (0: unthrottled)")
+    parser.add_argument('--writers', type=int, default=4, help="webhook sender threads")
+    parser.add_argument('--readers', type=int, default=2, help="dashboard/API reader threads")
+    parser.add_argument('--reader-rate', type=float, default=5, help="reads per second per reader (0: unthrottled)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('path=60,query=15,json=15,form=10'),
+                        help="URL shape weights, e.g. path=60,query=15,json=15,form=10")
+    parser.add_argument('--duplicates', type=float, default=0.02, help="share of webhooks resent as retries")
+    parser.add_argument('--unrendered', type=float, default=0.01, help="share of webhooks with {{...}} placeholders")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for reproducible traffic")
+    parser.add_argument('--async-ingest', action='store_true', help="run with WEBHOOK_ASYNC_INGEST=1 (test client only)")
+    parser.add_argument('--url', help="base URL of a running server instead of the in-process app")
+    parser.add_argument('--workdir', help="directory for the in-process database (default: a new temp dir)")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="previous results JSON to compare p95 latencies with")
+    args = parser.parse_args()
+    # The in-process run changes into its work directory
+    output = os.path.abspath(args.output) if args.output else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+
+    recorder = Recorder()
+    work = None
+    workdir = None
+    if args.url:
+        transport = HttpTransport(args.url)
+        day = transport.processing_day()
+    else:
+        # work.py keeps webhooks.db in the working directory and reads its
+        # settings at import time
+        workdir = args.workdir or tempfile.mkdtemp(prefix='webhook-load-')
+        os.chdir(workdir)
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ['LOG_FILE'] = ''
+        os.environ['WEBHOOK_SPOOL_DIR'] = os.path.join(workdir, 'spool')
+        os.environ['WEBHOOK_ASYNC_INGEST'] = '1' if args.async_ingest else '0'
+        sys.path.insert(0, ROOT)
+        import work
+        app = work.create_app()
+        instrument(work, recorder)
+        transport = TestClientTransport(app)
+        day = work.to_day_key(work.get_processing_date())
+
+    size_before = database_size(workdir) if workdir else None
+    waits_before = work.db_pool.info() if work else None
+
+    stop = threading.Event()
+    shapes, weights = args.mix
+    per_writer = args.rate / args.writers if args.rate else 0
+    threads = [
+        threading.Thread(target=writer_loop, daemon=True, args=(
+            transport, recorder,
+            TrafficGenerator(args.seed * 1000 + i, shapes, weights, args.duplicates, args.unrendered),
+            per_writer, stop))
+        for i in range(args.writers)
+    ] + [
+        threading.Thread(target=reader_loop, daemon=True, args=(
+            transport, recorder, day, args.seed * 1000 + 500 + i, args.reader_rate, stop))
+        for i in range(args.readers)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stored = None
+    if work:
+        if args.async_ingest:
+            # Let the background writer drain before measuring the database
+            deadline = time.time() + 30
+            while work.webhook_spool.info().get('backlog', 0) and time.time() < deadline:
+                time.sleep(0.1)
+        stored = work.db_pool.reader().execute("SELECT COUNT(*) FROM webhooks").fetchone()[0]
+
+    results = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('mix', 'compare', 'output')},
+        'mix': dict(zip(shapes, weights)),
+        'elapsed_seconds': round(elapsed, 3),
+        'requests': {
+            kind: dict(summarize(values, recorder.errors[kind], elapsed),
+                       statuses={str(status): count for status, count in recorder.statuses[kind].items()})
+            for kind, values in recorder.latencies.items()
+        },
+    }
+    if work:
+        waits_after = work.db_pool.info()
+        results['lock_waits'] = {key: round(waits_after[key] - waits_before[key], 6) for key in waits_after}
+        size_after = database_size(workdir)
+        results['database'] = {
+            'webhooks_stored': stored,
+            'bytes_before': size_before,
+            'bytes_after': size_after,
+            'bytes_per_webhook': round((size_after - size_before) / stored, 1) if stored else None,
+        }
+
+    previous = None
+    if compare:
+        with open(compare) as f:
+            previous = json.load(f)
+    print_report(results, previous)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
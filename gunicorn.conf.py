@@ -0,0 +1,19 @@
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+worker_class = 'gthread'
+
+# Every open /api/stream dashboard holds a thread; keep half for requests
+os.environ.setdefault('STREAM_MAX_CLIENTS', str(max(1, threads // 2)))
+
+# Import the app (and run init_db/migrations) once in the master, then fork
+preload_app = True
+
+if workers > 1:
+    # Workers share the database, so their stats caches validate against
+    # day_versions, and they log to stderr instead of one rotating file
+    os.environ.setdefault('WEBHOOK_MULTI_PROCESS', '1')
+    os.environ.setdefault('LOG_FILE', '')
@@ -0,0 +1,193 @@
+"""
+Parser for /hook<N>/... webhook requests.
+
+Bitrix robots call URLs built from a template such as
+
+    /hook7/name={{Название}}&summa={{Сумма}}
+
+so the payload can arrive in the path, in the query string, or (for other
+senders) as a JSON or form body. parse_hook_request resolves it in one pass
+from the raw request parts and returns a HookEvent. It has no Flask
+dependency, so it can be benchmarked on its own (benchmarks/bench_hook_parser.py).
+"""
+import json
+import re
+from dataclasses import dataclass
+from urllib.parse import unquote_to_bytes
+
+from payload_codec import canonical_json
+
+# Fields the handler reads from a payload
+HOOK_FIELDS = ('name', 'summa')
+
+# Bitrix leaves {{Field}} as is when the robot template is not rendered
+PLACEHOLDER_RE = re.compile(r'\{\{.*?\}\}')
+
+# Percent-encoded '&', '=' and '/', which split pairs once decoded
+ENCODED_SEPARATOR_RE = re.compile(r'%(?:26|3[dD]|2[fF])')
+
+SOURCE_QUERY = 'query'
+SOURCE_PATH = 'path'
+SOURCE_JSON = 'json'
+SOURCE_FORM = 'form'
+SOURCE_EMPTY = 'empty'
+
+
+class HookParseError(ValueError):
+    """The request body could not be decoded"""
+
+
+@dataclass(slots=True)
+class HookEvent:
+    """A parsed webhook: where it came from, name/summa and every parameter sent"""
+    hook_num: int
+    name: str
+    summa: str
+    source: str
+    params: dict
+    # Fields that still contained an unrendered {{...}} placeholder
+    placeholders: tuple = ()
+
+    @property
+    def raw_data(self):
+        """Parameters as the canonical JSON stored in webhook_payloads"""
+        return canonical_json(self.params)
+
+    @property
+    def unrendered(self):
+        return bool(self.placeholders)
+
+
+def decode_bytes(data):
+    """
+    Text of raw request bytes. UTF-8 is expected; senders that encode
+    Cyrillic as Windows-1251 are decoded as such instead of producing
+    replacement characters.
+    """
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1251', errors='replace')
+
+
+def wsgi_text(value):
+    """
+    A WSGI environ string (the request bytes decoded as Latin-1, per PEP
+    3333) as the text the sender meant
+    """
+    if value.isascii():
+        return value
+    try:
+        return decode_bytes(value.encode('latin-1'))
+    except UnicodeEncodeError:
+        # Already proper text
+        return value
+
+
+def decode_component(value, plus=False):
+    """Percent-decode a URL component, with the charset handling of decode_bytes"""
+    if '%' not in value and not (plus and '+' in value):
+        return value
+    if plus:
+        value = value.replace('+', ' ')
+    return decode_bytes(unquote_to_bytes(value))
+
+
+def parse_pairs(text, plus=False, decode=True):
+    """key=value pairs separated by '&'; pairs without '=' are ignored"""
+    params = {}
+    for pair in text.split('&'):
+        key, sep, value = pair.partition('=')
+        if not sep:
+            continue
+        if decode:
+            key, value = decode_component(key, plus), decode_component(value, plus)
+        # The first occurrence wins, as with request.args.get
+        params.setdefault(key, value)
+    return params
+
+
+def path_params(path, raw_uri=None):
+    """
+    Parameters from the last segment of the hook path. The server has
+    already percent-decoded path, which is only ambiguous when a deal name
+    contained an encoded '&', '=' or '/', or was not UTF-8; then the
+    still-encoded RAW_URI/REQUEST_URI segment is split and decoded instead.
+    """
+    if raw_uri:
+        segment = raw_uri.partition('?')[0].rpartition('/')[2]
+        if '\ufffd' in path or ('%' in segment and ENCODED_SEPARATOR_RE.search(segment)):
+            return parse_pairs(wsgi_text(segment))
+    return parse_pairs(path.rpartition('/')[2], decode=False)
+
+
+def placeholder_fields(name, summa):
+    """Names of the name/summa fields that still hold an unrendered {{...}} placeholder"""
+    if '{{' not in name and '{{' not in summa:
+        return ()
+    return tuple(field for field, value in zip(HOOK_FIELDS, (name, summa)) if PLACEHOLDER_RE.search(value))
+
+
+def field_text(value):
+    """name/summa as text: numbers from JSON bodies become strings"""
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value if isinstance(value, str) else str(value)
+
+
+def parse_hook_request(hook_num, path, query_string='', raw_uri=None, method='GET',
+                       content_type='', body=b'', form=None):
+    """
+    Resolve a webhook payload with the precedence the handler always had:
+    query string, then path parameters, then (POST only) a JSON or form
+    body, each used only when the previous sources gave neither name nor
+    summa. query_string may be the raw bytes (or a WSGI Latin-1 string)
+    and is decoded like a percent-encoded component. form is an already
+    parsed multipart form, if any; other body types carry no payload.
+    Raises HookParseError for a malformed JSON body.
+    """
+    params = {}
+    source = SOURCE_EMPTY
+    if query_string:
+        if isinstance(query_string, bytes):
+            query_string = decode_bytes(query_string)
+        else:
+            query_string = wsgi_text(query_string)
+        params = parse_pairs(query_string, plus=True)
+        source = SOURCE_QUERY
+
+    if not params.get('name') and not params.get('summa') and path:
+        params = path_params(path, raw_uri)
+        source = SOURCE_PATH
+
+    if not params.get('name') and not params.get('summa') and method == 'POST':
+        mimetype = content_type.partition(';')[0].strip().lower()
+        if mimetype == 'application/json' or mimetype.endswith('+json'):
+            try:
+                params = json.loads(body) if body else {}
+            except ValueError as e:
+                raise HookParseError(f"Invalid JSON body: {e}")
+            if not isinstance(params, dict):
+                raise HookParseError("JSON body must be an object")
+            source = SOURCE_JSON
+        elif mimetype == 'application/x-www-form-urlencoded':
+            if isinstance(body, bytes):
+                body = body.decode('utf-8', errors='replace')
+            params = parse_pairs(body, plus=True)
+            source = SOURCE_FORM
+        elif form is not None:
+            params = dict(form)
+            source = SOURCE_FORM
+        else:
+            params = {}
+            source = SOURCE_EMPTY
+
+    name = params.get('name', '')
+    summa = params.get('summa', '')
+    if type(name) is not str:
+        name = field_text(name)
+    if type(summa) is not str:
+        summa = field_text(summa)
+    return HookEvent(hook_num, name, summa, source, params, placeholder_fields(name, summa))
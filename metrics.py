@@ -0,0 +1,245 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Counters and histograms are recorded into a per-thread shard, so the
+request path never takes a lock or contends on shared state: each thread
+only ever writes its own dicts. A scrape walks all shards and adds them up.
+When a thread exits its shard is folded into a shared shard of retired
+totals, so short-lived threads do not accumulate shards.
+Gauges are callbacks evaluated at scrape time.
+
+Values are per process; with several gunicorn workers each one reports its
+own series.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+
+# Default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value) if not value.is_integer() else str(int(value))
+    return str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally labelled: counter.inc('7', 'processed')"""
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def inc(self, *label_values, amount=1):
+        values = self.registry._shard().counters.setdefault(self, {})
+        values[label_values] = values.get(label_values, 0) + amount
+
+    def render(self, shards):
+        totals = {}
+        # dict.copy() is atomic, so a shard's owner can keep writing meanwhile
+        for shard in shards:
+            for label_values, value in shard.counters.get(self, {}).copy().items():
+                totals[label_values] = totals.get(label_values, 0) + value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(totals.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram: histogram.observe(seconds, 'commit')"""
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        series = self.registry._shard().histograms.setdefault(self, {})
+        state = series.get(label_values)
+        if state is None:
+            # Per-bucket counts (the last one is +Inf), then sum
+            state = series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, label_values)
+
+    def render(self, shards):
+        totals = {}
+        for shard in shards:
+            for label_values, state in shard.histograms.get(self, {}).copy().items():
+                total = totals.get(label_values)
+                if total is None:
+                    totals[label_values] = list(state)
+                else:
+                    for i, value in enumerate(state):
+                        total[i] += value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.started, *self.label_values)
+
+
+class Gauge:
+    """
+    Value read at scrape time from a callback returning a number, or a list
+    of (label_values, number) pairs for a labelled gauge
+    """
+
+    def __init__(self, registry, name, documentation, callback, labels=(), kind='gauge'):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.label_names = tuple(labels)
+        self.kind = kind
+
+    def render(self, shards):
+        value = self.callback()
+        series = value if self.label_names else [((), value)]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, number in series:
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(number)}")
+        return lines
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def merged(self, other):
+        """A new shard holding the values of both"""
+        shard = _Shard()
+        for source in (self, other):
+            for metric, values in source.counters.items():
+                totals = shard.counters.setdefault(metric, {})
+                for label_values, value in values.items():
+                    totals[label_values] = totals.get(label_values, 0) + value
+            for metric, series in source.histograms.items():
+                totals = shard.histograms.setdefault(metric, {})
+                for label_values, state in series.items():
+                    total = totals.get(label_values)
+                    if total is None:
+                        totals[label_values] = list(state)
+                    else:
+                        for i, value in enumerate(state):
+                            total[i] += value
+        return shard
+
+
+class _ShardOwner:
+    """Thread-local holder of a shard; collected when its thread exits"""
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class MetricsRegistry:
+    """Metric definitions plus the per-thread shards holding their values"""
+
+    def __init__(self):
+        self._metrics = []
+        # The first shard holds the totals of threads that have exited
+        self._shards = [_Shard()]
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _shard(self):
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            # Once per thread; recording afterwards is lock-free
+            owner = self._local.owner = _ShardOwner(_Shard())
+            weakref.finalize(owner, self._retire, owner.shard).atexit = False
+            with self._shards_lock:
+                self._shards.append(owner.shard)
+        return owner.shard
+
+    def _retire(self, shard):
+        """Fold the shard of an exited thread into the retired totals"""
+        with self._shards_lock:
+            if not any(existing is shard for existing in self._shards[1:]):
+                # Recorded before a fork
+                return
+            # A new retired shard replaces the old one and the thread's shard
+            # in one step, so a scrape never counts the values twice
+            retired = self._shards[0].merged(shard)
+            self._shards = [retired] + [existing for existing in self._shards[1:] if existing is not shard]
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, callback, labels=(), kind='gauge'):
+        """kind='counter' exposes a callback-read monotonic value (e.g. cache hits)"""
+        return self._add(Gauge(self, name, documentation, callback, labels, kind))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(shards))
+        return '\n'.join(lines) + '\n'
+
+    def reset_after_fork(self):
+        """Start a forked child with no recorded values"""
+        self._shards = [_Shard()]
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
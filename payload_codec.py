@@ -0,0 +1,100 @@
+"""
+Storage format of raw webhook payloads (the webhook_payloads table).
+
+Payloads are kept as canonical JSON (sorted keys, no whitespace, UTF-8),
+compressed with raw DEFLATE primed with a preset dictionary. They are a few
+dozen bytes each and nearly identical across the 25 hooks: on its own
+DEFLATE has nothing to refer back to in a payload that short, while the
+dictionary supplies the keys, the quoting and the usual deal-name words.
+
+A stored payload is one format byte followed by the data:
+
+    0x00  UTF-8 text, for payloads compression does not shrink
+    0x01  raw DEFLATE primed with DICTIONARIES[1]
+
+A new dictionary gets a new format byte, so rows written with an older one
+stay readable. There is no Flask dependency, so the codec can be
+benchmarked on its own (benchmarks/bench_payload_codec.py).
+"""
+import ast
+import json
+import zlib
+from json.encoder import encode_basestring
+
+FORMAT_TEXT = 0
+FORMAT_DEFLATE_V1 = 1
+
+# Preset dictionaries by format byte. DEFLATE finds nearer matches with
+# shorter codes, so the most common strings come last.
+DICTIONARIES = {
+    FORMAT_DEFLATE_V1: ''.join((
+        '"ts":"2026-01-01T00:00:00+03:00","hook":1,"idempotency_key":"',
+        'Оптовая закупка Разовая поставка Клиент Петров, заказ ИП Иванов & партнёры Сделка с ООО «Ромашка» ',
+        ' ₽,00.00_000 000',
+        '{"name":"Заказ №',
+        '","summa":"',
+        '"}',
+    )).encode('utf-8'),
+}
+
+# wbits for raw DEFLATE: no zlib header or checksum, which would cost six
+# bytes on every payload. Payloads are compressed with a 1 KiB window
+# (enough for the dictionary and a typical payload) and the smallest hash
+# tables: setting up full-size state costs several times the compression
+# itself. Decoding accepts any window size.
+_ENCODE_WBITS = -10
+_ENCODE_MEM_LEVEL = 1
+_DECODE_WBITS = -15
+
+
+_CANONICAL_ENCODER = json.JSONEncoder(ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def canonical_json(params):
+    """A payload as canonical JSON: sorted keys, no whitespace, Cyrillic unescaped"""
+    try:
+        # Fast path for the usual flat dict of strings
+        return '{' + ','.join([encode_basestring(key) + ':' + encode_basestring(params[key])
+                               for key in sorted(params)]) + '}'
+    except TypeError:
+        return _CANONICAL_ENCODER.encode(params)
+
+
+def legacy_payload(text):
+    """
+    Canonical JSON of a raw_data value stored before payloads were JSON
+    (the str() of the parameter dict); text that is not a dict repr is kept
+    as is
+    """
+    try:
+        params = ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return text
+    return canonical_json(params) if isinstance(params, dict) else text
+
+
+def encode_payload(text, fmt=FORMAT_DEFLATE_V1):
+    """Stored form (bytes) of a payload's text"""
+    data = text.encode('utf-8')
+    compressor = zlib.compressobj(9, zlib.DEFLATED, _ENCODE_WBITS, _ENCODE_MEM_LEVEL, zdict=DICTIONARIES[fmt])
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) < len(data):
+        return bytes((fmt,)) + compressed
+    return bytes((FORMAT_TEXT,)) + data
+
+
+def decode_payload(value):
+    """
+    Payload text of a stored value. Text values (raw_data written before
+    payloads were compressed) and None pass through unchanged.
+    Raises ValueError for an unknown format byte.
+    """
+    if not isinstance(value, bytes):
+        return value
+    fmt, data = value[0], value[1:]
+    if fmt == FORMAT_TEXT:
+        return data.decode('utf-8')
+    if fmt not in DICTIONARIES:
+        raise ValueError(f"Unknown payload format {fmt}")
+    decompressor = zlib.decompressobj(_DECODE_WBITS, zdict=DICTIONARIES[fmt])
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
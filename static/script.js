@@ -18,41 +18,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const backToStatsBtn = document.getElementById('backToStats');
     const totalSumEl = document.getElementById('totalSum');
     const totalHooksEl = document.getElementById('totalHooks');
-    const confirmedSumEl = document.getElementById('confirmedSum'); // Новый элемент для суммы подтвержденных заказов
     const statsHeaderEl = document.querySelector('.stats-header h2');
     
-    // Добавляем элементы для вывода процентов
+    // Карточки KPI создаются по ответу /api/stats (определения из kpis.json)
     const statsContainer = document.querySelector('.stats-summary');
-    
-    // Создаем и добавляем элементы для процентов отмен
-    const cancelPercentItem = document.createElement('div');
-    cancelPercentItem.className = 'summary-item';
-    cancelPercentItem.innerHTML = `
-        <div class="summary-title">% отмен</div>
-        <div class="summary-value" id="cancelPercent">0%</div>
-        <div class="summary-formula">=(п.14+п.19+п.23)/п.7×100%</div>
-    `;
-    statsContainer.appendChild(cancelPercentItem);
-    
-    // Создаем и добавляем элементы для процентов недозвонов
-    const missedPercentItem = document.createElement('div');
-    missedPercentItem.className = 'summary-item';
-    missedPercentItem.innerHTML = `
-        <div class="summary-title">% недозвонов</div>
-        <div class="summary-value" id="missedPercent">0%</div>
-        <div class="summary-formula">=(п.15+п.20+п.24)/п.7×100%</div>
-    `;
-    statsContainer.appendChild(missedPercentItem);
-    
-    // Создаем и добавляем элемент для отображения суммы подтвержденных заказов
-    const confirmedSumItem = document.createElement('div');
-    confirmedSumItem.className = 'summary-item';
-    confirmedSumItem.innerHTML = `
-        <div class="summary-title">Сумма подтв. заказов</div>
-        <div class="summary-value" id="confirmedSum">0 ₽</div>
-        <div class="summary-formula">=п.13+п.18+п.22</div>
-    `;
-    statsContainer.appendChild(confirmedSumItem);
+    const kpiItems = {};
     
     // Массив с названиями месяцев
     const months = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь'];
@@ -208,11 +178,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 updateStatisticsHeader(currentDate);
                 
                 // Загружаем данные для выбранной даты
-                const formattedDate = formatDate(currentDate);
-                
-                // Добавляем случайный параметр для предотвращения кэширования
-                const cacheBuster = `&_=${Date.now()}`;
-                loadStats(formattedDate + cacheBuster);
+                loadStats(formatDate(currentDate));
                 
                 // Скрываем контейнер со сделками и показываем статистику
                 dealsContainerEl.style.display = 'none';
@@ -227,24 +193,11 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Функция для загрузки статистики
+    // Ответы кэшируются браузером и перепроверяются по ETag
     function loadStats(date) {
         console.log('Loading stats for date:', date);
         
-        // Очистка cache buster если он есть
-        const cleanDate = date.split('&')[0];
-        
-        // Для отладки
-        console.log(`Requesting stats for: ${cleanDate}, AJAX URL: /api/stats?date=${date}`);
-        
-        // Если данных нет в кэше, загружаем с сервера
-        fetch(`/api/stats?date=${date}`, {
-            method: 'GET',
-            headers: {
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0'
-            }
-        })
+        fetch(`/api/stats?date=${date}`)
         .then(response => {
             console.log('Response status:', response.status);
             if (!response.ok) {
@@ -256,12 +209,12 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log('Received data:', data);
             
             // Отображаем данные
-            displayStats(data, cleanDate);
+            displayStats(data, date);
         })
         .catch(error => {
             console.error('Ошибка при загрузке статистики:', error);
             // Отображаем пустые данные при ошибке
-            displayStats([], cleanDate);
+            displayStats({ stages: [], kpis: [] }, date);
         });
     }
     
@@ -282,44 +235,30 @@ document.addEventListener('DOMContentLoaded', function() {
         // Расчет итоговых значений
         let totalHooks = 0;
         let totalSum = 0;
-        let confirmedSum = 0; // Сумма подтвержденных заказов
         
-        // Создаем объект для хранения данных по стадиям
-        const stagesData = {};
-        
-        // Заполняем объект стадий начальными нулевыми значениями
-        stagesOrder.forEach(stage => {
-            stagesData[stage] = { count: 0, total_summa: 0 };
-        });
+        // Данные по стадиям по номеру (п.1 - индекс 0)
+        const stagesData = stagesOrder.map(stage => ({ name: stage, count: 0, total_summa: 0 }));
         
         // Заполняем данными из API
-        if (Array.isArray(data)) {
-            data.forEach(stage => {
-                if (stage && stage.stage && stagesData[stage.stage]) {
-                    stagesData[stage.stage] = {
-                        count: stage.count || 0,
-                        total_summa: stage.total_summa || 0
-                    };
-                    
-                    // Сумма для "Все сделки" становится итоговой суммой
-                    if (stage.stage === "Все сделки") {
-                        totalSum = stage.total_summa || 0;
-                    }
-                    
-                    // Суммируем только для подсчета количества вебхуков
-                    totalHooks += (stage.count || 0);
-                }
-            });
-        }
+        (data.stages || []).forEach(stage => {
+            if (stage && stagesData[stage.hook - 1]) {
+                stagesData[stage.hook - 1] = {
+                    name: stage.stage || stagesOrder[stage.hook - 1],
+                    count: stage.count || 0,
+                    total_summa: stage.total_summa || 0
+                };
+                
+                // Суммируем только для подсчета количества вебхуков
+                totalHooks += (stage.count || 0);
+            }
+        });
         
-        // Считаем сумму подтвержденных заказов
-        confirmedSum = (stagesData["Подтвердил заказ без предоплаты"].total_summa || 0) + 
-                      (stagesData["Подтвердил заказ с предоплатой"].total_summa || 0) + 
-                      (stagesData["Подтвердил заказ регион"].total_summa || 0);
+        // Сумма для "Все сделки" (п.1) становится итоговой суммой
+        totalSum = stagesData[0].total_summa;
         
         // Отображаем каждую стадию в заданном порядке
-        stagesOrder.forEach((stageName, index) => {
-            const stage = stagesData[stageName];
+        stagesData.forEach((stage, index) => {
+            const stageName = stage.name;
             const stageEl = document.createElement('div');
             stageEl.className = 'stage-item';
             stageEl.innerHTML = `
@@ -334,7 +273,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 selectedStageEl.textContent = selectedStage;
                 
                 // Загружаем сделки для выбранной стадии
-                loadDeals(selectedStage, date);
+                loadDeals(index + 1, date);
                 
                 // Скрываем статистику и показываем контейнер со сделками
                 statsContainerEl.style.display = 'none';
@@ -347,44 +286,48 @@ document.addEventListener('DOMContentLoaded', function() {
         // Обновляем итоговые значения
         totalHooksEl.textContent = totalHooks;
         totalSumEl.textContent = totalSum.toLocaleString() + ' ₽';
-        document.getElementById('confirmedSum').textContent = confirmedSum.toLocaleString() + ' ₽';
-        
-        // Расчет процентов
-        const allReadyCount = stagesData["Все готово"].count || 1; // Используем 1 для избежания деления на 0
-        
-        // Процент отмен
-        const cancelCount = (stagesData["Отменил заказ без предоплаты"].count + 
-                            stagesData["Отменил заказ с предоплатой"].count + 
-                            stagesData["Отменил заказ регион"].count);
-        const cancelPercent = (cancelCount / allReadyCount) * 100;
-        document.getElementById('cancelPercent').textContent = cancelPercent.toFixed(2) + '%';
         
-        // Процент недозвонов
-        const missedCount = (stagesData["Не взял трубку без предоплаты"].count + 
-                            stagesData["Не взял трубку с предоплатой"].count + 
-                            stagesData["Не взял трубку регион"].count);
-        const missedPercent = (missedCount / allReadyCount) * 100;
-        document.getElementById('missedPercent').textContent = missedPercent.toFixed(2) + '%';
+        // KPI считает сервер по kpis.json
+        displayKpis(data.kpis || []);
+    }
+    
+    // Форматирование значения KPI по его формату из kpis.json
+    function formatKpi(value, format) {
+        if (format === 'percent') {
+            return value + '%';
+        }
+        if (format === 'rub') {
+            return value.toLocaleString() + ' ₽';
+        }
+        return value.toLocaleString();
     }
     
-    // Функция для загрузки сделок по стадии
+    // Функция для отображения KPI; карточки создаются при первом появлении
+    function displayKpis(kpis) {
+        kpis.forEach(kpi => {
+            let item = kpiItems[kpi.name];
+            if (!item) {
+                item = document.createElement('div');
+                item.className = 'summary-item';
+                item.innerHTML = `
+                    <div class="summary-title"></div>
+                    <div class="summary-value" id="kpi-${kpi.name}"></div>
+                    <div class="summary-formula"></div>
+                `;
+                item.querySelector('.summary-title').textContent = kpi.title;
+                item.querySelector('.summary-formula').textContent = kpi.label;
+                statsContainer.appendChild(item);
+                kpiItems[kpi.name] = item;
+            }
+            item.querySelector('.summary-value').textContent = formatKpi(kpi.value, kpi.format);
+        });
+    }
+    
+    // Функция для загрузки сделок по стадии (номер п.1-п.25)
     function loadDeals(stage, date) {
         console.log(`Loading deals for stage: ${stage}, date: ${date}`);
         
-        // Очистка cache buster если он есть
-        const cleanDate = date.split('&')[0];
-        
-        // Добавляем случайный параметр для предотвращения кэширования
-        const cacheBuster = `&_=${Date.now()}`;
-        
-        fetch(`/api/deals/${encodeURIComponent(stage)}?date=${cleanDate}${cacheBuster}`, {
-            method: 'GET',
-            headers: {
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0'
-            }
-        })
+        fetch(`/api/deals/${stage}?date=${date}`)
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! Status: ${response.status}`);
@@ -411,7 +354,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     
                     // Форматируем время (теперь указываем, что это время MSK)
                     const dealTime = new Date(deal.timestamp);
-                    const formattedTime = dealTime.toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' });
+                    const formattedTime = dealTime.toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit', timeZone: 'Europe/Moscow' });
                     
                     dealEl.innerHTML = `
                         <div class="deal-name">${deal.name}</div>
@@ -452,7 +395,5 @@ document.addEventListener('DOMContentLoaded', function() {
     renderCalendar(currentDate);
     updateStatisticsHeader(currentDate);
     
-    // При инициализации добавляем случайный параметр для предотвращения кэширования
-    const cacheBuster = `&_=${Date.now()}`;
-    loadStats(formatDate(currentDate) + cacheBuster);
+    loadStats(formatDate(currentDate));
 });
\ No newline at end of file
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+# work reads its configuration at import time: keep its log file and spool
+# out of the working tree and ingest synchronous
+_scratch = tempfile.mkdtemp(prefix='webhook-tests-')
+os.environ.setdefault('LOG_FILE', '')
+os.environ['WEBHOOK_SPOOL_DIR'] = ''
+os.environ['WEBHOOK_ASYNC_INGEST'] = '0'
+os.environ['WEBHOOK_ARCHIVE_DIR'] = os.path.join(_scratch, 'archive')
+
+import work  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, migrated database in tmp_path, used by every work function"""
+    pool = work.ConnectionPool(str(tmp_path / 'webhooks.db'))
+    monkeypatch.setattr(work, 'db_pool', pool)
+    monkeypatch.setattr(work, 'DB_PATH', pool.path)
+    monkeypatch.setattr(work, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    work.stats_cache.clear()
+    work.response_cache.clear()
+    monkeypatch.setattr(work, 'recent_delivery_keys', work.RecentKeys(work.RECENT_KEYS_MAX))
+    work.init_db()
+    return pool
+
+
+@pytest.fixture
+def client(db):
+    app = work.create_app()
+    app.config['TESTING'] = True
+    return app.test_client()
@@ -0,0 +1,19 @@
+import work
+
+
+def test_stats_include_the_configured_kpis(client):
+    for hook_num, summa in ((7, '100'), (7, '200'), (14, '50'), (13, '1 500')):
+        assert client.get(f'/hook{hook_num}/name=Заказ {summa}&summa={summa}').status_code == 200
+    day = work.to_day_key(work.get_processing_date())
+
+    data = client.get(f'/api/stats?date={day}').get_json()
+
+    stages = {stage['hook']: stage for stage in data['stages']}
+    assert len(stages) == work.HOOK_COUNT
+    assert (stages[7]['count'], stages[7]['total_summa']) == (2, 300)
+    kpis = {kpi['name']: kpi for kpi in data['kpis']}
+    assert [kpi['name'] for kpi in data['kpis']] == [kpi['name'] for kpi in work.kpi_engine.kpis]
+    assert kpis['cancellation_rate']['value'] == 50.0
+    assert kpis['cancellation_rate']['format'] == 'percent'
+    assert kpis['confirmed_orders_sum']['value'] == 1500
+    assert kpis['confirmed_orders_sum']['title'] == 'Сумма подтв. заказов'
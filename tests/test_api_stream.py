@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import work
+
+
+@pytest.fixture
+def broadcaster(monkeypatch):
+    monkeypatch.setattr(work, 'STREAM_HEARTBEAT_SECONDS', 0.05)
+    broadcaster = work.StatsBroadcaster(2, 8)
+    monkeypatch.setattr(work, 'stats_broadcaster', broadcaster)
+    return broadcaster
+
+
+def open_stream(client, **args):
+    """The stream's response and a function returning its next (event, id, data), by default skipping ticks"""
+    response = client.get('/api/stream', query_string=args, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks) == b'retry: 5000\n\n'
+
+    def next_event(ticks=False):
+        while True:
+            fields = dict(line.split(': ', 1) for line in next(chunks).decode().strip().split('\n'))
+            if ticks or fields['event'] != 'tick':
+                return fields['event'], fields.get('id'), json.loads(fields['data'])
+
+    return response, next_event
+
+
+def add_webhook(client, summa='100'):
+    assert client.get(f'/hook7/name=Заказ {summa}&summa={summa}').status_code == 200
+
+
+def test_stream_starts_with_a_snapshot(client, broadcaster):
+    add_webhook(client)
+    date = work.get_processing_date()
+    response, next_event = open_stream(client)
+    try:
+        event, event_id, data = next_event()
+        assert event == 'snapshot'
+        assert (event_id, data['version'], data['date']) == ('1', 1, date)
+        assert [hook['hook'] for hook in data['hooks'] if hook['count']] == [7]
+        assert len(data['recent']) == 1
+    finally:
+        response.close()
+    assert broadcaster.info()['streams'] == 0
+
+
+def test_current_client_version_skips_the_snapshot(client, broadcaster):
+    add_webhook(client)
+    response, next_event = open_stream(client, version=1)
+    try:
+        assert next_event(ticks=True)[0] == 'tick'
+        add_webhook(client, '200')
+        event, event_id, data = next_event()
+        assert (event, event_id) == ('delta', '2')
+    finally:
+        response.close()
+
+
+def test_commits_are_sent_as_deltas(client, broadcaster):
+    response, next_event = open_stream(client)
+    try:
+        assert next_event()[0] == 'snapshot'
+        add_webhook(client, '250')
+        event, event_id, data = next_event()
+        assert (event, event_id, data['version']) == ('delta', '1', 1)
+        assert [row[4] for row in data['recent']] == ['250']
+    finally:
+        response.close()
+
+
+def test_streams_over_the_limit_are_rejected(client, broadcaster):
+    first, _ = open_stream(client)
+    second, _ = open_stream(client)
+    try:
+        response = client.get('/api/stream')
+        assert response.status_code == 503
+        assert response.get_json() == {'error': 'Too many live dashboards'}
+    finally:
+        first.close()
+        second.close()
+    assert broadcaster.info()['streams'] == 0
+
+
+def test_reset_resends_a_snapshot(client, broadcaster):
+    add_webhook(client)
+    response, next_event = open_stream(client)
+    try:
+        assert next_event()[2]['version'] == 1
+        assert client.get('/reset').status_code == 302
+        event, _, data = next_event()
+        assert event == 'snapshot'
+        assert data['recent'] == []
+    finally:
+        response.close()
@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import work
+
+DAY = '2026-03-10'
+
+
+@pytest.fixture
+def webhooks(db):
+    """Seven webhooks on DAY, two of them in the same second"""
+    noon = work.moscow_tz.localize(datetime(2026, 3, 10, 12, 0))
+    records = [
+        work.build_webhook_record('hook7_count', f"Заказ {i}", str(100 * (i + 1)),
+                                  work.canonical_json({'name': f"Заказ {i}"}),
+                                  received_at=noon + timedelta(seconds=min(i, 5)))
+        for i in range(7)
+    ]
+    assert work.save_webhooks_batch(records)
+    return records
+
+
+def get_page(client, **args):
+    return client.get('/api/webhooks', query_string=dict(date=DAY, **args))
+
+
+def test_cursor_round_trip_visits_every_row_once(client, webhooks):
+    names = []
+    response = get_page(client, limit=3)
+    while True:
+        page = response.get_json()
+        names += [item['name'] for item in page['webhooks']]
+        if page['next_cursor'] is None:
+            break
+        response = get_page(client, limit=3, cursor=page['next_cursor'])
+    # Newest first; rows sharing a ts come in descending id order
+    assert names == [f"Заказ {i}" for i in range(6, -1, -1)]
+
+
+def test_full_last_page_ends_with_an_empty_page(client, webhooks):
+    page = get_page(client, limit=7).get_json()
+    assert len(page['webhooks']) == 7 and page['next_cursor']
+    assert get_page(client, limit=7, cursor=page['next_cursor']).get_json() == {'webhooks': [], 'next_cursor': None}
+
+
+def test_fields_projection(client, webhooks):
+    page = get_page(client, fields='id,name,raw_data', limit=1).get_json()
+    assert set(page['webhooks'][0]) == {'id', 'name', 'raw_data'}
+    assert page['webhooks'][0]['raw_data'] == '{"name":"Заказ 6"}'
+    assert 'raw_data' not in get_page(client, limit=1).get_json()['webhooks'][0]
+
+
+def test_unknown_fields_are_rejected(client, webhooks):
+    response = get_page(client, fields='id,password')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Unknown fields: password'}
+
+
+@pytest.mark.parametrize('cursor', ['abc', '12', '1.2.3', '-1.5', '1.x'])
+def test_invalid_cursors_are_rejected(client, webhooks, cursor):
+    response = get_page(client, cursor=cursor)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+def test_query_errors_are_a_500(client, webhooks, monkeypatch):
+    monkeypatch.setattr(work, 'webhooks_query', lambda *args: ("SELECT * FROM missing_table", []))
+    response = get_page(client)
+    assert response.status_code == 500
+    assert 'missing_table' in response.get_json()['error']
+
+
+def test_errors_mid_stream_abort_the_body(client, webhooks, monkeypatch):
+    monkeypatch.setattr(work, 'WEBHOOKS_FETCH_SIZE', 2)
+    item = work.webhook_item
+    calls = []
+
+    def failing_item(row, fields):
+        calls.append(row)
+        if len(calls) > 3:
+            raise ValueError("corrupt payload")
+        return item(row, fields)
+
+    monkeypatch.setattr(work, 'webhook_item', failing_item)
+    response = client.get('/api/webhooks', query_string={'date': DAY}, buffered=False)
+    assert response.status_code == 200
+    body = ''
+    with pytest.raises(ValueError):
+        for chunk in response.response:
+            body += chunk.decode() if isinstance(chunk, bytes) else chunk
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(body)
@@ -0,0 +1,119 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import work
+
+
+@pytest.fixture(autouse=True)
+def no_pauses(monkeypatch):
+    monkeypatch.setattr(work, 'RETENTION_BATCH_PAUSE', 0)
+
+
+def add_webhooks(day, count, hook=7, start=0):
+    """count webhooks at noon of a processing day (YYYY-MM-DD); returns their day key"""
+    noon = work.moscow_tz.localize(datetime.fromisoformat(day).replace(hour=12))
+    records = [
+        work.build_webhook_record(f"hook{hook}_count", f"Заказ {start + i}", str(100 * (start + i + 1)),
+                                  work.canonical_json({'name': f"Заказ {start + i}", 'n': start + i}),
+                                  received_at=noon + timedelta(seconds=start + i))
+        for i in range(count)
+    ]
+    assert work.save_webhooks_batch(records)
+    return records[0]['processing_day']
+
+
+def main_rows(db, day):
+    return db.reader().execute("SELECT COUNT(*) FROM webhooks WHERE processing_day = ?", (day,)).fetchone()[0]
+
+
+def api_page(client, day, **args):
+    query = '&'.join(f"{key}={value}" for key, value in dict(date=day, **args).items())
+    return client.get(f'/api/webhooks?{query}').get_json()
+
+
+def test_archiving_a_day_keeps_it_readable(client, db):
+    day = add_webhooks('2026-03-10', 5)
+    add_webhooks('2026-03-11', 2)
+    before = api_page(client, day, fields='id,name,summa,raw_data')
+    deals_before = client.get(f'/api/deals/7?date={day}').get_json()
+
+    assert work.archive_day(day, batch_rows=2) == 5
+
+    assert main_rows(db, day) == 0
+    assert main_rows(db, '2026-03-11') == 2
+    assert db.reader().execute("SELECT COUNT(*) FROM webhook_payloads").fetchone()[0] == 2
+    assert os.path.exists(work.archive_path('2026-03'))
+    assert tuple(work.archived_day(day)) == ('2026-03', max(item['id'] for item in before['webhooks']))
+    assert api_page(client, day, fields='id,name,summa,raw_data') == before
+    # Deals are cached per day version; the archived rows must come back the same
+    work.response_cache.clear()
+    assert client.get(f'/api/deals/7?date={day}').get_json() == deals_before
+    webhook_id = before['webhooks'][0]['id']
+    item = client.get(f'/api/webhooks/{webhook_id}').get_json()['webhook']
+    assert (item['name'], item['raw_data']) == ('Заказ 4', '{"n":4,"name":"Заказ 4"}')
+    # Counters never move
+    assert work.get_stats_for_date(day)['hook7_count'] == 5
+
+
+def test_late_rows_are_merged_in_and_rearchived(client, db):
+    day = add_webhooks('2026-03-10', 3)
+    work.archive_day(day)
+    _, max_id = work.archived_day(day)
+    add_webhooks('2026-03-10', 2, start=3)
+    add_webhooks('2026-03-12', 1)
+
+    page = api_page(client, day, fields='id,name')
+    assert [item['name'] for item in page['webhooks']] == ['Заказ 4', 'Заказ 3', 'Заказ 2', 'Заказ 1', 'Заказ 0']
+    assert sum(item['id'] > max_id for item in page['webhooks']) == 2
+
+    # Re-archiving moves the late rows and is harmless for the rest
+    assert work.archive_day(day) == 2
+    assert main_rows(db, day) == 0
+    assert work.archived_day(day)[1] > max_id
+    assert api_page(client, day, fields='id,name') == page
+    assert work.archive_day(day) == 0
+
+
+def test_keyset_paging_over_an_archived_day(client, db):
+    day = add_webhooks('2026-03-10', 5)
+    work.archive_day(day)
+    add_webhooks('2026-03-10', 2, start=5)
+    names = []
+    page = api_page(client, day, fields='name', limit=3)
+    while True:
+        names += [item['name'] for item in page['webhooks']]
+        if not page['next_cursor']:
+            break
+        page = api_page(client, day, fields='name', limit=3, cursor=page['next_cursor'])
+    assert names == [f"Заказ {i}" for i in range(6, -1, -1)]
+
+
+def test_retention_moves_only_days_outside_the_window(client, db):
+    today = work.processing_calendar.today()
+    old = add_webhooks((today - timedelta(days=45)).isoformat(), 2)
+    older = add_webhooks((today - timedelta(days=75)).isoformat(), 1)
+    kept = add_webhooks((today - timedelta(days=29)).isoformat(), 1)
+    current = add_webhooks(today.isoformat(), 1)
+
+    assert work.run_retention(days=30) == {older: 1, old: 2}
+    assert [main_rows(db, day) for day in (old, older, kept, current)] == [0, 0, 1, 1]
+    archives = sorted(os.listdir(work.ARCHIVE_DIR))
+    assert archives == sorted({f"webhooks-{day[:7]}.db" for day in (old, older)} | {'.lock'})
+    assert work.run_retention(days=30) == {}
+
+
+def test_reset_detaches_and_deletes_archives(client, db):
+    day = add_webhooks('2026-03-10', 2)
+    work.archive_day(day)
+    api_page(client, day)
+    attached = {row[1] for row in db.reader().execute("PRAGMA database_list")}
+    assert work.archive_alias('2026-03') in attached
+
+    assert client.get('/reset').status_code == 302
+
+    attached = {row[1] for row in db.reader().execute("PRAGMA database_list")}
+    assert work.archive_alias('2026-03') not in attached
+    assert not os.path.exists(work.archive_path('2026-03'))
+    assert api_page(client, day)['webhooks'] == []
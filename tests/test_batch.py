@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+import work
+
+
+def post_batch(client, items):
+    return client.post('/hooks/batch', data=json.dumps(items))
+
+
+def stored_rows(db):
+    return [tuple(row) for row in db.reader().execute("SELECT name, summa, amount_int FROM webhooks ORDER BY id")]
+
+
+def test_batch_placeholders_are_blanked(client, db):
+    response = post_batch(client, [
+        {'hook': 7, 'name': '{{Название}}', 'summa': '{{Сумма}}'},
+        {'hook': 7, 'name': 'Заказ 1', 'summa': '{{Сумма}}'},
+        {'hook': 7, 'name': 'Заказ 2', 'summa': '500'},
+    ])
+    assert response.get_json() == {'status': 'processed', 'count': 3, 'duplicates': 0, 'unrendered': 2}
+    assert stored_rows(db) == [('', '', 0), ('Заказ 1', '', 0), ('Заказ 2', '500', 500)]
+    # The payload keeps what was sent
+    item = client.get('/api/webhooks/1').get_json()['webhook']
+    assert json.loads(item['raw_data'])['name'] == '{{Название}}'
+
+
+def test_batch_placeholders_rejected(client, db, monkeypatch):
+    monkeypatch.setattr(work, 'PLACEHOLDER_POLICY', 'reject')
+    response = post_batch(client, [
+        {'hook': 7, 'name': 'Заказ 2', 'summa': '500'},
+        {'hook': 7, 'name': '{{Название}}', 'summa': '500'},
+    ])
+    assert response.status_code == 400
+    assert response.get_json()['records'] == [{'index': 1, 'error': 'Unrendered template placeholders: name'}]
+    assert stored_rows(db) == []
+
+
+@pytest.mark.parametrize('body', [
+    b'[{"hook": 7, "name": "A"}, {"hook": 8, "name": "B"}]',
+    b'{"hook": 7, "name": "A"}\n\n{"hook": 8, "name": "B"}\n',
+])
+def test_parse_batch_body_reads_arrays_and_ndjson(body):
+    assert [item['name'] for item in work.parse_batch_body(body)] == ['A', 'B']
+
+
+@pytest.mark.parametrize('body', [b'[{"hook": 7}', b'{"hook": 7}\nnot json', b'[{"hook": 7}] [2]', b'\xff\xfe'])
+def test_parse_batch_body_rejects_other_bodies(body):
+    with pytest.raises(ValueError):
+        work.parse_batch_body(body)
+
+
+def test_invalid_body_is_a_400(client, db):
+    response = client.post('/hooks/batch', data=b'{"hook": 7')
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid batch body: ')
+
+
+def test_batches_over_the_record_limit_are_a_413(client, db, monkeypatch):
+    monkeypatch.setattr(work, 'BATCH_INGEST_MAX_RECORDS', 2)
+    assert post_batch(client, [{'hook': 7, 'name': 'A', 'summa': '1'}] * 2).status_code == 200
+    response = post_batch(client, [{'hook': 7, 'name': 'A', 'summa': '1'}] * 3)
+    assert response.status_code == 413
+    assert response.get_json() == {'error': 'Batch exceeds 2 records'}
+    assert len(stored_rows(db)) == 2
+
+
+@pytest.mark.parametrize('item, error', [
+    ('Заказ', 'Record must be an object'),
+    ({'name': 'A'}, 'Invalid webhook number'),
+    ({'hook': 0, 'name': 'A'}, 'Invalid webhook number'),
+    ({'hook': work.HOOK_COUNT + 1, 'name': 'A'}, 'Invalid webhook number'),
+    ({'hook': True, 'name': 'A'}, 'Invalid webhook number'),
+    ({'hook': 7, 'name': ['A']}, 'name and summa must be strings'),
+    ({'hook': 7, 'name': 'A', 'ts': 'yesterday'}, "Invalid isoformat string: 'yesterday'"),
+    ({'hook': 7, 'name': 'A', 'ts': True}, 'Invalid ts: True'),
+])
+def test_invalid_items_are_reported(client, db, item, error):
+    response = post_batch(client, [item])
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid records', 'records': [{'index': 0, 'error': error}]}
+
+
+def test_mixed_batches_store_nothing(client, db):
+    response = post_batch(client, [
+        {'hook': 7, 'name': 'Заказ 1', 'summa': '100'},
+        {'hook': 99, 'name': 'Заказ 2', 'summa': '200'},
+        {'hook': '13', 'name': 'Заказ 3', 'summa': 300},
+        {'hook': 7, 'name': None},
+    ])
+    assert response.status_code == 400
+    assert [record['index'] for record in response.get_json()['records']] == [1, 3]
+    assert stored_rows(db) == []
+
+
+def test_valid_batch_is_stored_by_event_time(client, db):
+    response = post_batch(client, [
+        {'hook': '13', 'name': 'Заказ 1', 'summa': 1500, 'ts': '2026-03-10T20:59:00'},
+        {'hook': 7, 'name': 'Заказ 2', 'summa': '200', 'ts': '2026-03-10T21:30:00+03:00'},
+    ])
+    assert response.get_json() == {'status': 'processed', 'count': 2, 'duplicates': 0, 'unrendered': 0}
+    assert stored_rows(db) == [('Заказ 1', '1500', 1500), ('Заказ 2', '200', 200)]
+    days = [row[0] for row in db.reader().execute("SELECT processing_day FROM webhooks ORDER BY id")]
+    assert days == ['2026-03-10', '2026-03-11']
@@ -0,0 +1,33 @@
+import sqlite3
+import threading
+
+
+def write_day_version(db):
+    with db.transaction() as cursor:
+        db.begin_immediate(cursor)
+        cursor.execute("INSERT OR REPLACE INTO day_versions (day, version, updated_at) VALUES ('2026-03-10', 1, 0)")
+
+
+def test_uncontended_writes_are_not_busy_waits(db):
+    for _ in range(20):
+        write_day_version(db)
+    assert db.info()['busy_waits'] == 0
+
+
+def test_lock_held_by_another_connection_is_a_busy_wait(db):
+    other = sqlite3.connect(db.path, check_same_thread=False)
+    other.isolation_level = None
+    other.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.2, other.execute, ("COMMIT",))
+    release.start()
+    try:
+        write_day_version(db)
+    finally:
+        release.join()
+        other.close()
+
+    info = db.info()
+    assert info['busy_waits'] == 1
+    assert info['busy_wait_seconds'] >= 0.1
+    # The busy timeout is back for later statements
+    assert db._writer.execute("PRAGMA busy_timeout").fetchone()[0] > 0
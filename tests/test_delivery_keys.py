@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+import work
+
+
+def stored(db):
+    return db.reader().execute("SELECT COUNT(*) FROM webhooks").fetchone()[0]
+
+
+def test_rendered_retries_are_stored_once(client, db):
+    for _ in range(2):
+        assert client.get('/hook7/name=Заказ 1&summa=500').status_code == 200
+    assert stored(db) == 1
+
+
+@pytest.mark.parametrize('path', [
+    '/hook7/name=&summa=500',
+    '/hook7/name=Заказ 1&summa=',
+    '/hook7/name={{Название}}&summa=500',
+    '/hook7/name=Заказ 1&summa={{Сумма}}',
+])
+def test_blank_or_unrendered_deliveries_are_not_deduplicated(client, db, path):
+    for _ in range(3):
+        assert client.get(path).status_code == 200
+    assert stored(db) == 3
+
+
+def test_explicit_keys_still_apply(client, db):
+    for _ in range(2):
+        client.get('/hook7/name=&summa=', headers={'Idempotency-Key': 'retry-1'})
+    assert stored(db) == 1
+
+
+def test_batch_backfills_keep_identical_rows(client, db):
+    row = {'hook': 7, 'name': 'Заказ 1', 'summa': '500', 'ts': '2026-03-10T12:00:00'}
+    response = client.post('/hooks/batch', data=json.dumps([row, row, dict(row, idempotency_key='a'),
+                                                             dict(row, idempotency_key='a')]))
+    assert response.get_json() == {'status': 'processed', 'count': 3, 'duplicates': 1, 'unrendered': 0}
+    assert stored(db) == 3
+
+
+def test_delivery_key():
+    assert work.delivery_key(7, 'Заказ 1', '500', 120) == work.delivery_key(7, 'Заказ 1', '500', 130)
+    assert work.delivery_key(7, 'Заказ 1', '500', 120) != work.delivery_key(8, 'Заказ 1', '500', 120)
+    assert work.delivery_key(7, ' ', '500', 120) is None
+    assert work.delivery_key(7, 'Заказ 1', '500', 120, derive=False) is None
+    assert work.delivery_key(7, '', '', 120, explicit='k') == 'k'
+
+
+def test_resent_deliveries_are_stored_after_a_reset(client, db):
+    assert client.get('/hook7/name=Заказ 1&summa=500').get_json() == {'status': 'processed'}
+    assert client.get('/reset').status_code == 302
+    assert stored(db) == 0
+    assert client.get('/hook7/name=Заказ 1&summa=500').get_json() == {'status': 'processed'}
+    assert stored(db) == 1
@@ -0,0 +1,59 @@
+from urllib.parse import quote
+
+import pytest
+
+from hook_parser import SOURCE_PATH, SOURCE_QUERY, parse_hook_request
+
+NAME = 'Тест'
+
+
+@pytest.mark.parametrize('query_string', [
+    f"name={NAME}&summa=5".encode('utf-8'),
+    # What WSGI servers put in QUERY_STRING for the same bytes
+    f"name={NAME}&summa=5".encode('utf-8').decode('latin-1'),
+    f"name={quote(NAME)}&summa=5",
+    f"name={quote(NAME, encoding='cp1251')}&summa=5",
+    f"name={NAME}&summa=5".encode('cp1251'),
+])
+def test_query_names_are_decoded(query_string):
+    event = parse_hook_request(7, 'x', query_string=query_string)
+    assert (event.source, event.name, event.summa) == (SOURCE_QUERY, NAME, '5')
+
+
+def test_query_plus_is_a_space():
+    event = parse_hook_request(7, 'x', query_string=b'name=%D0%A2%D0%B5%D1%81%D1%82+1&summa=1+000')
+    assert (event.name, event.summa) == ('Тест 1', '1 000')
+
+
+def test_path_with_encoded_ampersand_uses_the_raw_uri():
+    raw = f"/hook7/name={quote('Рога & Копыта')}&summa=5"
+    event = parse_hook_request(7, 'name=Рога & Копыта&summa=5', raw_uri=raw)
+    assert (event.source, event.name, event.summa) == (SOURCE_PATH, 'Рога & Копыта', '5')
+
+
+def test_path_with_raw_utf8_uri():
+    # Some servers leave RAW_URI unencoded; it arrives as Latin-1 text
+    raw = "/hook7/name=Рога %26 Копыта&summa=5".encode('utf-8').decode('latin-1')
+    event = parse_hook_request(7, 'name=Рога & Копыта&summa=5', raw_uri=raw)
+    assert event.name == 'Рога & Копыта'
+
+
+def test_placeholders_are_flagged():
+    event = parse_hook_request(7, 'name={{Название}}&summa=5')
+    assert event.placeholders == ('name',)
+    assert event.raw_data == '{"name":"{{Название}}","summa":"5"}'
+
+
+def test_json_numbers_become_text():
+    event = parse_hook_request(7, 'x', method='POST', content_type='application/json',
+                               body=b'{"name": "A", "summa": 1500}')
+    assert (event.name, event.summa) == ('A', '1500')
+    assert event.raw_data == '{"name":"A","summa":1500}'
+
+
+def test_handler_stores_raw_utf8_query(client, db):
+    # Unencoded UTF-8, as curl sends it; the test client would percent-encode it
+    query = f"name={NAME}&summa=5".encode('utf-8').decode('latin-1')
+    response = client.get('/hook7/x', environ_overrides={'QUERY_STRING': query})
+    assert response.status_code == 200
+    assert [tuple(row) for row in db.reader().execute("SELECT name, summa FROM webhooks")] == [(NAME, '5')]
@@ -0,0 +1,58 @@
+import work
+
+
+def add_webhook(client, summa='100'):
+    assert client.get(f'/hook7/name=Заказ {summa}&summa={summa}').status_code == 200
+
+
+def test_unchanged_day_answers_304(client):
+    add_webhook(client)
+    day = work.to_day_key(work.get_processing_date())
+    first = client.get(f'/api/stats?date={day}')
+    assert first.status_code == 200 and first.headers['ETag']
+
+    again = client.get(f'/api/stats?date={day}', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_write_to_the_day_changes_the_etag(client):
+    add_webhook(client)
+    day = work.to_day_key(work.get_processing_date())
+    etag = client.get(f'/api/stats?date={day}').headers['ETag']
+
+    add_webhook(client, '200')
+    response = client.get(f'/api/stats?date={day}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_each_filter_gets_its_own_etag(client):
+    add_webhook(client)
+    day = work.to_day_key(work.get_processing_date())
+    etag = client.get(f'/api/webhooks?date={day}').headers['ETag']
+    response = client.get(f'/api/webhooks?date={day}&timeFrom=09:00&timeTo=10:00', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_undated_webhooks_etag_follows_the_processing_day(client, monkeypatch):
+    add_webhook(client)
+    monkeypatch.setattr(work, 'get_processing_date', lambda: '2026-03-10')
+    etag = client.get('/api/webhooks?timeFrom=09:00&timeTo=10:00').headers['ETag']
+    assert client.get('/api/webhooks?timeFrom=09:00&timeTo=10:00',
+                      headers={'If-None-Match': etag}).status_code == 304
+
+    # Rolling over to the next day re-scopes the filter without any write
+    monkeypatch.setattr(work, 'get_processing_date', lambda: '2026-03-11')
+    response = client.get('/api/webhooks?timeFrom=09:00&timeTo=10:00', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_dashboard_page_is_not_revalidated(client):
+    # It also renders the queue size and the current time
+    add_webhook(client)
+    response = client.get('/', headers={'If-None-Match': '*'})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import work
+
+EVENTS = [
+    ('2026-02-27', 7, '100'), ('2026-02-27', 7, '200'), ('2026-02-27', 14, '50'),
+    ('2026-03-01', 7, '300'), ('2026-03-01', 13, '1500'),
+    ('2026-03-02', 7, '100'), ('2026-03-02', 7, '100'), ('2026-03-02', 14, '70'),
+    ('2026-03-09', 13, '500'),
+]
+
+
+@pytest.fixture
+def history(client):
+    items = [{'hook': hook, 'name': f"Заказ {i}", 'summa': summa, 'ts': f"{day}T12:00:00"}
+             for i, (day, hook, summa) in enumerate(EVENTS)]
+    assert client.post('/hooks/batch', data=json.dumps(items)).status_code == 200
+
+
+def kpi_range(client, first, last, granularity=None):
+    args = {'from': first, 'to': last}
+    if granularity:
+        args['granularity'] = granularity
+    return client.get('/api/kpis/range', query_string=args)
+
+
+def test_days_outside_the_range_are_left_out(client, history):
+    data = kpi_range(client, '2026-03-01', '03.03.2026').get_json()
+    assert (data['from'], data['to'], data['granularity']) == ('2026-03-01', '2026-03-03', 'day')
+    assert data['periods'] == ['2026-03-01', '2026-03-02', '2026-03-03']
+    assert data['kpis']['cancellation_count'] == [0, 1, 0]
+    assert data['kpis']['confirmed_orders_sum'] == [1500, 0, 0]
+    assert data['kpis']['cancellation_rate'] == [0.0, 50.0, 0.0]
+
+
+def test_weeks_start_on_monday(client, history):
+    data = kpi_range(client, '2026-02-27', '2026-03-09', 'week').get_json()
+    assert data['periods'] == ['2026-02-23', '2026-03-02', '2026-03-09']
+    assert data['kpis']['cancellation_count'] == [1, 1, 0]
+    assert data['kpis']['confirmed_orders_sum'] == [1500, 0, 500]
+    # Rates are computed from the period's totals, not averaged over days
+    assert data['kpis']['cancellation_rate'] == [33.33, 50.0, 0.0]
+
+
+def test_months(client, history):
+    data = kpi_range(client, '2026-02-27', '2026-03-09', 'month').get_json()
+    assert data['periods'] == ['2026-02-01', '2026-03-01']
+    assert data['kpis']['cancellation_count'] == [1, 1]
+    assert data['kpis']['confirmed_orders_sum'] == [0, 2000]
+    assert data['kpis']['cancellation_rate'] == [50.0, 33.33]
+
+
+def test_days_match_the_stats_kpis(client, history):
+    data = kpi_range(client, '2026-02-26', '2026-03-09').get_json()
+    for i, day in enumerate(data['periods']):
+        stats = client.get(f'/api/stats?date={day}').get_json()
+        assert {kpi['name']: kpi['value'] for kpi in stats['kpis']} == {
+            name: values[i] for name, values in data['kpis'].items()
+        }, day
+
+
+@pytest.mark.parametrize('args, error', [
+    ({'from': '2026-03-09', 'to': '2026-03-01'}, 'Invalid range'),
+    ({'from': '2016-01-01', 'to': '2026-03-01'}, 'Invalid range'),
+    ({'from': '2026-03-01'}, 'from and to must be dates'),
+    ({'from': '2026-03-01', 'to': '31.02.2026'}, 'from and to must be dates'),
+    ({'from': '2026-03-01', 'to': '2026-03-09', 'granularity': 'year'}, 'granularity must be one of'),
+])
+def test_invalid_ranges_are_rejected(client, args, error):
+    response = client.get('/api/kpis/range', query_string=args)
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith(error)
+
+
+def test_longest_range_is_accepted(client):
+    last = work.date_cls(2026, 3, 1)
+    first = last - work.timedelta(days=work.KPI_RANGE_MAX_DAYS - 1)
+    data = kpi_range(client, first.isoformat(), last.isoformat(), 'month').get_json()
+    assert data['periods'][0] == first.replace(day=1).isoformat()
+    assert data['periods'][-1] == '2026-03-01'
@@ -0,0 +1,77 @@
+import gc
+import threading
+
+from metrics import MetricsRegistry
+
+
+def record_in_threads(counter, histogram, count):
+    def record():
+        counter.inc('7')
+        histogram.observe(0.002)
+
+    for _ in range(count):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+
+def test_exited_threads_fold_into_retired_totals():
+    registry = MetricsRegistry()
+    counter = registry.counter('hooks_total', 'Hooks', labels=('hook',))
+    histogram = registry.histogram('save_seconds', 'Save time', buckets=(0.001, 0.01))
+    counter.inc('7')
+
+    record_in_threads(counter, histogram, 50)
+
+    # The retired totals plus this thread's shard
+    assert len(registry._shards) == 2
+    text = registry.render()
+    assert 'hooks_total{hook="7"} 51' in text
+    assert 'save_seconds_bucket{le="0.01"} 50' in text
+    assert 'save_seconds_count 50' in text
+
+
+def test_live_threads_keep_their_shards():
+    registry = MetricsRegistry()
+    counter = registry.counter('hooks_total', 'Hooks')
+    recorded, done = threading.Event(), threading.Event()
+
+    def record():
+        counter.inc()
+        recorded.set()
+        done.wait()
+
+    thread = threading.Thread(target=record, daemon=True)
+    thread.start()
+    recorded.wait()
+    try:
+        assert len(registry._shards) == 2
+        assert 'hooks_total 1' in registry.render()
+    finally:
+        done.set()
+    thread.join()
+    gc.collect()
+    assert len(registry._shards) == 1
+    assert 'hooks_total 1' in registry.render()
+
+
+def test_reset_after_fork_ignores_old_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter('hooks_total', 'Hooks')
+    recorded, done = threading.Event(), threading.Event()
+
+    def record():
+        counter.inc()
+        recorded.set()
+        done.wait()
+
+    thread = threading.Thread(target=record, daemon=True)
+    thread.start()
+    recorded.wait()
+    registry.reset_after_fork()
+    done.set()
+    thread.join()
+    gc.collect()
+    assert 'hooks_total 0' not in registry.render()
+    assert 'hooks_total 1' not in registry.render()
@@ -0,0 +1,109 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+import pytz
+
+import work
+from payload_codec import decode_payload
+
+
+def create_baseline_db(path):
+    """The schema and data of a database written before schema versions existed"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE webhooks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hook_type TEXT NOT NULL,
+        name TEXT,
+        summa TEXT,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        received_at_moscow TEXT,
+        processing_date TEXT,
+        raw_data TEXT
+    )
+    ''')
+    columns = [f"hook{i}_count INTEGER DEFAULT 0" for i in range(1, 26)] + ["total_count INTEGER DEFAULT 0"]
+    columns += [f"hook{i}_sum INTEGER DEFAULT 0" for i in range(1, 26)] + ["total_sum INTEGER DEFAULT 0"]
+    conn.execute(f"CREATE TABLE daily_stats (date TEXT PRIMARY KEY, {', '.join(columns)})")
+    rows = [
+        ('hook1_count', 'Заказ №1', '12 500,00', '2026-03-10 10:15:00', '10.03.2026'),
+        ('hook1_count', 'Заказ №2', '1000', '2026-03-10 21:30:00', '11.03.2026'),
+        ('hook7_count', 'Заказ №1', '300_', '2026-03-10 11:00:00', '10.03.2026'),
+    ]
+    for hook_type, name, summa, moscow_time, processing_date in rows:
+        conn.execute(
+            "INSERT INTO webhooks (hook_type, name, summa, received_at_moscow, processing_date, raw_data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (hook_type, name, summa, moscow_time, processing_date, str({'name': name, 'summa': summa})))
+    conn.execute("INSERT INTO daily_stats (date, hook1_count, hook1_sum, hook7_count, hook7_sum, total_count, "
+                 "total_sum) VALUES ('10.03.2026', 1, 12500, 1, 300, 2, 12800)")
+    conn.execute("INSERT INTO daily_stats (date, hook1_count, hook1_sum, total_count, total_sum) "
+                 "VALUES ('11.03.2026', 1, 1000, 1, 1000)")
+    conn.commit()
+    conn.close()
+
+
+def migrate_baseline(tmp_path, monkeypatch):
+    """A migrated baseline database in tmp_path, used by every work function"""
+    path = str(tmp_path / 'webhooks.db')
+    create_baseline_db(path)
+    pool = work.ConnectionPool(path)
+    monkeypatch.setattr(work, 'db_pool', pool)
+    monkeypatch.setattr(work, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    work.stats_cache.clear()
+    work.init_db()
+    return pool
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    return migrate_baseline(tmp_path, monkeypatch)
+
+
+def test_baseline_migrates_to_current_schema(baseline_db):
+    conn = baseline_db.reader()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == work.SCHEMA_VERSION
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'hook_stats', 'day_versions', 'minute_rollup', 'archived_days', 'webhook_payloads'} <= tables
+    assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'daily_stats'").fetchone()[0] == 'view'
+
+
+def test_baseline_rows_get_day_keys_amounts_and_payloads(baseline_db):
+    conn = baseline_db.reader()
+    rows = conn.execute("SELECT id, processing_day, ts, amount_int, raw_data FROM webhooks ORDER BY id").fetchall()
+    moscow_ts = work.moscow_tz.localize(datetime(2026, 3, 10, 10, 15)).timestamp()
+    assert [tuple(row) for row in rows] == [
+        (1, '2026-03-10', int(moscow_ts), 12500, None),
+        (2, '2026-03-11', int(moscow_ts) + 11 * 3600 + 15 * 60, 1000, None),
+        (3, '2026-03-10', int(moscow_ts) + 45 * 60, 300, None),
+    ]
+    payloads = dict(conn.execute("SELECT webhook_id, payload FROM webhook_payloads"))
+    assert decode_payload(payloads[1]) == '{"name":"Заказ №1","summa":"12 500,00"}'
+    assert len(payloads) == 3
+
+
+def test_baseline_counters_survive(baseline_db):
+    stats = work.get_stats_for_date('10.03.2026')
+    assert (stats['hook1_count'], stats['hook1_sum'], stats['hook7_count'], stats['hook7_sum']) == (1, 12500, 1, 300)
+    assert stats['total_count'] == 2
+    assert work.get_stats_for_date('11.03.2026')['hook1_sum'] == 1000
+    # The minute rollup was built from the migrated rows
+    assert work.check_minute_rollup() == []
+    assert baseline_db.reader().execute("SELECT SUM(count) FROM minute_rollup").fetchone()[0] == 3
+
+
+def test_migrating_twice_is_a_no_op(baseline_db):
+    work.init_db()
+    conn = baseline_db.reader()
+    assert conn.execute("SELECT COUNT(*) FROM webhook_payloads").fetchone()[0] == 3
+    assert conn.execute("SELECT SUM(count) FROM hook_stats").fetchone()[0] == 3
+
+
+def test_baseline_timestamps_use_the_processing_timezone(tmp_path, monkeypatch):
+    # Berlin is UTC+1 in March, not the UTC+3 the migration used to assume
+    berlin = pytz.timezone('Europe/Berlin')
+    monkeypatch.setattr(work, 'moscow_tz', berlin)
+    conn = migrate_baseline(tmp_path, monkeypatch).reader()
+    assert conn.execute("SELECT ts FROM webhooks WHERE id = 1").fetchone()[0] == \
+        int(berlin.localize(datetime(2026, 3, 10, 10, 15)).timestamp())
@@ -0,0 +1,56 @@
+import pytest
+
+from payload_codec import (FORMAT_DEFLATE_V1, FORMAT_TEXT, canonical_json, decode_payload, encode_payload,
+                           legacy_payload)
+
+
+@pytest.mark.parametrize('params', [
+    {'name': 'Заказ №12345', 'summa': '12 500,00'},
+    {'name': 'ИП Иванов & партнёры 7', 'summa': '1 000 ₽'},
+    {'hook': 7, 'idempotency_key': 'abc', 'name': '', 'summa': '5', 'ts': '2026-10-01T12:00:00+03:00'},
+    {'name': '{{Название}}', 'summa': '{{Сумма}}', 'nested': {'a': [1, 2.5, None, True]}},
+    {},
+])
+def test_round_trip(params):
+    text = canonical_json(params)
+    assert decode_payload(encode_payload(text)) == text
+
+
+def test_typical_payloads_compress():
+    text = canonical_json({'name': 'Заказ №12345', 'summa': '12 500,00'})
+    blob = encode_payload(text)
+    assert blob[0] == FORMAT_DEFLATE_V1
+    assert len(blob) < len(text.encode('utf-8')) / 2
+
+
+def test_incompressible_payloads_are_stored_as_text():
+    text = 'x'
+    blob = encode_payload(text)
+    assert blob == bytes((FORMAT_TEXT,)) + b'x'
+    assert decode_payload(blob) == text
+
+
+def test_long_payloads_round_trip():
+    text = canonical_json({'name': 'Сделка ' * 500, 'summa': '1'})
+    assert decode_payload(encode_payload(text)) == text
+
+
+def test_canonical_json_is_key_order_independent():
+    assert canonical_json({'summa': '1', 'name': 'Я'}) == canonical_json({'name': 'Я', 'summa': '1'}) \
+        == '{"name":"Я","summa":"1"}'
+
+
+def test_text_and_missing_values_pass_through():
+    assert decode_payload(None) is None
+    assert decode_payload('legacy') == 'legacy'
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        decode_payload(b'\x7fdata')
+
+
+def test_legacy_repr_becomes_canonical_json():
+    assert legacy_payload(str({'name': 'Заказ', 'summa': '10'})) == '{"name":"Заказ","summa":"10"}'
+    assert legacy_payload('not a dict') == 'not a dict'
+    assert legacy_payload('') == ''
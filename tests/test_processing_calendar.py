@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+from datetime import date, datetime, time
+
+import pytz
+
+import work
+from tests.conftest import ROOT
+from work import ProcessingCalendar
+
+MOSCOW = pytz.timezone('Europe/Moscow')
+
+
+def moscow(*args):
+    return MOSCOW.localize(datetime(*args))
+
+
+def test_cutoff_boundary():
+    calendar = ProcessingCalendar(MOSCOW, time(21, 0))
+    assert calendar.day_for(moscow(2026, 3, 10, 20, 59, 59)) == date(2026, 3, 10)
+    assert calendar.day_for(moscow(2026, 3, 10, 21, 0, 0)) == date(2026, 3, 10)
+    assert calendar.day_for(moscow(2026, 3, 10, 21, 0, 1)) == date(2026, 3, 11)
+
+
+def test_instants_in_other_zones_use_the_calendar_zone():
+    calendar = ProcessingCalendar(MOSCOW, time(21, 0))
+    # 18:00:01 UTC is 21:00:01 in Moscow
+    assert calendar.day_for(datetime(2026, 3, 10, 18, 0, 0, tzinfo=pytz.utc)) == date(2026, 3, 10)
+    assert calendar.day_for(datetime(2026, 3, 10, 18, 0, 1, tzinfo=pytz.utc)) == date(2026, 3, 11)
+
+
+def test_year_rollover():
+    calendar = ProcessingCalendar(MOSCOW, time(21, 0))
+    assert calendar.day_for(moscow(2025, 12, 31, 20, 0)) == date(2025, 12, 31)
+    assert calendar.day_for(moscow(2025, 12, 31, 21, 30)) == date(2026, 1, 1)
+    assert calendar.day_for(moscow(2026, 1, 1, 0, 30)) == date(2026, 1, 1)
+    assert calendar.day_for(moscow(2026, 1, 1, 21, 30)) == date(2026, 1, 2)
+
+
+def test_custom_cutoff_and_timezone():
+    berlin = pytz.timezone('Europe/Berlin')
+    calendar = ProcessingCalendar(berlin, time(18, 30))
+    assert calendar.day_for(berlin.localize(datetime(2026, 7, 1, 18, 30))) == date(2026, 7, 1)
+    assert calendar.day_for(berlin.localize(datetime(2026, 7, 1, 18, 30, 1))) == date(2026, 7, 2)
+    # 19:00 in Moscow is 18:00 in Berlin (summer time)
+    assert calendar.day_for(moscow(2026, 7, 1, 19, 0)) == date(2026, 7, 1)
+    assert calendar.cutoff_instant(date(2026, 7, 1)) == berlin.localize(datetime(2026, 7, 1, 18, 30)).timestamp()
+
+
+def test_get_processing_date_formats_the_day():
+    assert work.get_processing_date(moscow(2026, 3, 10, 21, 0, 1)) == '11.03.2026'
+    assert work.to_day_key('11.03.2026') == '2026-03-11'
+
+
+class FakeClock:
+    def __init__(self, wall):
+        self.wall = wall
+        self.mono = 1000.0
+
+    def advance(self, seconds):
+        self.wall += seconds
+        self.mono += seconds
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+
+def test_today_refreshes_after_the_cutoff(monkeypatch):
+    clock = FakeClock(moscow(2026, 3, 10, 20, 59, 58).timestamp())
+    monkeypatch.setattr(work.time_module, 'time', clock.time)
+    monkeypatch.setattr(work.time_module, 'monotonic', clock.monotonic)
+    calendar = ProcessingCalendar(MOSCOW, time(21, 0))
+
+    assert calendar.today() == date(2026, 3, 10)
+    deadline = calendar._current[0]
+    clock.advance(2)  # 21:00:00, still the same day
+    assert calendar.today() == date(2026, 3, 10)
+    assert calendar._current[0] == deadline
+    clock.advance(1)  # 21:00:01
+    assert calendar.today() == date(2026, 3, 11)
+    assert calendar._current[0] > deadline
+    # The new range covers the following day's instants up to its cutoff
+    assert calendar.day_for(moscow(2026, 3, 11, 12, 0)) == date(2026, 3, 11)
+    assert calendar.day_for(moscow(2026, 3, 11, 21, 0, 1)) == date(2026, 3, 12)
+
+
+
+def test_timezone_and_cutoff_come_from_the_environment(tmp_path):
+    env = dict(os.environ, PROCESSING_TIMEZONE='Asia/Vladivostok', PROCESSING_CUTOFF='18:00',
+               PYTHONPATH=ROOT, LOG_FILE='')
+    script = (
+        "import work, pytz, datetime as d\n"
+        "tz = pytz.timezone('Asia/Vladivostok')\n"
+        "at = lambda *a: work.processing_calendar.day_for(tz.localize(d.datetime(*a))).isoformat()\n"
+        "print(work.processing_calendar.tz.zone, at(2026, 5, 1, 18, 0), at(2026, 5, 1, 18, 0, 1))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ['Asia/Vladivostok', '2026-05-01', '2026-05-02']
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import work
+
+DAY = '2026-03-10'
+
+
+@pytest.fixture
+def runner(client, db):
+    items = [{'hook': hook, 'name': f"Заказ {i}", 'summa': summa, 'ts': f"{DAY}T{at}"}
+             for i, (hook, summa, at) in enumerate([
+                 (7, '100', '11:59:59'), (7, '200', '12:00:00'), (7, '300', '12:00:59'),
+                 (13, '1500', '12:01:00'), (7, '50', '21:30:00'),
+             ])]
+    assert client.post('/hooks/batch', data=json.dumps(items)).status_code == 200
+    return client.application.test_cli_runner()
+
+
+def rollup_cells(db):
+    return [tuple(row) for row in db.reader().execute(
+        "SELECT processing_day, minute_bucket % 1440, hook_num, count, sum FROM minute_rollup "
+        "ORDER BY processing_day, minute_bucket, hook_num")]
+
+
+def test_rollup_buckets_by_minute(db, runner):
+    # Moscow is UTC+3, so 11:59 local is minute 8 * 60 + 59 of the UTC day
+    assert rollup_cells(db) == [
+        (DAY, 539, 7, 1, 100), (DAY, 540, 7, 2, 500), (DAY, 541, 13, 1, 1500),
+        ('2026-03-11', 1110, 7, 1, 50),
+    ]
+    result = runner.invoke(args=['crm', 'check-rollup'])
+    assert result.exit_code == 0
+    assert result.output == "Minute rollup matches the webhooks table\n"
+
+
+def test_check_reports_drift_and_rebuild_repairs_it(db, runner):
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE minute_rollup SET count = count + 1 WHERE hook_num = 13")
+        cursor.execute("DELETE FROM minute_rollup WHERE processing_day = '2026-03-11'")
+
+    result = runner.invoke(args=['crm', 'check-rollup'])
+    assert result.exit_code == 1
+    assert f"{DAY} 2026-03-10 12:01 hook13: rollup=(2, 1500) raw=(1, 1500)" in result.output
+    assert "2026-03-11 2026-03-10 21:30 hook7: rollup=None raw=(1, 50)" in result.output
+    assert "Error: 2 mismatching rollup cell(s)" in result.output
+
+    # A one-day rebuild leaves the other day as it was
+    result = runner.invoke(args=['crm', 'rebuild-rollup', '--day', '10.03.2026'])
+    assert (result.exit_code, result.output) == (0, f"Rebuilt minute rollup for {DAY}\n")
+    assert runner.invoke(args=['crm', 'check-rollup', '--day', DAY]).exit_code == 0
+    assert runner.invoke(args=['crm', 'check-rollup']).exit_code == 1
+
+    result = runner.invoke(args=['crm', 'rebuild-rollup'])
+    assert (result.exit_code, result.output) == (0, "Rebuilt minute rollup for all days\n")
+    assert runner.invoke(args=['crm', 'check-rollup']).exit_code == 0
+    assert len(rollup_cells(db)) == 4
@@ -0,0 +1,159 @@
+import os
+from queue import Queue
+
+import pytest
+
+import work
+from work import WebhookSpool
+
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch):
+    """A private webhook_queue for the spool to hand records to"""
+    queue = Queue()
+    monkeypatch.setattr(work, 'webhook_queue', queue)
+    return queue
+
+
+def start(directory):
+    """A spool as a freshly started process opens it"""
+    spool = WebhookSpool(str(directory), segment_bytes=1 << 20, max_backlog=1000, fsync=False)
+    spool.open()
+    return spool
+
+
+def stop(spool):
+    """Release the spool's files and slot lock, as a process exit would"""
+    spool.reset_after_fork()
+
+
+def record(n):
+    return {'hook_type': 'hook1_count', 'name': f"deal {n}", 'delivery_key': f"key-{n}"}
+
+
+def names(records):
+    return [r['name'] for r in records]
+
+
+class Saver:
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.saved = []
+
+    def __call__(self, records):
+        if self.ok:
+            self.saved.extend(records)
+        return self.ok
+
+
+def test_replay_returns_unacknowledged_records(tmp_path, queue):
+    spool = start(tmp_path)
+    for n in range(3):
+        spool.append(record(n))
+    spool.acknowledge([queue.get()])
+    stop(spool)
+
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 2
+    assert names(saver.saved) == ['deal 1', 'deal 2']
+    stop(spool)
+
+    # Replayed segments are gone
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 0
+
+
+def test_failed_replay_survives_later_acknowledgements(tmp_path, queue):
+    spool = start(tmp_path)
+    for n in range(3):
+        spool.append(record(n))
+    stop(spool)
+
+    # The replay fails, then the writer commits and acknowledges a new record
+    spool = start(tmp_path)
+    assert spool.replay(Saver(ok=False)) == 0
+    for _ in range(3):
+        queue.get()
+    spool.append(record(3))
+    spool.acknowledge([queue.get()])
+    stop(spool)
+
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 3
+    assert names(saver.saved) == ['deal 0', 'deal 1', 'deal 2']
+
+
+def test_failed_replay_keeps_dead_letters_until_saved(tmp_path):
+    spool = start(tmp_path)
+    spool.append(record(0))
+    stop(spool)
+    for _ in range(2):
+        spool = start(tmp_path)
+        assert spool.replay(Saver(ok=False)) == 0
+        stop(spool)
+
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 1
+    assert names(saver.saved) == ['deal 0']
+
+
+def test_segments_are_deleted_only_once_acknowledged(tmp_path, queue):
+    spool = WebhookSpool(str(tmp_path), segment_bytes=1, max_backlog=1000, fsync=False)
+    spool.open()
+    for n in range(3):
+        spool.append(record(n))  # one record per segment
+    slot = os.path.join(str(tmp_path), 'slot-0')
+    assert len(WebhookSpool._segments(slot)) == 4
+
+    spool.acknowledge([queue.get()])
+    assert len(WebhookSpool._segments(slot)) == 3
+    stop(spool)
+
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 2
+    assert names(saver.saved) == ['deal 1', 'deal 2']
+
+
+def test_new_segments_start_past_a_stale_checkpoint(tmp_path, queue):
+    spool = start(tmp_path)
+    spool.append(record(0))
+    spool.acknowledge([queue.get()])
+    stop(spool)
+    # All segments replayed and deleted; the ack file remains
+    spool = start(tmp_path)
+    spool.replay(Saver())
+    stop(spool)
+    for path in WebhookSpool._segments(os.path.join(str(tmp_path), 'slot-0')):
+        os.remove(path[1])
+
+    spool = start(tmp_path)
+    spool.append(record(1))
+    stop(spool)
+
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 1
+    assert names(saver.saved) == ['deal 1']
+
+
+def test_writer_dead_letters_a_batch_it_gives_up_on(tmp_path, queue, monkeypatch):
+    spool = start(tmp_path)
+    monkeypatch.setattr(work, 'webhook_spool', spool)
+    monkeypatch.setattr(work, 'save_webhooks_batch', Saver(ok=False))
+    monkeypatch.setattr(work.time_module, 'sleep', lambda seconds: None)
+    for n in range(2):
+        spool.append(record(n))
+    queue.put(None)
+    work.webhook_processor()
+    assert spool.info()['backlog'] == 0
+    stop(spool)
+
+    saver = Saver()
+    spool = start(tmp_path)
+    assert spool.replay(saver) == 2
+    assert names(saver.saved) == ['deal 0', 'deal 1']
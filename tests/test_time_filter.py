@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import work
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('00:00', (0, 0)),
+    ('23:59', (23, 59)),
+    ('9:05', (9, 5)),
+    ('24:00', None),
+    ('25:00', None),
+    ('12:60', None),
+    ('12:75', None),
+    ('-1:30', None),
+    ('noon', None),
+    ('', None),
+])
+def test_parse_time(text, expected):
+    assert work.parse_time(text) == expected
+
+
+@pytest.mark.parametrize('query', ['timePoint=25:00', 'timeFrom=12:75&timeTo=13:00', 'timeFrom=10:00&timeTo=ab'])
+def test_api_webhooks_rejects_invalid_times(client, query):
+    response = client.get(f'/api/webhooks?date=10.03.2026&{query}')
+    assert response.status_code == 400
+    assert 'HH:MM' in response.get_json()['error']
+
+
+def test_index_rejects_invalid_times(client):
+    assert client.get('/?date=10.03.2026&timePoint=25:00').status_code == 400
+
+
+def test_valid_times_are_accepted(client):
+    assert client.get('/api/webhooks?date=10.03.2026&timeFrom=21:30&timeTo=23:59').status_code == 200
+    assert client.get('/?date=10.03.2026&timePoint=20:00').status_code == 200
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('timePoint=23:59', ['09 21:00:01', '09 21:30', '10 12:00', '10 21:00:00']),
+    ('timeFrom=00:00&timeTo=23:59', ['09 21:00:01', '09 21:30', '10 12:00', '10 21:00:00']),
+    ('timeFrom=21:00&timeTo=23:59', ['09 21:00:01', '09 21:30', '10 21:00:00']),
+    ('timeFrom=11:00&timeTo=12:00', ['10 12:00']),
+])
+def test_undated_filters_stay_inside_the_processing_day(client, monkeypatch, query, expected):
+    # Either side of both cutoffs around processing day 2026-03-10
+    names = ['09 12:00', '09 21:00:00', '09 21:00:01', '09 21:30', '10 12:00', '10 21:00:00', '10 21:00:01', '10 21:30']
+    items = [{'hook': 7, 'name': name, 'summa': '1', 'ts': f"2026-03-{name}"} for name in names]
+    assert client.post('/hooks/batch', data=json.dumps(items)).status_code == 200
+    monkeypatch.setattr(work, 'get_processing_date', lambda: '10.03.2026')
+
+    for url in (f'/api/webhooks?{query}', f'/api/webhooks?date=2026-03-10&{query}'):
+        assert sorted(item['name'] for item in client.get(url).get_json()['webhooks']) == expected, url
@@ -1,26 +1,94 @@
+import ast
 import os
-from flask import Flask, request, render_template, jsonify, redirect, url_for
-from datetime import datetime, time, timedelta
+import re
+import click
+from flask import Blueprint, Flask, Response, make_response, request, render_template, jsonify, redirect, url_for
+import hashlib
+from datetime import datetime, date as date_cls, time, timedelta, timezone
 import sqlite3
 import threading
+import fcntl
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+import json
 import logging
-from queue import Queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+from queue import Queue, Empty, Full
 import time as time_module
 import traceback
 import pytz
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("webhook_processor.log"),
-        logging.StreamHandler()  # Also output to console
-    ]
-)
+from hook_parser import PLACEHOLDER_RE, HookParseError, parse_hook_request, placeholder_fields
+from metrics import MetricsRegistry
+from payload_codec import canonical_json, decode_payload, encode_payload, legacy_payload
+
+# Logging: INFO carries one structured line per webhook, DEBUG adds
+# request parsing and query tracing
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.environ.get('LOG_FILE', 'webhook_processor.log')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+
+
+def configure_logging():
+    """
+    Send all records through a QueueHandler so request threads never block
+    on file or console I/O. A QueueListener thread writes them to a rotating
+    log file and to the console. An empty LOG_FILE logs to the console only
+    (several processes must not rotate the same file).
+    """
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = Queue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers[:] = [QueueHandler(log_queue)]
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def restart_log_listener():
+    """Give a forked child its own log queue and listener thread"""
+    log_queue = Queue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueHandler):
+            handler.queue = log_queue
+    log_listener.queue = log_queue
+    log_listener.start()
+
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+
+def _log_value(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "=\n'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+def log_event(event, **fields):
+    """Log one key=value line for a hot-path event at INFO"""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(" ".join([f"event={event}"] + [f"{key}={_log_value(value)}" for key, value in fields.items()]))
+
+# Routes live on a blueprint; create_app() builds the application around it
+bp = Blueprint('crm', __name__)
 
 # Database initialization
 DB_PATH = "webhooks.db"
@@ -28,14 +96,1078 @@ DB_PATH = "webhooks.db"
 # Queue for processing webhooks asynchronously
 webhook_queue = Queue()
 
-# Moscow timezone
-moscow_tz = pytz.timezone('Europe/Moscow')
+# Metrics served at /metrics. Recording goes to per-thread shards, so the
+# hot paths below never take a lock for it; gauges are read on scrape.
+metrics = MetricsRegistry()
+WEBHOOK_REQUESTS = metrics.counter(
+    'webhook_requests_total', "Webhook requests by stage and outcome", ('hook', 'status'))
+WEBHOOK_REQUEST_SECONDS = metrics.histogram(
+    'webhook_request_seconds', "Time to handle one /hook<N>/ request")
+WEBHOOKS_STORED = metrics.counter(
+    'webhooks_stored_total', "Webhooks committed to the database by stage", ('hook',))
+WRITE_PHASE_SECONDS = metrics.histogram(
+    'webhook_write_phase_seconds',
+    "Time per write transaction phase (connect, encode, begin, dedupe, insert, update, commit)", ('phase',))
+WRITE_FAILURES = metrics.counter(
+    'webhook_write_failures_total', "Failed write transactions (retried by the background writer)")
+BATCHES_DROPPED = metrics.counter(
+    'webhook_batches_dropped_total', "Queued batches given up after all retries (dead-lettered when spooled)")
+INDEX_RENDER_SECONDS = metrics.histogram(
+    'index_render_seconds', "Time to build the dashboard page", ('filtered',))
+
+# Async ingest ("accept-then-persist"): webhook routes only validate and
+# enqueue, answering 202, and webhook_processor writes the queue in batches
+ASYNC_INGEST = os.environ.get('WEBHOOK_ASYNC_INGEST', '0') == '1'
+BATCH_MAX_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '200'))
+BATCH_MAX_WAIT_MS = int(os.environ.get('WEBHOOK_BATCH_WAIT_MS', '50'))
+BATCH_MAX_ATTEMPTS = 3
+
+# Deliveries without an explicit idempotency key are identified by hook,
+# name, summa and this time bucket (seconds; 0 turns derived keys off).
+# Keys are only derived when name and summa are both set and rendered;
+# /hooks/batch items are only deduplicated by their idempotency_key.
+# The last WEBHOOK_RECENT_KEYS keys are remembered in memory so retries are
+# acknowledged without a database round trip.
+DEDUPE_WINDOW_SECONDS = int(os.environ.get('WEBHOOK_DEDUPE_WINDOW', '60'))
+RECENT_KEYS_MAX = int(os.environ.get('WEBHOOK_RECENT_KEYS', '50000'))
+
+# Durable spool in front of the background writer: queued webhooks are
+# appended to segment files, fsync'ed in groups, before they are
+# acknowledged, and replayed on startup. An empty WEBHOOK_SPOOL_DIR keeps
+# them in memory only. Above WEBHOOK_MAX_BACKLOG uncommitted webhooks,
+# queued ingest answers 429.
+SPOOL_DIR = os.environ.get('WEBHOOK_SPOOL_DIR', 'webhook_spool')
+SPOOL_SEGMENT_BYTES = int(os.environ.get('WEBHOOK_SPOOL_SEGMENT_BYTES', str(4 * 1024 * 1024)))
+SPOOL_FSYNC = os.environ.get('WEBHOOK_SPOOL_FSYNC', '1') == '1'
+SPOOL_MAX_BACKLOG = int(os.environ.get('WEBHOOK_MAX_BACKLOG', '10000'))
+
+# Raw webhook retention: processing days older than WEBHOOK_RETENTION_DAYS
+# (0 keeps everything) move out of the webhooks table into one archive
+# database per month in WEBHOOK_ARCHIVE_DIR, WEBHOOK_RETENTION_BATCH rows
+# per transaction. hook_stats and minute_rollup keep their counters. The
+# pass runs every WEBHOOK_RETENTION_INTERVAL seconds in each process that
+# serves requests (one process at a time), or via `flask crm archive`.
+RETENTION_DAYS = int(os.environ.get('WEBHOOK_RETENTION_DAYS', '0'))
+ARCHIVE_DIR = os.environ.get('WEBHOOK_ARCHIVE_DIR', 'webhook_archive')
+RETENTION_INTERVAL = float(os.environ.get('WEBHOOK_RETENTION_INTERVAL', '3600'))
+RETENTION_BATCH_ROWS = int(os.environ.get('WEBHOOK_RETENTION_BATCH', '500'))
+RETENTION_BATCH_PAUSE = 0.02
+# Pages handed back to the filesystem by each PRAGMA incremental_vacuum
+VACUUM_STEP_PAGES = 2000
+
+# Webhooks whose name/summa still hold a Bitrix {{...}} placeholder:
+# 'flag' stores them with those fields blanked, 'reject' answers 422
+PLACEHOLDER_POLICY = os.environ.get('WEBHOOK_PLACEHOLDERS', 'flag')
+
+# Most records accepted by one /hooks/batch request
+BATCH_INGEST_MAX_RECORDS = int(os.environ.get('WEBHOOK_BATCH_MAX_RECORDS', '10000'))
+
+# Live dashboard stream (/api/stream): pending events kept per client,
+# heartbeat period, and a cap on open streams (each holds a server thread)
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '64'))
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_MAX_CLIENTS = int(os.environ.get('STREAM_MAX_CLIENTS', '32'))
+
+# Business timezone ("Moscow time" throughout the app and the database)
+moscow_tz = pytz.timezone(os.environ.get('PROCESSING_TIMEZONE', 'Europe/Moscow'))
+
+# Webhooks received after this Moscow time (HH:MM) count towards the next day
+PROCESSING_CUTOFF = time.fromisoformat(os.environ.get('PROCESSING_CUTOFF', '21:00'))
+
+# SQLite tuning. cache_size follows SQLite semantics: negative values are KiB,
+# positive values are pages.
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '-16000'))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT = 20
+SQLITE_STATEMENT_CACHE = 256
+
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    raise ValueError(f"Invalid SQLITE_SYNCHRONOUS value: {SQLITE_SYNCHRONOUS}")
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections: a single writer connection serialized by
+    a lock and one read-only connection per thread. The database runs in WAL
+    mode, so readers never wait for the writer and vice versa.
+
+    Writers that had to wait, for the in-process write lock or for another
+    process holding SQLite's write lock, are counted in info().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        # Bumped to have every thread's reader detach its databases
+        self._attach_generation = 0
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.busy_waits = 0
+        self.busy_wait_seconds = 0.0
+
+    def _connect(self, read_only):
+        if read_only:
+            target = f"file:{os.path.abspath(self.path)}?mode=ro"
+        else:
+            target = f"file:{os.path.abspath(self.path)}"
+        conn = sqlite3.connect(
+            target,
+            uri=True,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+        )
+        conn.row_factory = sqlite3.Row
+        if not read_only:
+            # Only takes effect on a new database; `flask crm vacuum` converts an existing one
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Hold the writer connection for one transaction, committing on success"""
+        if not self._write_lock.acquire(blocking=False):
+            started = time_module.perf_counter()
+            self._write_lock.acquire()
+            self.lock_waits += 1
+            self.lock_wait_seconds += time_module.perf_counter() - started
+        try:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            conn = self._writer
+            try:
+                yield conn.cursor()
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            self._write_lock.release()
+
+    def begin_immediate(self, cursor):
+        """
+        Take SQLite's write lock for the current transaction. It is tried
+        once without a busy timeout; only when another process holds the
+        lock (SQLITE_BUSY) is the wait under the timeout counted as a busy wait.
+        """
+        cursor.execute("PRAGMA busy_timeout=0")
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode != sqlite3.SQLITE_BUSY:
+                raise
+        finally:
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000}")
+        started = time_module.perf_counter()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+        finally:
+            self.busy_waits += 1
+            self.busy_wait_seconds += time_module.perf_counter() - started
+
+    def info(self):
+        return {
+            'lock_waits': self.lock_waits,
+            'lock_wait_seconds': round(self.lock_wait_seconds, 6),
+            'busy_waits': self.busy_waits,
+            'busy_wait_seconds': round(self.busy_wait_seconds, 6),
+        }
+
+    def reset_after_fork(self):
+        """Forget connections inherited from the parent; SQLite handles must not cross fork()"""
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+
+    def reader(self):
+        """Return this thread's read-only connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            self._local.generation = self._attach_generation
+        elif self._local.generation != self._attach_generation:
+            self._detach_all(conn)
+        return conn
+
+    def _detach_all(self, conn):
+        """Detach everything attached to this thread's reader; retried on the next read if it is busy"""
+        attached = getattr(self._local, 'attached', None) or {}
+        for alias in list(attached):
+            try:
+                conn.execute(f"DETACH DATABASE {alias}")
+            except sqlite3.OperationalError as e:
+                # A statement on the connection is still running
+                logger.warning(f"Could not detach {alias} yet: {str(e)}")
+                return
+            del attached[alias]
+        self._local.generation = self._attach_generation
+
+    def detach_readers(self):
+        """
+        Detach the databases attached to readers, e.g. before their files
+        are deleted: this thread's now, other threads' on their next read
+        """
+        self._attach_generation += 1
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._detach_all(conn)
+
+    # Databases kept attached to one reader connection
+    MAX_READER_ATTACHED = 6
+
+    def attach_reader(self, alias, path):
+        """
+        Attach the database at path read-only to this thread's reader as
+        alias, unless it already is. The least recently used one is detached
+        past MAX_READER_ATTACHED, and one replaced on disk is reattached.
+        """
+        conn = self.reader()
+        attached = getattr(self._local, 'attached', None)
+        if attached is None:
+            attached = self._local.attached = OrderedDict()
+        inode = os.stat(path).st_ino
+        if alias in attached:
+            if attached[alias] == inode:
+                attached.move_to_end(alias)
+                return
+            conn.execute(f"DETACH DATABASE {alias}")
+            del attached[alias]
+        if len(attached) >= self.MAX_READER_ATTACHED:
+            oldest, _ = attached.popitem(last=False)
+            conn.execute(f"DETACH DATABASE {oldest}")
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (f"file:{os.path.abspath(path)}?mode=ro",))
+        attached[alias] = inode
+
+
+db_pool = ConnectionPool(DB_PATH)
+
+# Number of processing days kept in the in-process stats cache
+STATS_CACHE_DAYS = int(os.environ.get('STATS_CACHE_DAYS', '64'))
+
+
+class StatsCache:
+    """
+    LRU cache of per-day hook counters. Committed write batches fold their
+    increments into cached days, so dashboard reads of a cached day never
+    touch the database.
+
+    A day is only stored if no write was in flight or committed while it was
+    being loaded, otherwise the loaded snapshot could miss (or double count)
+    an increment. Each entry remembers the day's day_versions value; with
+    `shared` set (other processes write to the same database) entries are
+    checked against the current version before being served.
+    """
+
+    def __init__(self, max_days, shared=False):
+        self.max_days = max_days
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._days = OrderedDict()  # day -> (version, {hook_num: (count, sum)})
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._writes_in_flight = 0
+
+    def get(self, day, loader, version_loader):
+        """
+        Return the (hook_num, count, sum) rows of a day. loader(day) returns
+        (version, rows) on a miss; version_loader(day) is only consulted in
+        shared mode.
+        """
+        current_version = version_loader(day) if self.shared else None
+        with self._lock:
+            entry = self._days.get(day)
+            if entry is not None and (current_version is None or entry[0] == current_version):
+                self._days.move_to_end(day)
+                self.hits += 1
+                return [(hook_num, count, total) for hook_num, (count, total) in entry[1].items()]
+            self.misses += 1
+            generation = self._generation
+            cacheable = self._writes_in_flight == 0
+
+        version, rows = loader(day)
+
+        with self._lock:
+            if cacheable and self._writes_in_flight == 0 and self._generation == generation:
+                self._days[day] = (version, {hook_num: (count, total) for hook_num, count, total in rows})
+                self._days.move_to_end(day)
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+        return rows
+
+    def write_started(self):
+        """Mark a write transaction as in flight"""
+        with self._lock:
+            self._writes_in_flight += 1
+
+    def write_finished(self, increments=None, versions=None):
+        """
+        End a write. On commit, apply its {(day, hook_num): (count, sum)}
+        increments and {day: version} versions; a cached day whose version
+        did not advance by exactly one was also written elsewhere and is
+        dropped instead.
+        """
+        with self._lock:
+            self._writes_in_flight -= 1
+            self._generation += 1
+            for day, version in (versions or {}).items():
+                entry = self._days.get(day)
+                if entry is None:
+                    continue
+                if entry[0] + 1 != version:
+                    del self._days[day]
+                else:
+                    self._days[day] = (version, entry[1])
+            for (day, hook_num), (count, total) in (increments or {}).items():
+                entry = self._days.get(day)
+                if entry is not None:
+                    counters = entry[1]
+                    old_count, old_total = counters.get(hook_num, (0, 0))
+                    counters[hook_num] = (old_count + count, old_total + total)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._days.clear()
+
+    def reset_after_fork(self):
+        """Start a forked child with an empty cache and a fresh lock"""
+        self._lock = threading.Lock()
+        self._days = OrderedDict()
+        self._writes_in_flight = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'days': len(self._days),
+                'max_days': self.max_days,
+                'shared': self.shared,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized JSON response bodies derived from one processing
+    day. Each body is stored with the day version it was built at and only
+    served while that is still the day's version, so writes from any
+    process invalidate it without explicit eviction.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, body)
+        self._lock = threading.Lock()
+
+    def get(self, key, version, builder):
+        """
+        Return the body cached under key for this day version, calling
+        builder() and caching its result on a miss. The version must be
+        read before builder runs, so a body is never older than its version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        body = builder()
+
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_after_fork(self):
+        """Start a forked child with an empty cache and a fresh lock"""
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def info(self):
+        with self._lock:
+            return {
+                'responses': len(self._entries),
+                'max_responses': self.max_entries,
+                'response_hits': self.hits,
+                'response_misses': self.misses,
+            }
+
+
+# Set when several processes (e.g. gunicorn workers) write to the same
+# database, so per-process caches have to validate against day_versions
+MULTI_PROCESS = os.environ.get('WEBHOOK_MULTI_PROCESS', '0') == '1'
+
+stats_cache = StatsCache(STATS_CACHE_DAYS, shared=MULTI_PROCESS)
+
+# /api/stats and /api/deals bodies kept per process
+RESPONSE_CACHE_ENTRIES = int(os.environ.get('RESPONSE_CACHE_ENTRIES', '512'))
+
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES)
+
+
+class StreamSubscriber:
+    """One open /api/stream connection: the day it watches and its pending events"""
+
+    def __init__(self, day, queue_size):
+        self.day = day
+        self.events = Queue(queue_size)
+        self.lagging = False
+
+
+class StatsBroadcaster:
+    """
+    Fans committed stats updates out to live dashboard streams. Publishing
+    never blocks the writer: a stream whose queue is full is flagged as
+    lagging and gets a full snapshot instead of the events it missed.
+    """
+
+    def __init__(self, max_clients, queue_size):
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, day):
+        """Register a stream for a processing day; None when at capacity"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = StreamSubscriber(day, self.queue_size)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def watched_days(self):
+        with self._lock:
+            return {subscriber.day for subscriber in self._subscribers}
+
+    def publish(self, day, event):
+        with self._lock:
+            subscribers = [subscriber for subscriber in self._subscribers if subscriber.day == day]
+        for subscriber in subscribers:
+            self._offer(subscriber, event)
+
+    def resync_all(self):
+        """Make every stream send a fresh snapshot (e.g. after /reset)"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.lagging = True
+            self._offer(subscriber, None)  # wake the stream up
+
+    @staticmethod
+    def _offer(subscriber, event):
+        try:
+            subscriber.events.put_nowait(event)
+        except Full:
+            subscriber.lagging = True
+
+    def reset_after_fork(self):
+        """Streams belong to the parent's connections; a forked child starts empty"""
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def info(self):
+        with self._lock:
+            return {'streams': len(self._subscribers), 'max_streams': self.max_clients}
+
+
+stats_broadcaster = StatsBroadcaster(STREAM_MAX_CLIENTS, STREAM_QUEUE_SIZE)
+
+
+class RecentKeys:
+    """Bounded LRU set of delivery keys committed by this process"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return True
+            return False
+
+    def add_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        """Forget every key, e.g. once the webhooks they point to are deleted"""
+        with self._lock:
+            self._keys.clear()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def info(self):
+        with self._lock:
+            return {'recent_keys': len(self._keys), 'max_keys': self.max_size, 'duplicate_hits': self.hits}
+
+
+recent_delivery_keys = RecentKeys(RECENT_KEYS_MAX)
+
+
+class SpoolFull(Exception):
+    """The writer backlog is at its limit; the sender should retry later"""
+
+
+class WebhookSpool:
+    """
+    Write-ahead log in front of webhook_queue. Each process claims its own
+    slot directory (an flock'ed lock file) and appends records to numbered
+    segment files, one "<crc32> <json>" line each. Appenders wait for an
+    fsync covering their record, and concurrent appenders share one fsync.
+
+    The writer acknowledges records in queue order once they are committed
+    or, when every retry failed, copied to a dead-letter file. The
+    checkpoint (segment and offset) is kept in the slot's ack file, and a
+    segment is deleted only once all of it is acknowledged. On start the
+    writer replays dead letters and whatever its slot and any abandoned
+    slot still hold; delivery keys make replaying a committed record
+    harmless.
+    """
+
+    def __init__(self, directory, segment_bytes, max_backlog, fsync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_backlog = max_backlog
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._slot_dir = None
+        self._lock_file = None
+        self._file = None
+        self._segment = 0
+        self._first_segment = 0
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+        self._acked = 0
+        # Set when records could not be saved or dead-lettered: the
+        # checkpoint stays put so they are replayed on the next start
+        self._ack_blocked = False
+
+    @staticmethod
+    def _segments(slot_dir, prefix='segment-'):
+        """(number, path) of a slot's segment (or dead-letter) files, oldest first"""
+        segments = []
+        for name in os.listdir(slot_dir):
+            if name.startswith(prefix) and name.endswith('.log'):
+                segments.append((int(name[len(prefix):-4]), os.path.join(slot_dir, name)))
+        return sorted(segments)
+
+    def _segment_path(self, segment):
+        return os.path.join(self._slot_dir, f"segment-{segment:012d}.log")
+
+    @staticmethod
+    def _try_lock(slot_dir):
+        """Open and exclusively flock a slot's lock file; None if another process holds it"""
+        lock_file = open(os.path.join(slot_dir, 'lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            lock_file.close()
+            return None
+
+    def open(self):
+        """Claim the first free slot for this process and start a segment after any left over"""
+        with self._lock:
+            if not self.directory or self._slot_dir is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            slot = 0
+            while True:
+                slot_dir = os.path.join(self.directory, f"slot-{slot}")
+                os.makedirs(slot_dir, exist_ok=True)
+                lock_file = self._try_lock(slot_dir)
+                if lock_file is not None:
+                    break
+                slot += 1
+            self._slot_dir, self._lock_file = slot_dir, lock_file
+            # Past the checkpoint too: a new segment below it would count as acknowledged
+            segments = self._segments(slot_dir)
+            last = max(segments[-1][0] if segments else 0, self._read_ack(slot_dir)[0])
+            self._segment = self._first_segment = last + 1
+            self._file = open(self._segment_path(self._segment), 'ab', buffering=0)
+            logger.info(f"Spooling queued webhooks to {slot_dir}")
+
+    def append(self, record):
+        """
+        Queue a record for the writer: append it to the current segment,
+        hand it to webhook_queue and wait until an fsync covers it.
+        Raises SpoolFull when max_backlog records are still uncommitted.
+        """
+        payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            if self._appended - self._acked >= self.max_backlog:
+                raise SpoolFull(f"{self._appended - self._acked} webhooks waiting to be written")
+            if self._file is not None:
+                self._file.write(b'%08x %s\n' % (zlib.crc32(payload), payload))
+                record['spool_position'] = (self._segment, self._file.tell())
+                if record['spool_position'][1] >= self.segment_bytes:
+                    self._rotate()
+            self._appended += 1
+            sequence = self._appended
+            webhook_queue.put(record)
+        if self._file is not None and self.fsync:
+            self._sync(sequence)
+
+    def _rotate(self):
+        """Close the full segment (durably) and start the next one; caller holds _lock"""
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), 'ab', buffering=0)
+
+    def _sync(self, sequence):
+        """Return once record number `sequence` is on disk, sharing fsyncs between appenders"""
+        with self._sync_cond:
+            while self._synced < sequence:
+                if not self._syncing:
+                    self._syncing = True
+                    break
+                self._sync_cond.wait()
+            else:
+                return
+
+        synced = None
+        try:
+            with self._lock:
+                target = self._appended
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+                synced = target
+            finally:
+                os.close(fd)
+        finally:
+            with self._sync_cond:
+                self._syncing = False
+                if synced is not None:
+                    self._synced = max(self._synced, synced)
+                self._sync_cond.notify_all()
+
+    def acknowledge(self, records):
+        """
+        Checkpoint records the writer has finished with (committed or
+        dead-lettered) and delete the segments before the checkpoint,
+        which batches in queue order have fully acknowledged
+        """
+        positions = [record['spool_position'] for record in records if 'spool_position' in record]
+        with self._lock:
+            self._acked += len(records)
+            if not positions or self._ack_blocked:
+                return
+            segment, offset = max(positions)
+            if offset >= self.segment_bytes:
+                # The segment was rotated right after this record, so all of it is acknowledged
+                segment, offset = segment + 1, 0
+            self._write_ack(self._slot_dir, segment, offset)
+            for old_segment in range(self._first_segment, segment):
+                try:
+                    os.remove(self._segment_path(old_segment))
+                except FileNotFoundError:
+                    pass
+            self._first_segment = max(self._first_segment, segment)
+
+    def dead_letter(self, records):
+        """
+        Durably copy records the writer gave up on to a new dead-letter file
+        in this process's slot, replayed on the next start. Returns False
+        (and stops checkpointing, so the segments keep them) if it cannot.
+        """
+        if self._slot_dir is None:
+            return False
+        try:
+            self._write_dead_letter(self._slot_dir, records)
+            return True
+        except OSError as e:
+            logger.error(f"Could not write spool dead letters: {str(e)}")
+            with self._lock:
+                self._ack_blocked = True
+            return False
+
+    def _write_dead_letter(self, slot_dir, records):
+        """Write records to the slot's next deadletter-N.log, fsync'ed before returning"""
+        dead_letters = self._segments(slot_dir, 'deadletter-')
+        number = dead_letters[-1][0] + 1 if dead_letters else 1
+        path = os.path.join(slot_dir, f"deadletter-{number:012d}.log")
+        lines = []
+        for record in records:
+            record = {key: value for key, value in record.items() if key not in ('spool_position', 'duplicate')}
+            payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+            lines.append(b'%08x %s\n' % (zlib.crc32(payload), payload))
+        with open(path + '.tmp', 'wb') as dead_letter_file:
+            dead_letter_file.write(b''.join(lines))
+            if self.fsync:
+                os.fsync(dead_letter_file.fileno())
+        os.replace(path + '.tmp', path)
+        return path
+
+    @staticmethod
+    def _write_ack(slot_dir, segment, offset):
+        path = os.path.join(slot_dir, 'ack')
+        with open(path + '.tmp', 'w') as ack_file:
+            ack_file.write(f"{segment} {offset}")
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _read_ack(slot_dir):
+        try:
+            with open(os.path.join(slot_dir, 'ack')) as ack_file:
+                segment, offset = ack_file.read().split()
+            return int(segment), int(offset)
+        except (FileNotFoundError, ValueError):
+            return 0, 0
+
+    @staticmethod
+    def _read_segment(path, offset):
+        """Records of a segment from offset on, stopping at a torn or corrupt tail"""
+        records = []
+        with open(path, 'rb') as segment_file:
+            segment_file.seek(offset)
+            for line in segment_file:
+                checksum, _, payload = line.rstrip(b'\n').partition(b' ')
+                if not line.endswith(b'\n') or checksum != b'%08x' % zlib.crc32(payload):
+                    logger.warning(f"Ignoring torn spool record at the end of {path}")
+                    break
+                records.append(json.loads(payload))
+        return records
+
+    def replay(self, save):
+        """
+        Persist dead letters and records left unacknowledged by earlier
+        runs, in this process's slot and in slots no process holds, through
+        save(records). Replayed files are deleted. Records that still fail
+        are moved to a dead-letter file for the next start, so this run's
+        checkpoint can safely pass their segments. Returns the number of
+        records saved.
+        """
+        if self._slot_dir is None:
+            return 0
+        total = self._replay_slot(self._slot_dir, save, before=self._first_segment)
+        for name in sorted(os.listdir(self.directory)):
+            slot_dir = os.path.join(self.directory, name)
+            if slot_dir == self._slot_dir or not os.path.isdir(slot_dir):
+                continue
+            lock_file = self._try_lock(slot_dir)
+            if lock_file is None:
+                continue
+            try:
+                total += self._replay_slot(slot_dir, save)
+            finally:
+                lock_file.close()
+        return total
+
+    def _replay_slot(self, slot_dir, save, before=None):
+        total = 0
+        for _, path in self._segments(slot_dir, 'deadletter-'):
+            records = self._read_segment(path, 0)
+            if not self._save_all(records, save):
+                logger.error(f"Could not replay {path}; keeping it for the next start")
+                continue
+            total += len(records)
+            os.remove(path)
+
+        ack_segment, ack_offset = self._read_ack(slot_dir)
+        pending = []
+        for segment, path in self._segments(slot_dir):
+            if before is not None and segment >= before:
+                break
+            if segment >= ack_segment:
+                pending.append((path, self._read_segment(path, ack_offset if segment == ack_segment else 0)))
+            else:
+                # Fully acknowledged before the last run stopped
+                os.remove(path)
+
+        failed = []
+        for path, records in pending:
+            if not failed and self._save_all(records, save):
+                total += len(records)
+            else:
+                failed.extend(records)
+        if failed:
+            try:
+                dead_letter = self._write_dead_letter(slot_dir, failed)
+            except OSError as e:
+                logger.error(f"Could not replay {len(failed)} spooled webhook(s) or move them to dead letters: "
+                             f"{str(e)}; keeping the segments and stopping checkpoints")
+                with self._lock:
+                    self._ack_blocked = True
+                return total
+            logger.error(f"Could not replay {len(failed)} spooled webhook(s); moved them to {dead_letter}")
+        for path, _ in pending:
+            os.remove(path)
+        return total
+
+    @staticmethod
+    def _save_all(records, save):
+        """Save records in BATCH_MAX_SIZE batches; False as soon as one fails"""
+        for start in range(0, len(records), BATCH_MAX_SIZE):
+            if not save(records[start:start + BATCH_MAX_SIZE]):
+                return False
+        return True
+
+    def reset_after_fork(self):
+        """
+        A forked child claims its own slot. The inherited files are only
+        closed; the parent's flock stays in place.
+        """
+        for inherited in (self._file, self._lock_file):
+            if inherited is not None:
+                inherited.close()
+        self._lock = threading.Lock()
+        self._sync_cond = threading.Condition()
+        self._reset_state()
+
+    def info(self):
+        with self._lock:
+            return {
+                'spool_dir': self._slot_dir or '(memory)',
+                'segment': self._segment,
+                'backlog': self._appended - self._acked,
+                'max_backlog': self.max_backlog,
+                'checkpoint_blocked': self._ack_blocked,
+            }
+
+
+webhook_spool = WebhookSpool(SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BACKLOG, fsync=SPOOL_FSYNC)
+
+
+# Fixed statements are kept as module constants so every execution hits the
+# per-connection statement cache instead of being re-prepared.
+INSERT_WEBHOOK_SQL = (
+    "INSERT INTO webhooks (hook_type, name, summa, amount_int, received_at_moscow, processing_date, processing_day, "
+    "ts, delivery_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_PAYLOAD_SQL = "INSERT INTO webhook_payloads (webhook_id, payload) VALUES (?, ?)"
+UPSERT_HOOK_STATS_SQL = """
+    INSERT INTO hook_stats (date, hook_num, count, sum) VALUES (?, ?, ?, ?)
+    ON CONFLICT (date, hook_num) DO UPDATE
+    SET count = count + excluded.count, sum = sum + excluded.sum
+"""
+UPSERT_MINUTE_ROLLUP_SQL = """
+    INSERT INTO minute_rollup (processing_day, minute_bucket, hook_num, count, sum) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (processing_day, minute_bucket, hook_num) DO UPDATE
+    SET count = count + excluded.count, sum = sum + excluded.sum
+"""
+BUMP_DAY_VERSION_SQL = """
+    INSERT INTO day_versions (day, version, updated_at) VALUES (?, 1, ?)
+    ON CONFLICT (day) DO UPDATE
+    SET version = version + 1, updated_at = excluded.updated_at
+"""
+
+# Stage names and KPI formulas, see kpis.json
+KPI_CONFIG = os.environ.get(
+    'KPI_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kpis.json')
+)
+
+
+class KpiEngine:
+    """
+    Stage names and KPI definitions loaded from a JSON config. Each KPI is an
+    arithmetic expression over hN (count of stage N) and sN (sum of stage N),
+    e.g. "(h14 + h19 + h23) / h7 * 100". Expressions are checked and compiled
+    once into Python functions; a zero divisor counts as 1, as the dashboard
+    always did.
+    """
+
+    FORMATS = ('percent', 'rub', 'count')
+    _OPERATORS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+    _VARIABLE = re.compile(r'([hs])([1-9][0-9]*)')
+
+    def __init__(self, config):
+        stages = config.get('stages') or {}
+        self.stage_names = {int(num): str(name) for num, name in stages.items()}
+        self.hook_count = len(self.stage_names)
+        if sorted(self.stage_names) != list(range(1, self.hook_count + 1)):
+            raise ValueError("stages must be numbered 1..N without gaps")
+
+        self.kpis = []
+        self.hooks = set()
+        scalar = []
+        series = []
+        for kpi in config.get('kpis') or []:
+            name = kpi.get('name', '')
+            if not name.isidentifier() or any(name == known['name'] for known in self.kpis):
+                raise ValueError(f"Invalid or duplicate KPI name: {name!r}")
+            if kpi.get('format', 'count') not in self.FORMATS:
+                raise ValueError(f"KPI {name}: format must be one of {', '.join(self.FORMATS)}")
+            try:
+                tree = ast.parse(kpi['expr'], mode='eval')
+            except (KeyError, SyntaxError) as e:
+                raise ValueError(f"KPI {name}: invalid expression: {e}")
+            hooks = set()
+            expr = self._compile(tree.body, hooks, name)
+            digits = kpi.get('round')
+            if digits is not None:
+                expr = f"round({expr}, {int(digits)})"
+            self.hooks |= hooks
+            self.kpis.append({
+                'name': name,
+                'title': kpi.get('title', name),
+                'label': kpi.get('label', ''),
+                'format': kpi.get('format', 'count'),
+                'hooks': sorted(hooks),
+            })
+            scalar.append(f"{name!r}: {expr.format(i='')}")
+            series.append(f"{name!r}: [{expr.format(i='[i]')} for i in r]")
+
+        # c and s are indexed by stage number; for series every item is a
+        # column with one value per period and r is range(periods)
+        self._evaluate = eval(f"lambda c, s: {{{', '.join(scalar)}}}", {'round': round})
+        self._evaluate_series = eval(f"lambda c, s, r: {{{', '.join(series)}}}", {'round': round})
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _compile(self, node, hooks, name):
+        """Python source for an expression node; {i} marks the series index"""
+        if isinstance(node, ast.BinOp) and type(node.op) in self._OPERATORS:
+            left = self._compile(node.left, hooks, name)
+            right = self._compile(node.right, hooks, name)
+            if isinstance(node.op, ast.Div):
+                right = f"({right} or 1)"
+            return f"({left} {self._OPERATORS[type(node.op)]} {right})"
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return f"(-{self._compile(node.operand, hooks, name)})"
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return repr(node.value)
+        if isinstance(node, ast.Name):
+            match = self._VARIABLE.fullmatch(node.id)
+            if match and int(match.group(2)) <= self.hook_count:
+                hooks.add(int(match.group(2)))
+                return f"{'c' if match.group(1) == 'h' else 's'}[{match.group(2)}]{{i}}"
+            raise ValueError(f"KPI {name}: unknown variable {node.id} (use h1..h{self.hook_count}, s1..s{self.hook_count})")
+        raise ValueError(f"KPI {name}: unsupported syntax {type(node).__name__}")
+
+    def evaluate(self, counts, sums):
+        """KPIs for one stats vector: counts and sums indexed by stage number"""
+        return self._evaluate(counts, sums)
+
+    def evaluate_series(self, counts, sums, length):
+        """KPIs for columns: counts and sums map stage number to a list of values"""
+        zero = [0] * length
+        count_columns = [counts.get(i, zero) for i in range(self.hook_count + 1)]
+        sum_columns = [sums.get(i, zero) for i in range(self.hook_count + 1)]
+        return self._evaluate_series(count_columns, sum_columns, range(length))
+
+
+kpi_engine = KpiEngine.load(KPI_CONFIG)
+
+# Number of webhook stages shown on the dashboard. Counters live in the
+# narrow hook_stats table, so raising this needs no schema change.
+HOOK_COUNT = kpi_engine.hook_count
+
+# Webhook stage names
+WEBHOOK_TYPES = {
+    f"hook{num}_count": f"{num}. {name}" for num, name in kpi_engine.stage_names.items()
+}
+
+# Rows in the dashboard's "recent webhooks" table
+RECENT_WEBHOOKS_LIMIT = 50
+
+# Webhook fields exposed by the API, mapped to their SQL expressions.
+# raw_data is only sent when asked for (?fields=...,raw_data).
+WEBHOOK_FIELDS = {
+    'id': 'id',
+    'hook_type': 'hook_type',
+    'name': 'name',
+    'summa': 'summa',
+    'received_at': 'received_at_moscow',
+    'processing_date': 'processing_date',
+    'raw_data': 'raw_data',
+}
+DEFAULT_WEBHOOK_FIELDS = tuple(field for field in WEBHOOK_FIELDS if field != 'raw_data')
+
+
+def payload_sql(schema):
+    """
+    Stored payload of the current webhooks row: its webhook_payloads blob in
+    schema, or the raw_data text of a row written before payloads moved there
+    """
+    return (f"COALESCE((SELECT payload FROM {schema}.webhook_payloads WHERE webhook_id = webhooks.id), "
+            f"webhooks.raw_data)")
+
+
+def webhook_select(fields, payloads='main'):
+    """
+    SELECT list for webhook fields. raw_data yields the still compressed
+    payload from the schema named by payloads; None reads the raw_data
+    column as is, for sources that already resolved it.
+    """
+    return ', '.join(
+        f"{payload_sql(payloads) if field == 'raw_data' and payloads else WEBHOOK_FIELDS[field]} AS {field}"
+        for field in fields
+    )
+
+
+def webhook_item(row, fields):
+    """API dict of a webhook row; a selected raw_data payload is decompressed only here"""
+    item = {field: row[field] for field in fields}
+    if 'raw_data' in item:
+        payload = item['raw_data']
+        # Text is a raw_data value from before webhook_payloads (e.g. in an older archive)
+        item['raw_data'] = legacy_payload(payload) if isinstance(payload, str) else decode_payload(payload)
+    return item
+
+# Largest page /api/webhooks returns; rows are streamed in chunks of
+# WEBHOOKS_FETCH_SIZE straight off the cursor
+WEBHOOKS_MAX_PAGE = int(os.environ.get('WEBHOOKS_MAX_PAGE', '500'))
+WEBHOOKS_FETCH_SIZE = 100
 
 
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with db_pool.transaction() as cursor:
+        # Take the write lock up front so concurrent starts migrate only once
+        cursor.execute("BEGIN IMMEDIATE")
+        _create_schema(cursor)
+    upgrade_archives()
+    logger.info("Database initialized successfully")
+
+
+def _create_schema(cursor):
+    """Create tables and bring the schema up to SCHEMA_VERSION"""
 
     # Table for storing webhook data
     cursor.execute('''
@@ -51,106 +1183,259 @@ def init_db():
     )
     ''')
 
-    # Add received_at_moscow column if it doesn't exist
-    try:
-        cursor.execute("SELECT received_at_moscow FROM webhooks LIMIT 1")
-    except sqlite3.OperationalError:
+    # Per-day, per-hook counters. `date` is the YYYY-MM-DD processing day. (one row per stage that received webhooks)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS hook_stats (
+        date TEXT NOT NULL,
+        hook_num INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        sum INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, hook_num)
+    ) WITHOUT ROWID
+    ''')
+
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        MIGRATIONS[target](cursor)
+        cursor.execute(f"PRAGMA user_version = {target}")
+        logger.info(f"Migrated database schema to version {target}")
+
+    _create_daily_stats_view(cursor)
+
+
+def _create_daily_stats_view(cursor):
+    """
+    Expose hook_stats in the legacy wide daily_stats shape (hookN_count,
+    total_count, hookN_sum, total_sum) for code and tools that still read it
+    """
+    count_columns = ",\n        ".join(
+        f"SUM(CASE WHEN hook_num = {i} THEN count ELSE 0 END) AS hook{i}_count"
+        for i in range(1, HOOK_COUNT + 1)
+    )
+    sum_columns = ",\n        ".join(
+        f"SUM(CASE WHEN hook_num = {i} THEN sum ELSE 0 END) AS hook{i}_sum"
+        for i in range(1, HOOK_COUNT + 1)
+    )
+    cursor.execute("DROP VIEW IF EXISTS daily_stats")
+    cursor.execute(f'''
+    CREATE VIEW daily_stats AS
+    SELECT
+        date,
+        {count_columns},
+        SUM(count) AS total_count,
+        {sum_columns},
+        SUM(sum) AS total_sum
+    FROM hook_stats
+    GROUP BY date
+    ''')
+
+
+def _migrate_to_hook_stats(cursor):
+    """Move counters from the wide daily_stats table into hook_stats"""
+    # Databases created before received_at_moscow was introduced
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(webhooks)")}
+    if 'received_at_moscow' not in columns:
         cursor.execute("ALTER TABLE webhooks ADD COLUMN received_at_moscow TEXT")
         logger.info("Added received_at_moscow column to webhooks table")
 
-    # Table for storing daily statistics with sum columns
+    legacy = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'"
+    ).fetchone()
+    if not legacy:
+        return
+
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(daily_stats)")}
+    hook_nums = sorted(
+        int(column[len('hook'):-len('_count')])
+        for column in columns
+        if column.startswith('hook') and column.endswith('_count')
+    )
+    for i in hook_nums:
+        sum_expr = f"COALESCE(hook{i}_sum, 0)" if f"hook{i}_sum" in columns else "0"
+        cursor.execute(f'''
+            INSERT INTO hook_stats (date, hook_num, count, sum)
+            SELECT date, {i}, COALESCE(hook{i}_count, 0), {sum_expr}
+            FROM daily_stats
+            WHERE COALESCE(hook{i}_count, 0) != 0 OR {sum_expr} != 0
+        ''')
+    cursor.execute("DROP TABLE daily_stats")
+    logger.info(f"Migrated daily_stats counters for {len(hook_nums)} hooks into hook_stats")
+
+
+def _migrate_to_sortable_days(cursor):
+    """
+    Add the YYYY-MM-DD processing_day key and integer epoch ts to webhooks,
+    rekey hook_stats by processing day and index the dashboard filters
+    """
+    cursor.execute("ALTER TABLE webhooks ADD COLUMN processing_day TEXT")
+    cursor.execute("ALTER TABLE webhooks ADD COLUMN ts INTEGER")
+
+    # received_at_moscow is wall-clock time in the processing timezone;
+    # rows that predate it only carry the UTC received_at default.
+    cursor.connection.create_function("local_to_epoch", 1, local_to_epoch, deterministic=True)
+    cursor.execute('''
+        UPDATE webhooks SET
+            processing_day = substr(processing_date, 7, 4) || '-' || substr(processing_date, 4, 2)
+                             || '-' || substr(processing_date, 1, 2),
+            ts = COALESCE(
+                local_to_epoch(received_at_moscow),
+                CAST(strftime('%s', received_at) AS INTEGER)
+            )
+    ''')
+    cursor.execute('''
+        UPDATE hook_stats
+        SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)
+        WHERE date LIKE '__.__.____'
+    ''')
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhooks_day_hook_ts ON webhooks (processing_day, hook_type, ts)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhooks_day_ts ON webhooks (processing_day, ts)")
+
+
+def _migrate_to_amount_column(cursor):
+    """
+    Store the parsed integer amount of every webhook in amount_int and make
+    the (processing_day, hook_type, ts) index cover it for aggregation
+    """
+    cursor.execute("ALTER TABLE webhooks ADD COLUMN amount_int INTEGER NOT NULL DEFAULT 0")
+    cursor.connection.create_function("summa_to_int", 1, summa_to_int, deterministic=True)
+    cursor.execute("UPDATE webhooks SET amount_int = summa_to_int(summa)")
+
+    cursor.execute("DROP INDEX IF EXISTS idx_webhooks_day_hook_ts")
+    cursor.execute(
+        "CREATE INDEX idx_webhooks_day_hook_ts ON webhooks (processing_day, hook_type, ts, amount_int)"
+    )
+
+
+def _migrate_to_day_versions(cursor):
+    """
+    Track a version per processing day, bumped by every write transaction,
+    so processes sharing the database can tell when a day has changed
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS day_versions (
+        day TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS daily_stats (
-        date TEXT PRIMARY KEY,
-        hook1_count INTEGER DEFAULT 0,
-        hook2_count INTEGER DEFAULT 0,
-        hook3_count INTEGER DEFAULT 0,
-        hook4_count INTEGER DEFAULT 0,
-        hook5_count INTEGER DEFAULT 0,
-        hook6_count INTEGER DEFAULT 0,
-        hook7_count INTEGER DEFAULT 0,
-        hook8_count INTEGER DEFAULT 0,
-        hook9_count INTEGER DEFAULT 0,
-        hook10_count INTEGER DEFAULT 0,
-        hook11_count INTEGER DEFAULT 0,
-        hook12_count INTEGER DEFAULT 0,
-        hook13_count INTEGER DEFAULT 0,
-        hook14_count INTEGER DEFAULT 0,
-        hook15_count INTEGER DEFAULT 0,
-        hook16_count INTEGER DEFAULT 0,
-        hook17_count INTEGER DEFAULT 0,
-        hook18_count INTEGER DEFAULT 0,
-        hook19_count INTEGER DEFAULT 0,
-        hook20_count INTEGER DEFAULT 0,
-        hook21_count INTEGER DEFAULT 0,
-        hook22_count INTEGER DEFAULT 0,
-        hook23_count INTEGER DEFAULT 0,
-        hook24_count INTEGER DEFAULT 0,
-        hook25_count INTEGER DEFAULT 0,
-        total_count INTEGER DEFAULT 0,
-        hook1_sum INTEGER DEFAULT 0,
-        hook2_sum INTEGER DEFAULT 0,
-        hook3_sum INTEGER DEFAULT 0,
-        hook4_sum INTEGER DEFAULT 0,
-        hook5_sum INTEGER DEFAULT 0,
-        hook6_sum INTEGER DEFAULT 0,
-        hook7_sum INTEGER DEFAULT 0,
-        hook8_sum INTEGER DEFAULT 0,
-        hook9_sum INTEGER DEFAULT 0,
-        hook10_sum INTEGER DEFAULT 0,
-        hook11_sum INTEGER DEFAULT 0,
-        hook12_sum INTEGER DEFAULT 0,
-        hook13_sum INTEGER DEFAULT 0,
-        hook14_sum INTEGER DEFAULT 0,
-        hook15_sum INTEGER DEFAULT 0,
-        hook16_sum INTEGER DEFAULT 0,
-        hook17_sum INTEGER DEFAULT 0,
-        hook18_sum INTEGER DEFAULT 0,
-        hook19_sum INTEGER DEFAULT 0,
-        hook20_sum INTEGER DEFAULT 0,
-        hook21_sum INTEGER DEFAULT 0,
-        hook22_sum INTEGER DEFAULT 0,
-        hook23_sum INTEGER DEFAULT 0,
-        hook24_sum INTEGER DEFAULT 0,
-        hook25_sum INTEGER DEFAULT 0,
-        total_sum INTEGER DEFAULT 0
+        INSERT OR IGNORE INTO day_versions (day, version, updated_at)
+        SELECT DISTINCT date, 1, CAST(strftime('%s', 'now') AS INTEGER) FROM hook_stats
+    ''')
+
+
+def _migrate_to_keyset_index(cursor):
+    """
+    Put id right after ts in the (processing_day, hook_type, ts) index so it
+    also yields rows in the (ts, id) order /api/webhooks pages by
+    """
+    cursor.execute("DROP INDEX IF EXISTS idx_webhooks_day_hook_ts")
+    cursor.execute(
+        "CREATE INDEX idx_webhooks_day_hook_ts ON webhooks (processing_day, hook_type, ts, id, amount_int)"
+    )
+
+
+def _migrate_to_delivery_keys(cursor):
+    """
+    Record each delivery's idempotency key; the partial unique index makes
+    a retried delivery detectable (older rows have no key)
+    """
+    cursor.execute("ALTER TABLE webhooks ADD COLUMN delivery_key TEXT")
+    cursor.execute(
+        "CREATE UNIQUE INDEX idx_webhooks_delivery_key ON webhooks (delivery_key) WHERE delivery_key IS NOT NULL"
     )
+
+
+def rebuild_minute_rollup(cursor, day=None, skip_archived=True):
+    """
+    Recompute minute_rollup from the webhooks table, for one processing day
+    or all of them. Archived days keep their rollup, since their raw rows
+    have left the table.
+    """
+    day_filter = " AND processing_day = ?" if day else ""
+    if skip_archived:
+        day_filter += " AND processing_day NOT IN (SELECT day FROM archived_days)"
+    params = [day] if day else []
+    cursor.execute(f"DELETE FROM minute_rollup WHERE 1=1{day_filter}", params)
+    cursor.execute(f'''
+        INSERT INTO minute_rollup (processing_day, minute_bucket, hook_num, count, sum)
+        SELECT processing_day, ts / 60, CAST(substr(hook_type, 5, length(hook_type) - 10) AS INTEGER),
+               COUNT(*), SUM(amount_int)
+        FROM webhooks
+        WHERE hook_type LIKE 'hook%\\_count' ESCAPE '\\'{day_filter}
+        GROUP BY processing_day, ts / 60, hook_type
+    ''', params)
+
+
+def _migrate_to_minute_rollup(cursor):
+    """
+    Per-minute counters, (processing_day, ts // 60, hook_num) -> (count, sum),
+    maintained with every insert so time-window stats never scan raw rows
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS minute_rollup (
+        processing_day TEXT NOT NULL,
+        minute_bucket INTEGER NOT NULL,
+        hook_num INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        sum INTEGER NOT NULL,
+        PRIMARY KEY (processing_day, minute_bucket, hook_num)
+    ) WITHOUT ROWID
     ''')
+    # archived_days comes with a later migration, so nothing is archived yet
+    rebuild_minute_rollup(cursor, skip_archived=False)
 
-    # Make sure all columns exist
-    for i in range(1, 26):
-        # Check and add count columns if they don't exist
-        count_col = f"hook{i}_count"
-        try:
-            cursor.execute(f"SELECT {count_col} FROM daily_stats LIMIT 1")
-        except sqlite3.OperationalError:
-            cursor.execute(f"ALTER TABLE daily_stats ADD COLUMN {count_col} INTEGER DEFAULT 0")
-            logger.info(f"Added {count_col} column to daily_stats table")
 
-        # Check and add sum columns if they don't exist
-        sum_col = f"hook{i}_sum"
-        try:
-            cursor.execute(f"SELECT {sum_col} FROM daily_stats LIMIT 1")
-        except sqlite3.OperationalError:
-            cursor.execute(f"ALTER TABLE daily_stats ADD COLUMN {sum_col} INTEGER DEFAULT 0")
-            logger.info(f"Added {sum_col} column to daily_stats table")
+def _migrate_to_archived_days(cursor):
+    """
+    Record the processing days whose raw webhooks were moved to a monthly
+    archive database, with the highest id moved (later rows stay here)
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archived_days (
+        day TEXT PRIMARY KEY,
+        archive TEXT NOT NULL,
+        max_id INTEGER NOT NULL,
+        archived_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
 
-    # Add total columns if they don't exist
-    try:
-        cursor.execute("SELECT total_count FROM daily_stats LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE daily_stats ADD COLUMN total_count INTEGER DEFAULT 0")
-        logger.info("Added total_count column to daily_stats table")
 
-    try:
-        cursor.execute("SELECT total_sum FROM daily_stats LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE daily_stats ADD COLUMN total_sum INTEGER DEFAULT 0")
-        logger.info("Added total_sum column to daily_stats table")
+def _migrate_to_payload_table(cursor):
+    """
+    Move raw payloads out of webhooks.raw_data into webhook_payloads, as
+    compressed canonical JSON keyed by webhook id, so list queries no longer
+    carry them; raw_data stays NULL from now on
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS webhook_payloads (
+        webhook_id INTEGER PRIMARY KEY,
+        payload BLOB NOT NULL
+    )
+    ''')
+    cursor.connection.create_function(
+        "encode_legacy_payload", 1, lambda text: encode_payload(legacy_payload(text)), deterministic=True)
+    cursor.execute('''
+        INSERT OR IGNORE INTO webhook_payloads (webhook_id, payload)
+        SELECT id, encode_legacy_payload(raw_data) FROM webhooks WHERE raw_data IS NOT NULL
+    ''')
+    cursor.execute("UPDATE webhooks SET raw_data = NULL WHERE raw_data IS NOT NULL")
 
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized successfully")
+
+# Schema migrations keyed by the PRAGMA user_version they upgrade to
+MIGRATIONS = {
+    1: _migrate_to_hook_stats,
+    2: _migrate_to_sortable_days,
+    3: _migrate_to_amount_column,
+    4: _migrate_to_day_versions,
+    5: _migrate_to_keyset_index,
+    6: _migrate_to_delivery_keys,
+    7: _migrate_to_minute_rollup,
+    8: _migrate_to_archived_days,
+    9: _migrate_to_payload_table,
+}
+SCHEMA_VERSION = max(MIGRATIONS)
 
 
 def get_moscow_now():
@@ -158,150 +1443,395 @@ def get_moscow_now():
     return datetime.now(moscow_tz)
 
 
-def get_processing_date():
+class ProcessingCalendar:
     """
-    Determine the processing date based on current Moscow time
-    If time is after 21:00, use tomorrow's date
-    If time is before or equal to 21:00, use today's date
+    Maps instants to processing days: a time after the cutoff (21:00 by
+    default) belongs to the next calendar day, a time at or before it to the
+    same day.
+
+    The current day is cached together with the epoch range it covers,
+    (previous cutoff, next cutoff], and a monotonic deadline at the next
+    cutoff, so asking for today's processing date is one clock comparison
+    until the cutoff passes.
     """
-    now = get_moscow_now()
-    cutoff_time = time(21, 0)  # 21:00
 
-    if now.time() > cutoff_time:
-        # If current time is past 21:00, use tomorrow's date
-        processing_date = (now + timedelta(days=1)).strftime('%d.%m.%Y')
-        logger.info(
-            f"Moscow time is {now.strftime('%H:%M:%S')}, which is after 21:00. Using tomorrow's date: {processing_date}")
-    else:
-        # Otherwise use today's date
-        processing_date = now.strftime('%d.%m.%Y')
-        logger.info(
-            f"Moscow time is {now.strftime('%H:%M:%S')}, which is before 21:00. Using today's date: {processing_date}")
+    def __init__(self, tz, cutoff):
+        self.tz = tz
+        self.cutoff = cutoff
+        # (monotonic deadline, start epoch, end epoch, day), replaced as a whole
+        self._current = (float('-inf'), 0, 0, None)
+
+    def cutoff_instant(self, day):
+        """Epoch seconds of the cutoff on a calendar day, in self.tz"""
+        return self.tz.localize(datetime.combine(day, self.cutoff)).timestamp()
+
+    def day_for(self, now):
+        """Processing day (a date) of a timezone-aware datetime"""
+        _, start, end, day = self._current
+        instant = now.timestamp()
+        if start < instant <= end:
+            return day
+        local = now.astimezone(self.tz)
+        if local.time() > self.cutoff:
+            return local.date() + timedelta(days=1)
+        return local.date()
+
+    def today(self):
+        """Processing day (a date) of the current instant"""
+        deadline, _, _, day = self._current
+        if time_module.monotonic() <= deadline:
+            return day
+        return self._roll_over()
+
+    def _roll_over(self):
+        wall, mono = time_module.time(), time_module.monotonic()
+        day = self.day_for(datetime.fromtimestamp(wall, self.tz))
+        start = self.cutoff_instant(day - timedelta(days=1))
+        end = self.cutoff_instant(day)
+        self._current = (mono + (end - wall), start, end, day)
+        logger.info(f"Processing day is {day.isoformat()} until {datetime.fromtimestamp(end, self.tz)}")
+        return day
+
+
+processing_calendar = ProcessingCalendar(moscow_tz, PROCESSING_CUTOFF)
+
+
+def get_processing_date(now=None):
+    """
+    Determine the processing date (dd.mm.YYYY) of a Moscow datetime, by
+    default the current time. If time is after 21:00, use tomorrow's date;
+    at or before 21:00, use today's date.
+    """
+    if now is None:
+        return format_processing_date(processing_calendar.today())
+    return format_processing_date(processing_calendar.day_for(now))
 
-    return processing_date
 
+@lru_cache(maxsize=32)
+def format_processing_date(day):
+    """dd.mm.YYYY display form of a processing day"""
+    return day.strftime('%d.%m.%Y')
 
-def save_webhook(hook_type, name, summa, raw_data):
-    """Save webhook data to database"""
-    conn = None
+
+def to_day_key(date):
+    """
+    Convert a processing date to the sortable YYYY-MM-DD key used in the
+    database. Accepts the dd.mm.YYYY display format or an existing key.
+    """
+    if len(date) == 10 and date[2] == '.' and date[5] == '.':
+        return f"{date[6:10]}-{date[3:5]}-{date[0:2]}"
+    return date
+
+
+def moscow_timestamp(calendar_day, hours, minutes):
+    """Epoch seconds of the Moscow wall-clock time HH:MM on a calendar date"""
+    return int(moscow_tz.localize(datetime.combine(calendar_day, time(hours, minutes))).timestamp())
+
+
+def local_to_epoch(text):
+    """
+    Epoch seconds of a stored received_at_moscow wall-clock time in the
+    processing timezone, None if it is empty or unparsable
+    """
     try:
-        # Log database path
-        logger.info(f"Using database at path: {os.path.abspath(DB_PATH)}")
-        
-        # Test if we can write to the database directory
-        db_dir = os.path.dirname(os.path.abspath(DB_PATH))
-        if not os.path.exists(db_dir):
-            logger.info(f"Creating directory: {db_dir}")
-            os.makedirs(db_dir, exist_ok=True)
-            
-        # Test if we can connect to database
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        cursor = conn.cursor()
-        
-        processing_date = get_processing_date()
+        moment = datetime.fromisoformat(text)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moscow_tz.localize(moment)
+    return int(moment.timestamp())
 
-        # Get current time in Moscow timezone
-        now = get_moscow_now()
-        moscow_time_str = now.strftime('%Y-%m-%d %H:%M:%S')
 
-        # Convert summa to integer if possible
-        try:
-            # Original summa value for logging
-            original_summa = summa
-            
-            # Handle the case when summa ends with underscore(s)
-            if isinstance(summa, str):
-                summa = summa.rstrip('_')
-                logger.info(f"Stripped trailing underscores: '{original_summa}' -> '{summa}'")
-            
-            # Handle special cases
-            if not summa or summa.lower() in ('__', 'none', 'null', ''):
-                summa_int = 0
-                logger.info(f"Special case summa value '{original_summa}' converted to 0")
-            else:
-                # Remove any non-numeric chars except decimal point and digits
-                summa_clean = ''.join(c for c in str(summa) if c.isdigit() or c in '.,')
-                # Replace comma with dot for decimal
-                summa_clean = summa_clean.replace(',', '.')
-                
-                # Try to convert to float first, then to int
-                if summa_clean:
-                    summa_float = float(summa_clean)
-                    summa_int = int(summa_float)
-                    logger.info(f"Converted summa '{original_summa}' -> '{summa_clean}' -> {summa_int}")
-                else:
-                    summa_int = 0
-                    logger.info(f"Empty summa after cleaning '{original_summa}', using 0")
-        except (ValueError, TypeError, AttributeError) as e:
-            summa_int = 0
-            logger.warning(f"Could not convert summa '{summa}' to integer, using 0. Error: {str(e)}")
+def time_filter_sql(day, time_point=None, time_from=None, time_to=None, column='ts', unit=1):
+    """
+    Translate the dashboard time filters for processing day `day`
+    (YYYY-MM-DD) into a condition on the indexed ts column (or another
+    column counting `unit`-second steps, e.g. minute_bucket with unit=60).
+
+    Filters compare the Moscow clock time HH:MM, each bound including its
+    whole minute. A processing day covers the previous evening after the
+    cutoff plus the calendar day itself, so the clock window maps to at most
+    two ts ranges. Returns ('', []) when no valid filter is given.
+    """
+    if time_point:
+        from_time, to_time = (0, 0), parse_time(time_point)
+    elif time_from and time_to:
+        from_time, to_time = parse_time(time_from), parse_time(time_to)
+    else:
+        return '', []
+    if not from_time or not to_time:
+        return '', []
+
+    calendar_day = date_cls.fromisoformat(day)
+    evening = calendar_day - timedelta(days=1)
+    cutoff = (PROCESSING_CUTOFF.hour, PROCESSING_CUTOFF.minute)
+    # The day is (previous cutoff, cutoff]; the ranges stay inside it even
+    # without a processing_day condition (undated /api/webhooks)
+    day_start = int(processing_calendar.cutoff_instant(evening)) + 1
+    day_end = int(processing_calendar.cutoff_instant(calendar_day)) + 1
+    ranges = []
+    if to_time >= cutoff:
+        # Evening of the previous calendar day
+        ranges.append((max(moscow_timestamp(evening, *from_time), day_start),
+                       moscow_timestamp(evening, *to_time) + 60))
+    if from_time <= cutoff:
+        ranges.append((moscow_timestamp(calendar_day, *from_time),
+                       min(moscow_timestamp(calendar_day, *to_time) + 60, day_end)))
+    if not ranges:
+        return " AND 0", []
+
+    # The outer bounds let SQLite use a single index range scan. For a
+    # coarser unit, starts round down and ends up, so the cutoff minute's
+    # bucket is kept on both sides; the processing_day condition of such
+    # queries separates its rows.
+    sql = " OR ".join(f"({column} >= ? AND {column} < ?)" for _ in ranges)
+    bounds = [(ranges[0][0], ranges[-1][1])] + ranges
+    params = [bound for start, end in bounds for bound in (start // unit, -(-end // unit))]
+    return f" AND {column} >= ? AND {column} < ? AND ({sql})", params
+
+
+# Everything except ASCII digits and decimal separators is noise in summa
+SUMMA_NOISE_RE = re.compile(r'[^0-9.,]+')
+
+
+def summa_to_int(summa):
+    """
+    Convert a Bitrix summa value such as "12 500,00", "1500_" or "__" to an
+    integer amount. Values that cannot be parsed count as 0. This is the only
+    summa parser; its result is stored in webhooks.amount_int at ingest.
+    """
+    if summa is None:
+        return 0
+    if type(summa) is int:
+        return summa
+
+    text = str(summa)
+    if text.isascii() and text.isdigit():
+        # Fast path for the common plain integer case
+        return int(text)
+
+    clean = SUMMA_NOISE_RE.sub('', text)
+    if not clean:
+        return 0
+    if clean.isdigit():
+        return int(clean)
+    try:
+        return int(float(clean.replace(',', '.')))
+    except (ValueError, OverflowError):
+        logger.warning(f"Could not convert summa '{summa}' to integer, using 0")
+        return 0
 
-        # Log detailed information
-        logger.info(
-            f"Saving webhook: type={hook_type}, name={name}, summa={summa}, summa_int={summa_int}, date={processing_date}, moscow_time={moscow_time_str}")
 
-        # Insert webhook data with Moscow time
-        cursor.execute(
-            "INSERT INTO webhooks (hook_type, name, summa, received_at_moscow, processing_date, raw_data) VALUES (?, ?, ?, ?, ?, ?)",
-            (hook_type, name, summa, moscow_time_str, processing_date, raw_data)
-        )
-        logger.info("Inserted webhook into webhooks table")
+def delivery_key(hook_num, name, summa, ts, explicit=None, derive=True):
+    """
+    Idempotency key of a delivery: the explicit key when the sender gave
+    one, else a hash of hook, name, summa and the DEDUPE_WINDOW_SECONDS
+    bucket of ts. None when derived keys are off (derive=False or a zero
+    window) or name or summa is blank or an unrendered placeholder: such
+    deliveries cannot be told apart, so they are never treated as retries.
+    """
+    if explicit:
+        return str(explicit)[:200]
+    if not derive or DEDUPE_WINDOW_SECONDS <= 0:
+        return None
+    for value in (name, summa):
+        if not isinstance(value, str) or not value.strip() or ('{{' in value and PLACEHOLDER_RE.search(value)):
+            return None
+    identity = f"{hook_num}|{name}|{summa}|{ts // DEDUPE_WINDOW_SECONDS}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
 
-        # Get the hook number from the hook_type string (e.g., "hook1_count" -> 1)
-        hook_num = int(hook_type.replace("hook", "").replace("_count", ""))
-        sum_column = f"hook{hook_num}_sum"
-        logger.info(f"Extracted hook number: {hook_num}, sum column: {sum_column}")
 
-        # Ensure the date exists in daily_stats
+def build_webhook_record(hook_type, name, summa, raw_data, received_at=None, idempotency_key=None,
+                         derive_key=True):
+    """
+    Prepare a webhook for persistence: resolve the processing date and
+    Moscow receive time at the moment the webhook arrives (or at
+    received_at, an aware datetime, for replayed events), convert summa
+    to an integer and derive the delivery key (derive_key=False keeps
+    only an explicit idempotency_key). The resulting dict is what goes
+    onto webhook_queue.
+    """
+    # Get current time in Moscow timezone
+    now = get_moscow_now() if received_at is None else received_at.astimezone(moscow_tz)
+    moscow_time_str = now.strftime('%Y-%m-%d %H:%M:%S')
+    processing_date = get_processing_date(now)
+
+    # Handle the case when summa ends with underscore(s)
+    original_summa = summa
+    if isinstance(summa, str):
+        summa = summa.rstrip('_')
+    summa_int = summa_to_int(summa)
+    logger.debug(f"Converted summa '{original_summa}' -> {summa_int}")
+
+    # Get the hook number from the hook_type string (e.g., "hook1_count" -> 1)
+    hook_num = int(hook_type.replace("hook", "").replace("_count", ""))
+    ts = int(now.timestamp())
+
+    return {
+        'hook_type': hook_type,
+        'hook_num': hook_num,
+        'name': name,
+        'summa': summa,
+        'summa_int': summa_int,
+        'raw_data': raw_data,
+        'processing_date': processing_date,
+        'processing_day': to_day_key(processing_date),
+        'received_at_moscow': moscow_time_str,
+        'ts': ts,
+        'delivery_key': delivery_key(hook_num, name, summa, ts, idempotency_key, derive_key),
+    }
+
+
+def find_delivered_keys(cursor, keys):
+    """Subset of delivery keys already stored in webhooks"""
+    keys = list(keys)
+    found = set()
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
         cursor.execute(
-            "INSERT OR IGNORE INTO daily_stats (date) VALUES (?)",
-            (processing_date,)
+            f"SELECT delivery_key FROM webhooks WHERE delivery_key IN ({', '.join('?' * len(chunk))})", chunk
         )
-        logger.info(f"Ensured date {processing_date} exists in daily_stats")
-
-        # Update daily statistics (count and sum)
-        update_query = f"""
-            UPDATE daily_stats 
-            SET {hook_type} = COALESCE({hook_type}, 0) + 1, 
-                total_count = COALESCE(total_count, 0) + 1, 
-                {sum_column} = COALESCE({sum_column}, 0) + ?, 
-                total_sum = COALESCE(total_sum, 0) + ? 
-            WHERE date = ?
-        """
-        logger.info(f"Executing update query: {update_query} with values ({summa_int}, {summa_int}, {processing_date})")
-        cursor.execute(update_query, (summa_int, summa_int, processing_date))
-        logger.info("Updated daily stats")
-
-        conn.commit()
-        logger.info("Committed changes to database")
-
-        # Verify the update worked by querying the updated record
-        cursor.execute(f"SELECT {hook_type}, total_count, {sum_column}, total_sum FROM daily_stats WHERE date = ?",
-                       (processing_date,))
-        updated_stats = cursor.fetchone()
-        if updated_stats:
-            logger.info(
-                f"Updated stats for {processing_date}: {hook_type}={updated_stats[0]}, total_count={updated_stats[1]}, "
-                f"{sum_column}={updated_stats[2]}, total_sum={updated_stats[3]}")
-        else:
-            logger.error(f"No stats found for date {processing_date} after update")
+        found.update(row[0] for row in cursor.fetchall())
+    return found
 
-        conn.close()
-        return True
+
+def write_webhooks(cursor, records):
+    """
+    Insert prepared webhook records and apply their counter increments.
+    Records whose delivery key is already stored (or repeated within the
+    batch) are flagged 'duplicate' and skipped, so retries never touch the
+    counters. Increments are grouped per (date, hook) so a batch issues one
+    UPSERT per distinct stage instead of one per webhook. The caller owns
+    the transaction.
+    Returns the {(processing_day, hook_num): (count, sum)} increments and the
+    new {processing_day: version} of every day written.
+    """
+    # Compress payloads before taking the write lock
+    mark = time_module.perf_counter()
+    payloads = [encode_payload(r['raw_data'] or '') for r in records]
+    mark = observe_phase('encode', mark)
+
+    # Take the write lock before looking up keys so no other process can
+    # store one of them in between
+    if not cursor.connection.in_transaction:
+        db_pool.begin_immediate(cursor)
+    mark = observe_phase('begin', mark)
+
+    seen = find_delivered_keys(cursor, {r['delivery_key'] for r in records if r['delivery_key']})
+    fresh = []
+    fresh_payloads = []
+    for r, payload in zip(records, payloads):
+        r['duplicate'] = r['delivery_key'] in seen
+        if not r['duplicate']:
+            fresh.append(r)
+            fresh_payloads.append(payload)
+            if r['delivery_key']:
+                seen.add(r['delivery_key'])
+    mark = observe_phase('dedupe', mark)
+
+    cursor.executemany(
+        INSERT_WEBHOOK_SQL,
+        [(r['hook_type'], r['name'], r['summa'], r['summa_int'], r['received_at_moscow'], r['processing_date'],
+          r['processing_day'], r['ts'], r['delivery_key'])
+         for r in fresh]
+    )
+    if fresh:
+        # AUTOINCREMENT ids are consecutive while this transaction holds
+        # the write lock, so the batch ended at last_insert_rowid()
+        last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        cursor.executemany(INSERT_PAYLOAD_SQL, zip(range(last_id - len(fresh) + 1, last_id + 1), fresh_payloads))
+    mark = observe_phase('insert', mark)
+
+    increments = {}
+    for r in fresh:
+        key = (r['processing_day'], r['hook_num'])
+        count, total = increments.get(key, (0, 0))
+        increments[key] = (count + 1, total + r['summa_int'])
+
+    cursor.executemany(
+        UPSERT_HOOK_STATS_SQL,
+        [(processing_day, hook_num, count, total)
+         for (processing_day, hook_num), (count, total) in increments.items()]
+    )
+
+    minutes = {}
+    for r in fresh:
+        key = (r['processing_day'], r['ts'] // 60, r['hook_num'])
+        count, total = minutes.get(key, (0, 0))
+        minutes[key] = (count + 1, total + r['summa_int'])
+    cursor.executemany(
+        UPSERT_MINUTE_ROLLUP_SQL,
+        [(processing_day, minute, hook_num, count, total)
+         for (processing_day, minute, hook_num), (count, total) in minutes.items()]
+    )
+
+    versions = {}
+    now = int(time_module.time())
+    for processing_day in {day for day, _ in increments}:
+        cursor.execute(BUMP_DAY_VERSION_SQL, (processing_day, now))
+        cursor.execute("SELECT version FROM day_versions WHERE day = ?", (processing_day,))
+        versions[processing_day] = cursor.fetchone()[0]
+    observe_phase('update', mark)
+    return increments, versions
+
+
+def observe_phase(phase, mark):
+    """Record the time since mark as a write phase and return the new mark"""
+    now = time_module.perf_counter()
+    WRITE_PHASE_SECONDS.observe(now - mark, phase)
+    return now
+
+
+def save_webhooks_batch(records):
+    """Persist a list of prepared webhook records in a single transaction"""
+    increments = versions = None
+    stats_cache.write_started()
+    try:
+        mark = time_module.perf_counter()
+        with db_pool.transaction() as cursor:
+            observe_phase('connect', mark)
+            increments, versions = write_webhooks(cursor, records)
+            mark = time_module.perf_counter()
+        observe_phase('commit', mark)
     except sqlite3.Error as e:
-        logger.error(f"SQLite error saving webhook: {str(e)}")
+        logger.error(f"SQLite error saving {len(records)} webhook(s): {str(e)}")
         logger.error(traceback.format_exc())
-        if 'conn' in locals() and conn:
-            conn.close()
+        WRITE_FAILURES.inc()
         return False
     except Exception as e:
-        logger.error(f"Error saving webhook: {str(e)}")
+        logger.error(f"Error saving {len(records)} webhook(s): {str(e)}")
         logger.error(traceback.format_exc())
-        if 'conn' in locals() and conn:
-            conn.close()
+        WRITE_FAILURES.inc()
         return False
-    
-@app.route('/check-permissions')
+    finally:
+        stats_cache.write_finished(increments, versions)
+
+    for (_, hook_num), (count, _) in increments.items():
+        WEBHOOKS_STORED.inc(str(hook_num), amount=count)
+
+    fresh = [r for r in records if not r['duplicate']]
+    logger.debug(f"Saved {len(fresh)} webhook(s) to database, skipped {len(records) - len(fresh)} duplicate(s)")
+    recent_delivery_keys.add_many(r['delivery_key'] for r in records if r['delivery_key'])
+    publish_stats_update(fresh, increments, versions)
+    return True
+
+
+def save_webhook(hook_type, name, summa, raw_data):
+    """Save webhook data to database"""
+    try:
+        record = build_webhook_record(hook_type, name, summa, raw_data)
+    except Exception as e:
+        logger.error(f"Error preparing webhook: {str(e)}")
+        logger.error(traceback.format_exc())
+        return False
+
+    logger.debug(
+        f"Saving webhook: type={record['hook_type']}, name={record['name']}, summa={record['summa']}, "
+        f"summa_int={record['summa_int']}, date={record['processing_date']}, moscow_time={record['received_at_moscow']}")
+    return save_webhooks_batch([record])
+
+
+@bp.route('/check-permissions')
 def check_permissions():
     """Check file system permissions"""
     try:
@@ -352,332 +1882,585 @@ def check_permissions():
         })
 
 
-def webhook_processor():
-    """Background thread function to process webhooks from the queue"""
-    logger.info("Webhook processor thread started")
+def drain_webhook_batch():
+    """
+    Block until a webhook is queued, then keep collecting until the batch
+    holds BATCH_MAX_SIZE items or BATCH_MAX_WAIT_MS has passed since the
+    first one arrived.
+    """
+    batch = [webhook_queue.get()]
+    deadline = time_module.monotonic() + BATCH_MAX_WAIT_MS / 1000.0
+    while len(batch) < BATCH_MAX_SIZE and batch[-1] is not None:
+        remaining = deadline - time_module.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(webhook_queue.get(timeout=remaining))
+        except Empty:
+            break
+    return batch
+
+
+def webhook_processor():
+    """Background thread function to persist queued webhooks in batches"""
+    logger.info("Webhook processor thread started")
+    try:
+        replayed = webhook_spool.replay(save_webhooks_batch)
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled webhook(s)")
+    except Exception as e:
+        logger.error(f"Webhook spool replay failed: {str(e)}")
+        logger.error(traceback.format_exc())
+
+    while True:
+        batch = drain_webhook_batch()
+        stop = batch[-1] is None  # Poison pill to stop the thread
+        records = [item for item in batch if item is not None]
+
+        try:
+            if records:
+                for attempt in range(1, BATCH_MAX_ATTEMPTS + 1):
+                    if save_webhooks_batch(records):
+                        log_event('batch', size=len(records), attempt=attempt)
+                        break
+                    logger.error(f"Failed to process batch of {len(records)} webhook(s), attempt {attempt}")
+                    if attempt < BATCH_MAX_ATTEMPTS:
+                        time_module.sleep(0.1 * attempt)
+                else:
+                    keys = [r['delivery_key'] for r in records]
+                    logger.error(f"Giving up on a batch of {len(records)} webhook(s), delivery keys {keys}")
+                    BATCHES_DROPPED.inc()
+                    if webhook_spool.dead_letter(records):
+                        logger.error("Moved the batch to the spool's dead letters for the next start")
+                webhook_spool.acknowledge(records)
+        except Exception as e:
+            logger.error(f"Webhook processor exception: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            for _ in batch:
+                webhook_queue.task_done()
+
+        if stop:
+            break
+
+
+# Background writer of this process (see create_app for the ownership rule)
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+
+def start_webhook_processor():
+    """Start this process's background writer thread unless it is already running"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            webhook_spool.open()
+            _writer_thread = threading.Thread(target=webhook_processor, name='webhook-writer', daemon=True)
+            _writer_thread.start()
+
+
+def enqueue_webhook(record):
+    """
+    Queue a prepared record for the background writer owned by this
+    process, durably when the spool is on. Raises SpoolFull.
+    """
+    if _writer_thread is None:
+        start_webhook_processor()
+    webhook_spool.append(record)
+
+
+# Columns copied into archive databases
+ARCHIVE_COLUMNS = ('id', 'hook_type', 'name', 'summa', 'received_at', 'received_at_moscow', 'processing_date',
+                   'raw_data', 'processing_day', 'ts', 'amount_int', 'delivery_key')
+
+
+def archive_select(schema):
+    """ARCHIVE_COLUMNS of a webhooks table, with raw_data resolved to its stored payload"""
+    return ', '.join(f"{payload_sql(schema)} AS raw_data" if column == 'raw_data' else column
+                     for column in ARCHIVE_COLUMNS)
+
+
+def archive_path(month):
+    """Archive database of a YYYY-MM month"""
+    return os.path.join(ARCHIVE_DIR, f"webhooks-{month}.db")
+
+
+def archive_alias(month):
+    """Schema name a month's archive is attached under"""
+    return f"archive_{month.replace('-', '_')}"
+
+
+def _create_archive_schema(cursor, alias):
+    """webhooks table of an archive database, indexed like the main one"""
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS {alias}.webhooks (
+        id INTEGER PRIMARY KEY,
+        hook_type TEXT NOT NULL,
+        name TEXT,
+        summa TEXT,
+        received_at TIMESTAMP,
+        received_at_moscow TEXT,
+        processing_date TEXT,
+        raw_data TEXT,
+        processing_day TEXT,
+        ts INTEGER,
+        amount_int INTEGER NOT NULL DEFAULT 0,
+        delivery_key TEXT
+    )
+    ''')
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_webhooks_day_hook_ts "
+                   f"ON webhooks (processing_day, hook_type, ts, id, amount_int)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_webhooks_day_ts ON webhooks (processing_day, ts)")
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS {alias}.webhook_payloads (
+        webhook_id INTEGER PRIMARY KEY,
+        payload BLOB NOT NULL
+    )
+    ''')
+
+
+@contextmanager
+def archive_transaction(month):
+    """Write transaction (BEGIN IMMEDIATE) with the month's archive attached as 'archive'"""
+    with db_pool.transaction() as cursor:
+        # ATTACH/DETACH are refused inside a transaction
+        cursor.execute("ATTACH DATABASE ? AS archive", (os.path.abspath(archive_path(month)),))
+        try:
+            db_pool.begin_immediate(cursor)
+            _create_archive_schema(cursor, 'archive')
+            yield cursor
+            cursor.connection.commit()
+        finally:
+            if cursor.connection.in_transaction:
+                cursor.connection.rollback()
+            cursor.execute("DETACH DATABASE archive")
+
+
+def upgrade_archives():
+    """Bring the schema of every existing archive database up to date"""
+    months = db_pool.reader().execute("SELECT DISTINCT archive FROM archived_days").fetchall()
+    for (month,) in months:
+        if os.path.exists(archive_path(month)):
+            with archive_transaction(month):
+                pass
+
+
+def archived_day(day):
+    """(archive month, max_id) of an archived processing day, None if it was not archived"""
+    return db_pool.reader().execute("SELECT archive, max_id FROM archived_days WHERE day = ?", (day,)).fetchone()
+
+
+def webhooks_source(day):
+    """
+    FROM source holding the webhooks of one processing day: the webhooks
+    table, or for an archived day its archive (attached to this thread's
+    reader) plus the day's rows stored here after it was archived
+    """
+    archived = archived_day(day)
+    if archived is None:
+        return "webhooks"
+    month, max_id = archived
+    alias = archive_alias(month)
+    try:
+        db_pool.attach_reader(alias, archive_path(month))
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Archive {archive_path(month)} is unavailable: {str(e)}")
+        return "webhooks"
+    return (f"(SELECT {archive_select(alias)} FROM {alias}.webhooks UNION ALL "
+            f"SELECT {archive_select('main')} FROM main.webhooks WHERE id > {int(max_id)})")
+
+
+def find_archived_webhook(webhook_id):
+    """Row (all WEBHOOK_FIELDS) of a webhook moved to an archive, trying the likeliest month first"""
+    months = db_pool.reader().execute(
+        "SELECT archive FROM archived_days GROUP BY archive ORDER BY MAX(max_id) < ?, MAX(max_id)",
+        (webhook_id,)
+    ).fetchall()
+    for (month,) in months:
+        alias = archive_alias(month)
+        try:
+            db_pool.attach_reader(alias, archive_path(month))
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Archive {archive_path(month)} is unavailable: {str(e)}")
+            continue
+        row = db_pool.reader().execute(
+            f"SELECT {webhook_select(WEBHOOK_FIELDS, alias)} FROM {alias}.webhooks WHERE id = ?", (webhook_id,)
+        ).fetchone()
+        if row is not None:
+            return row
+    return None
+
+
+def incremental_vacuum(pages=VACUUM_STEP_PAGES):
+    """Give up to `pages` free pages (all of them for None) back to the filesystem"""
+    with db_pool.transaction() as cursor:
+        # The pragma frees one page per step; execute() would only step it once
+        cursor.executescript(f"PRAGMA incremental_vacuum({int(pages)});" if pages else "PRAGMA incremental_vacuum;")
+
+
+def delete_in_batches(sql, batch_rows=RETENTION_BATCH_ROWS):
+    """
+    Run a DELETE whose only parameter is a row limit in short transactions
+    until it runs out of rows; returns the number deleted
+    """
+    deleted = 0
+    while True:
+        with db_pool.transaction() as cursor:
+            db_pool.begin_immediate(cursor)
+            count = cursor.execute(sql, (batch_rows,)).rowcount
+        deleted += count
+        if count < batch_rows:
+            return deleted
+        time_module.sleep(RETENTION_BATCH_PAUSE)
+
+
+def archive_day(day, batch_rows=RETENTION_BATCH_ROWS):
+    """
+    Move one processing day's webhooks into its month's archive database.
+    The rows are copied first (INSERT OR IGNORE, so rerunning after a crash
+    is harmless), then the day is recorded in archived_days, which switches
+    readers over to the archive, and only then deleted here. Every step
+    runs in transactions of batch_rows rows. Returns the number of rows moved.
+    """
+    ids = [row[0] for row in db_pool.reader().execute(
+        "SELECT id FROM webhooks WHERE processing_day = ? ORDER BY id", (day,))]
+    if not ids:
+        return 0
+    month = day[:7]
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    batches = [ids[i:i + batch_rows] for i in range(0, len(ids), batch_rows)]
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    for batch in batches:
+        placeholders = ', '.join('?' * len(batch))
+        with archive_transaction(month) as cursor:
+            cursor.execute(f"INSERT OR IGNORE INTO archive.webhooks ({columns}) SELECT {columns} "
+                           f"FROM main.webhooks WHERE id IN ({placeholders})", batch)
+            cursor.execute(f"INSERT OR IGNORE INTO archive.webhook_payloads (webhook_id, payload) "
+                           f"SELECT webhook_id, payload FROM main.webhook_payloads WHERE webhook_id IN ({placeholders})",
+                           batch)
+        time_module.sleep(RETENTION_BATCH_PAUSE)
+
+    with db_pool.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO archived_days (day, archive, max_id, archived_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (day) DO UPDATE SET max_id = MAX(max_id, excluded.max_id), archived_at = excluded.archived_at
+        ''', (day, month, ids[-1], int(time_module.time())))
+
+    for number, batch in enumerate(batches, 1):
+        with db_pool.transaction() as cursor:
+            db_pool.begin_immediate(cursor)
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f"DELETE FROM webhooks WHERE id IN ({placeholders})", batch)
+            cursor.execute(f"DELETE FROM webhook_payloads WHERE webhook_id IN ({placeholders})", batch)
+        if number % 20 == 0:
+            incremental_vacuum()
+        time_module.sleep(RETENTION_BATCH_PAUSE)
+    incremental_vacuum()
+    return len(ids)
+
+
+def retention_candidates(days):
+    """[(processing_day, rows)] of the days older than the last `days` processing days"""
+    cutoff = (processing_calendar.today() - timedelta(days=days)).isoformat()
+    return db_pool.reader().execute(
+        "SELECT processing_day, COUNT(*) FROM webhooks WHERE processing_day < ? "
+        "GROUP BY processing_day ORDER BY processing_day", (cutoff,)
+    ).fetchall()
+
+
+def run_retention(days=None):
+    """
+    Archive every processing day outside the retention window. Returns
+    {day: rows moved}, or None when another process is already at it.
+    """
+    days = RETENTION_DAYS if days is None else days
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(os.path.join(ARCHIVE_DIR, '.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        moved = {}
+        for day, _ in retention_candidates(days):
+            started = time_module.perf_counter()
+            moved[day] = archive_day(day)
+            log_event('archive', day=day, rows=moved[day],
+                      ms=f"{(time_module.perf_counter() - started) * 1000:.1f}")
+        return moved
+
+
+def retention_worker():
+    """Background thread archiving old days every RETENTION_INTERVAL seconds"""
+    logger.info(f"Retention thread started, keeping {RETENTION_DAYS} day(s) of raw webhooks")
     while True:
         try:
-            logger.info(f"Queue size: {webhook_queue.qsize()}")  # Add this line
-            webhook_data = webhook_queue.get(timeout=5)  # 5 second timeout
-            if webhook_data is None:  # Poison pill to stop the thread
-                break
+            run_retention()
+        except Exception as e:
+            logger.error(f"Retention pass failed: {str(e)}")
+            logger.error(traceback.format_exc())
+        time_module.sleep(RETENTION_INTERVAL)
 
-            hook_type = webhook_data.get('hook_type')
-            name = webhook_data.get('name')
-            summa = webhook_data.get('summa')
-            raw_data = webhook_data.get('raw_data')
 
-            logger.info(f"Processing webhook from queue: {hook_type}, {name}, {summa}")
-            
-            # Test database connection before saving
-            try:
-                conn = sqlite3.connect(DB_PATH, timeout=20)
-                cursor = conn.cursor()
-                cursor.execute("SELECT 1")
-                conn.close()
-                logger.info("Database connection test successful")
-            except Exception as db_e:
-                logger.error(f"Database connection test failed: {str(db_e)}")
-                logger.error(traceback.format_exc())
-            
-            success = save_webhook(hook_type, name, summa, raw_data)
+# Retention thread of this process, started by its first request
+_retention_thread = None
+_retention_lock = threading.Lock()
 
-            if success:
-                logger.info(f"Successfully processed webhook: {hook_type}")
-            else:
-                logger.error(f"Failed to process webhook: {hook_type}")
 
-            webhook_queue.task_done()
+@bp.before_app_request
+def start_retention_worker():
+    """Start this process's retention thread when retention is configured"""
+    global _retention_thread
+    if _retention_thread is not None or RETENTION_DAYS <= 0 or RETENTION_INTERVAL <= 0:
+        return
+    with _retention_lock:
+        if _retention_thread is None:
+            _retention_thread = threading.Thread(target=retention_worker, name='webhook-retention', daemon=True)
+            _retention_thread.start()
 
-            # Small delay to prevent database locks
-            time_module.sleep(0.1)
 
-        except Exception as e:
-            # If timeout or other error, just continue
-            if "Empty" not in str(e):  # Don't log queue.Empty exceptions
-                logger.error(f"Webhook processor exception: {str(e)}")
-                logger.error(traceback.format_exc())
-            continue
+def load_day_version(day):
+    """Current day_versions value of a processing day (0 if never written)"""
+    row = db_pool.reader().execute("SELECT version FROM day_versions WHERE day = ?", (day,)).fetchone()
+    return row[0] if row else 0
 
-def get_stats_for_date(date):
-    """Get statistics for a specific date"""
+
+def load_day_validators(day):
+    """(version, updated_at) of a processing day, or a summary over all days when day is None"""
+    if day is None:
+        row = db_pool.reader().execute(
+            "SELECT COALESCE(SUM(version), 0), COALESCE(MAX(updated_at), 0) FROM day_versions"
+        ).fetchone()
+    else:
+        row = db_pool.reader().execute(
+            "SELECT version, updated_at FROM day_versions WHERE day = ?", (day,)
+        ).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def load_hook_stats(day):
+    """Read the version and (hook_num, count, sum) rows of a processing day from one snapshot"""
+    conn = db_pool.reader()
+    conn.execute("BEGIN")
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)  # Increase timeout to avoid database locks
-        conn.row_factory = sqlite3.Row  # Use row factory for easier dictionary conversion
-        cursor = conn.cursor()
-
-        # First ensure the date exists in the table
-        cursor.execute("INSERT OR IGNORE INTO daily_stats (date) VALUES (?)", (date,))
-        conn.commit()
-
-        # Then get the stats
-        cursor.execute("SELECT * FROM daily_stats WHERE date = ?", (date,))
-        stats = cursor.fetchone()
-
-        if not stats:
-            logger.error(f"No stats found for date {date}")
-            return {}
-
-        # Convert to dictionary
-        stats_dict = dict(stats)
-
-        # Ensure all keys have values (not None)
-        for key in stats_dict:
-            if stats_dict[key] is None:
-                stats_dict[key] = 0
-
-        # Log the retrieved stats for debugging
-        logger.info(f"Retrieved stats for date {date}: {stats_dict}")
-
-        # Verify total count matches sum of individual counts
-        total_count = 0
-        total_sum = 0
-        for i in range(1, 26):
-            count_key = f"hook{i}_count"
-            sum_key = f"hook{i}_sum"
-            if count_key in stats_dict:
-                total_count += stats_dict[count_key]
-            if sum_key in stats_dict:
-                total_sum += stats_dict[sum_key]
-        
-        # Log verification results
-        logger.info(f"Calculated total count: {total_count}, DB total count: {stats_dict.get('total_count', 0)}")
-        logger.info(f"Calculated total sum: {total_sum}, DB total sum: {stats_dict.get('total_sum', 0)}")
-        
-        # Update totals if they don't match
-        if total_count != stats_dict.get('total_count', 0) or total_sum != stats_dict.get('total_sum', 0):
-            logger.info(f"Updating totals in database to match calculated values")
-            cursor.execute(
-                "UPDATE daily_stats SET total_count = ?, total_sum = ? WHERE date = ?",
-                (total_count, total_sum, date)
-            )
-            conn.commit()
-            stats_dict['total_count'] = total_count
-            stats_dict['total_sum'] = total_sum
+        version = load_day_version(day)
+        rows = conn.execute("SELECT hook_num, count, sum FROM hook_stats WHERE date = ?", (day,)).fetchall()
+    finally:
+        conn.rollback()
+    return version, [tuple(row) for row in rows]
 
-        conn.close()
-        return stats_dict
+
+def get_stats_for_date(date):
+    """Get statistics for a specific date (read-only, served from stats_cache)"""
+    try:
+        return build_stats_dict(date, stats_cache.get(to_day_key(date), load_hook_stats, load_day_version))
     except Exception as e:
         logger.error(f"Error getting stats for date {date}: {str(e)}")
         logger.error(traceback.format_exc())
-        if 'conn' in locals() and conn:
-            conn.close()
         return {}
 
+
+def build_stats_dict(date, rows):
+    """
+    Build the wide stats dict (hookN_count, hookN_sum, total_count, total_sum)
+    used by calculate_kpis and the template from (hook_num, count, sum) rows
+    """
+    stats_dict = {'date': date}
+    for i in range(1, HOOK_COUNT + 1):
+        stats_dict[f"hook{i}_count"] = 0
+        stats_dict[f"hook{i}_sum"] = 0
+
+    total_count = 0
+    total_sum = 0
+    for hook_num, count, total in rows:
+        stats_dict[f"hook{hook_num}_count"] = count
+        stats_dict[f"hook{hook_num}_sum"] = total
+        total_count += count
+        total_sum += total
+
+    stats_dict['total_count'] = total_count
+    stats_dict['total_sum'] = total_sum
+    return stats_dict
+
+# hookN_count / hookN_sum keys of a stats dict, indexed by stage number
+COUNT_KEYS = tuple(f"hook{i}_count" for i in range(HOOK_COUNT + 1))
+SUM_KEYS = tuple(f"hook{i}_sum" for i in range(HOOK_COUNT + 1))
+
+
 def calculate_kpis(stats_dict):
-    """Calculate KPIs based on daily statistics"""
-    # Ensure all hook counts exist to avoid None values
-    for i in range(1, 26):
-        key = f"hook{i}_count"
-        sum_key = f"hook{i}_sum"
-        if key not in stats_dict or stats_dict[key] is None:
-            stats_dict[key] = 0
-        if sum_key not in stats_dict or stats_dict[sum_key] is None:
-            stats_dict[sum_key] = 0
-
-    # Calculate cancellation count (п.14 + п.19 + п.23)
-    cancellation_count = (
-            stats_dict.get('hook14_count', 0) +
-            stats_dict.get('hook19_count', 0) +
-            stats_dict.get('hook23_count', 0)
-    )
+    """Calculate KPIs from kpis.json based on daily statistics"""
+    counts = [stats_dict.get(key) or 0 for key in COUNT_KEYS]
+    sums = [stats_dict.get(key) or 0 for key in SUM_KEYS]
+    return kpi_engine.evaluate(counts, sums)
 
-    # Calculate missed calls count (п.15 + п.20 + п.24)
-    missed_calls_count = (
-            stats_dict.get('hook15_count', 0) +
-            stats_dict.get('hook20_count', 0) +
-            stats_dict.get('hook24_count', 0)
-    )
 
-    # Calculate cancellation rate (p.14 + p.19 + p.23) / p.7 * 100%
-    all_ready_count = stats_dict.get('hook7_count', 0)
-    if all_ready_count == 0:
-        all_ready_count = 1  # Avoid division by zero
+# Longest range /api/kpis/range accepts, in days
+KPI_RANGE_MAX_DAYS = 3660
+KPI_GRANULARITIES = ('day', 'week', 'month')
 
-    cancellation_rate = round((cancellation_count / all_ready_count) * 100, 2)
 
-    # Calculate missed calls rate (p.15 + p.20 + p.24) / p.7 * 100%
-    missed_calls_rate = round((missed_calls_count / all_ready_count) * 100, 2)
+def period_start(day, granularity):
+    """First day of the day/week (ISO, Monday)/month period containing a date"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
 
-    # Calculate confirmed orders sum (p.13 + p.18 + p.22)
-    confirmed_orders_sum = (
-            stats_dict.get('hook13_sum', 0) +
-            stats_dict.get('hook18_sum', 0) +
-            stats_dict.get('hook22_sum', 0)
+
+def next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def calculate_kpis_for_range(first_day, last_day, granularity):
+    """
+    KPI time series for processing days first_day..last_day (dates) in
+    day/week/month periods, from one range query over hook_stats. Periods
+    without webhooks are included with zero counters.
+    """
+    periods = []
+    start = period_start(first_day, granularity)
+    while start <= last_day:
+        periods.append(start)
+        start = next_period(start, granularity)
+    index = {start: i for i, start in enumerate(periods)}
+
+    counts = {}
+    sums = {}
+    period_of_day = {}
+    hooks = sorted(kpi_engine.hooks)
+    rows = db_pool.reader().execute(
+        "SELECT date, hook_num, count, sum FROM hook_stats WHERE date >= ? AND date <= ? "
+        f"AND hook_num IN ({', '.join('?' * len(hooks))})",
+        (first_day.isoformat(), last_day.isoformat(), *hooks)
     )
+    for day, hook_num, count, total in rows:
+        i = period_of_day.get(day)
+        if i is None:
+            i = period_of_day[day] = index[period_start(date_cls.fromisoformat(day), granularity)]
+        counts.setdefault(hook_num, [0] * len(periods))[i] += count
+        sums.setdefault(hook_num, [0] * len(periods))[i] += total
 
-    # Return KPIs
     return {
-        'cancellation_rate': cancellation_rate,
-        'missed_calls_rate': missed_calls_rate,
-        'confirmed_orders_sum': confirmed_orders_sum,
-        'cancellation_count': cancellation_count,   # Абсолютное число отмен
-        'missed_calls_count': missed_calls_count    # Абсолютное число недозвонов
+        'from': first_day.isoformat(),
+        'to': last_day.isoformat(),
+        'granularity': granularity,
+        'periods': [start.isoformat() for start in periods],
+        'kpis': kpi_engine.evaluate_series(counts, sums, len(periods)),
     }
-    
+
+
 def parse_time(time_str):
-    """Parse time string in format HH:MM to hours and minutes"""
+    """Parse time string in format HH:MM to hours and minutes, None if invalid or out of range"""
     if not time_str:
         return None
     
     try:
         hours, minutes = map(int, time_str.split(':'))
-        return hours, minutes
     except (ValueError, TypeError):
         logger.error(f"Invalid time format: {time_str}")
         return None
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59):
+        logger.error(f"Time out of range: {time_str}")
+        return None
+    return hours, minutes
 
 
-def get_webhooks_by_filter(date=None, hook_type=None, time_point=None, time_from=None, time_to=None, limit=100):
-    """Get webhooks by filter criteria including time filters"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # Check if the received_at_moscow column exists
-        try:
-            cursor.execute("SELECT received_at_moscow FROM webhooks LIMIT 1")
-            use_moscow_time = True
-        except sqlite3.OperationalError:
-            use_moscow_time = False
-
-        if use_moscow_time:
-            query = "SELECT id, hook_type, name, summa, received_at_moscow as received_at, processing_date, raw_data FROM webhooks WHERE 1=1"
-        else:
-            query = "SELECT id, hook_type, name, summa, datetime(received_at, 'localtime') as received_at, processing_date, raw_data FROM webhooks WHERE 1=1"
-
-        params = []
-
-        if date:
-            query += " AND processing_date = ?"
-            params.append(date)
+def invalid_time_filter(args):
+    """Name of the first timePoint/timeFrom/timeTo request argument that is not a valid HH:MM"""
+    for name in ('timePoint', 'timeFrom', 'timeTo'):
+        if args.get(name) and parse_time(args[name]) is None:
+            return name
+    return None
 
-        if hook_type:
-            query += " AND hook_type = ?"
-            params.append(hook_type)
-            
-        # Добавляем фильтрацию по времени
-        if time_point:
-            # Для конкретного времени ищем все записи до этого времени
-            parsed_time = parse_time(time_point)
-            if parsed_time:
-                hours, minutes = parsed_time
-                time_format = f"{hours:02d}:{minutes:02d}"
-                
-                if use_moscow_time:
-                    # Формат SQL-запроса для времени в текстовом формате
-                    query += " AND substr(received_at_moscow, 12, 5) <= ?"
-                else:
-                    # Формат для времени в стандартном формате SQLite
-                    query += " AND time(received_at) <= ?"
-                
-                params.append(time_format)
-                logger.info(f"Filtering webhooks for time point <= {time_format}")
-        
-        elif time_from and time_to:
-            # Для диапазона времени
-            from_time = parse_time(time_from)
-            to_time = parse_time(time_to)
-            
-            if from_time and to_time:
-                from_hours, from_minutes = from_time
-                to_hours, to_minutes = to_time
-                
-                from_format = f"{from_hours:02d}:{from_minutes:02d}"
-                to_format = f"{to_hours:02d}:{to_minutes:02d}"
-                
-                if use_moscow_time:
-                    query += " AND substr(received_at_moscow, 12, 5) >= ? AND substr(received_at_moscow, 12, 5) <= ?"
-                else:
-                    query += " AND time(received_at) >= ? AND time(received_at) <= ?"
-                
-                params.append(from_format)
-                params.append(to_format)
-                logger.info(f"Filtering webhooks for time range {from_format} - {to_format}")
 
-        query += " ORDER BY received_at DESC LIMIT ?"
-        params.append(limit)
+def webhooks_query(date=None, hook_type=None, time_point=None, time_from=None, time_to=None,
+                   fields=DEFAULT_WEBHOOK_FIELDS, after=None, limit=100):
+    """
+    SQL and params selecting webhook fields, newest first, plus the
+    _cursor_ts/_cursor_id keyset columns. `after` is a (ts, id) cursor:
+    only rows strictly older than it are returned. Run it on this thread's
+    reader, which has an archived day's archive attached.
+    """
+    source = webhooks_source(to_day_key(date)) if date else "webhooks"
+    # An archived day's source resolves raw_data from its own payloads
+    columns = webhook_select(fields, 'main' if source == "webhooks" else None)
+    query = f"SELECT {columns}, ts AS _cursor_ts, id AS _cursor_id FROM {source} WHERE 1=1"
+    params = []
+
+    if date:
+        query += " AND processing_day = ?"
+        params.append(to_day_key(date))
+
+    if hook_type:
+        query += " AND hook_type = ?"
+        params.append(hook_type)
+
+    # Добавляем фильтрацию по времени
+    time_sql, time_params = time_filter_sql(
+        to_day_key(date or get_processing_date()), time_point, time_from, time_to)
+    if time_sql:
+        query += time_sql
+        params.extend(time_params)
+        logger.debug(f"Filtering webhooks for time window {time_point or (time_from, time_to)}")
+
+    if after:
+        query += " AND (ts, id) < (?, ?)"
+        params.extend(after)
+
+    query += " ORDER BY ts DESC, id DESC LIMIT ?"
+    params.append(limit)
+    return query, params
+
+
+def get_webhooks_by_filter(date=None, hook_type=None, time_point=None, time_from=None, time_to=None, limit=100,
+                           fields=DEFAULT_WEBHOOK_FIELDS):
+    """Get webhooks by filter criteria including time filters"""
+    try:
+        cursor = db_pool.reader().cursor()
+        query, params = webhooks_query(date, hook_type, time_point, time_from, time_to, fields, limit=limit)
 
-        logger.info(f"Executing query: {query} with params: {params}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Executing query: {query} with params: {params}")
         cursor.execute(query, params)
         rows = cursor.fetchall()
 
         # Convert to list of dictionaries
-        webhooks = []
-        for row in rows:
-            webhook = {}
-            for key in row.keys():
-                webhook[key] = row[key]
-            webhooks.append(webhook)
-
-        conn.close()
-        logger.info(f"Retrieved {len(webhooks)} webhooks matching filter criteria")
+        webhooks = [webhook_item(row, fields) for row in rows]
+
+        logger.debug(f"Retrieved {len(webhooks)} webhooks matching filter criteria")
         return webhooks
     except Exception as e:
         logger.error(f"Error getting webhooks: {str(e)}")
         logger.error(traceback.format_exc())
-        if 'conn' in locals() and conn:
-            conn.close()
         return []
     
 def calculate_stats_for_time_filter(date, time_point=None, time_from=None, time_to=None):
-    """Calculate statistics for webhooks filtered by time"""
+    """
+    Calculate statistics for webhooks filtered by time by summing the
+    per-minute rollup (at most 1440 x HOOK_COUNT rows per day)
+    """
     try:
-        # Get all webhooks for the specified date and time filters
-        webhooks = get_webhooks_by_filter(
-            date=date, 
-            time_point=time_point, 
-            time_from=time_from, 
-            time_to=time_to, 
-            limit=10000  # Увеличиваем лимит, чтобы получить все вебхуки за день
-        )
-        
-        # Initialize stats dictionary with zeros
-        stats_dict = {f"hook{i}_count": 0 for i in range(1, 26)}
-        stats_dict.update({f"hook{i}_sum": 0 for i in range(1, 26)})
-        stats_dict['total_count'] = 0
-        stats_dict['total_sum'] = 0
-        
-        # Count webhooks by type and sum values
-        for webhook in webhooks:
-            hook_type = webhook.get('hook_type', '')
-            if hook_type and hook_type.startswith('hook') and '_count' in hook_type:
-                # Increment count
-                stats_dict[hook_type] = stats_dict.get(hook_type, 0) + 1
-                stats_dict['total_count'] += 1
-                
-                # Extract hook number for sum column
-                try:
-                    hook_num = int(hook_type.replace('hook', '').replace('_count', ''))
-                    sum_key = f"hook{hook_num}_sum"
-                    
-                    # Add summa value
-                    summa_str = webhook.get('summa', '0')
-                    try:
-                        # Clean and convert summa to integer
-                        if not summa_str or summa_str.lower() in ('__', 'none', 'null', ''):
-                            summa_int = 0
-                        else:
-                            # Remove non-numeric chars except decimal point
-                            summa_clean = ''.join(c for c in str(summa_str) if c.isdigit() or c in '.,')
-                            summa_clean = summa_clean.replace(',', '.')
-                            
-                            if summa_clean:
-                                summa_int = int(float(summa_clean))
-                            else:
-                                summa_int = 0
-                        
-                        stats_dict[sum_key] = stats_dict.get(sum_key, 0) + summa_int
-                        stats_dict['total_sum'] += summa_int
-                    except (ValueError, TypeError):
-                        # If conversion fails, don't add to sum
-                        pass
-                except ValueError:
-                    # If hook number extraction fails, skip
-                    pass
-        
-        logger.info(f"Calculated stats for time filter: {stats_dict}")
+        day = to_day_key(date)
+        query = "SELECT hook_num, SUM(count), SUM(sum) FROM minute_rollup WHERE processing_day = ?"
+        params = [day]
+
+        time_sql, time_params = time_filter_sql(day, time_point, time_from, time_to, column='minute_bucket', unit=60)
+        query += time_sql
+        params.extend(time_params)
+
+        query += " GROUP BY hook_num"
+
+        cursor = db_pool.reader().cursor()
+        rows = [tuple(row) for row in cursor.execute(query, params)]
+
+        stats_dict = build_stats_dict(date, rows)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Calculated stats for time filter: {stats_dict}")
         return stats_dict
     except Exception as e:
         logger.error(f"Error calculating stats for time filter: {str(e)}")
@@ -686,44 +2469,304 @@ def calculate_stats_for_time_filter(date, time_point=None, time_from=None, time_
 
 
 # API endpoint for filtered webhooks
-@app.route('/api/webhooks', methods=['GET'])
+# Part of every ETag, so API responses cached by clients are revalidated
+# after the code or kpis.json is redeployed
+ETAG_SALT = "{:.0f}-{:.0f}".format(os.path.getmtime(__file__), os.path.getmtime(KPI_CONFIG))
+
+
+def cache_validators(day, scope=None):
+    """
+    ETag and Last-Modified of a response computed from one processing day
+    (all days for None). The ETag covers the day version and the full
+    request path, so each filter combination gets its own tag; `scope`
+    names whatever else the body depends on, such as the processing day
+    an undated time filter resolves to.
+    """
+    version, updated_at = load_day_validators(day)
+    digest = hashlib.blake2b(f"{ETAG_SALT}{scope or ''}{request.full_path}".encode(), digest_size=6).hexdigest()
+    return {'etag': f"{day or scope or 'all'}-{version}-{digest}", 'version': version, 'updated_at': updated_at}
+
+
+def is_not_modified(validators):
+    """Whether the client's cached copy (If-None-Match / If-Modified-Since) is current"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators['etag'])
+    since = request.if_modified_since
+    # Last-Modified has one-second resolution, so a day written within the
+    # last second may still change under the same timestamp
+    updated_at = validators['updated_at']
+    return (since is not None and 0 < updated_at < time_module.time() - 1
+            and updated_at <= since.timestamp())
+
+
+def with_validators(response, validators):
+    """Attach ETag / Last-Modified to a 200 or 304 response; clients must revalidate"""
+    response = make_response(response)
+    if response.status_code in (200, 304):
+        response.set_etag(validators['etag'])
+        if validators['updated_at']:
+            response.last_modified = datetime.fromtimestamp(validators['updated_at'], timezone.utc)
+        response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(validators):
+    return with_validators(Response(status=304), validators)
+
+
+def parse_webhooks_cursor(value):
+    """(ts, id) from a next_cursor string ("<ts>.<id>"), None if malformed"""
+    match = re.fullmatch(r'(\d+)\.(\d+)', value)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def stream_webhooks_page(cursor, first_chunk, fields, limit):
+    """
+    Write a {"webhooks": [...], "next_cursor": ...} page as rows come off
+    the cursor, starting with the already serialized first fetch.
+    next_cursor is set when the page is full and resumes right after its
+    last row. The status line is gone by now, so an error re-raises and the
+    server aborts the response instead of ending it as valid JSON.
+    """
+    items, count, last = first_chunk
+    try:
+        yield '{"webhooks": [' + items
+        while count:
+            rows = cursor.fetchmany(WEBHOOKS_FETCH_SIZE)
+            if not rows:
+                break
+            yield ',' + ','.join(json.dumps(webhook_item(row, fields)) for row in rows)
+            count += len(rows)
+            last = rows[-1]
+        next_cursor = f"{last['_cursor_ts']}.{last['_cursor_id']}" if count == limit else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+    except Exception as e:
+        logger.error(f"Error streaming webhooks: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+    finally:
+        cursor.close()
+
+
+def first_webhooks_chunk(cursor, fields):
+    """(JSON of the first fetch's items, row count, last row) of a page query"""
+    rows = cursor.fetchmany(WEBHOOKS_FETCH_SIZE)
+    return ','.join(json.dumps(webhook_item(row, fields)) for row in rows), len(rows), rows[-1] if rows else None
+
+
+@bp.route('/api/webhooks', methods=['GET'])
 def api_webhooks():
-    """API endpoint to get filtered webhooks"""
+    """
+    API endpoint to get filtered webhooks, newest first. Pages hold at most
+    WEBHOOKS_MAX_PAGE rows; pass the returned next_cursor as ?cursor= for
+    the next one. ?fields= selects the columns (raw_data is opt-in).
+    """
     date = request.args.get('date')
     hook_type = request.args.get('hook_type')
     time_point = request.args.get('timePoint')
     time_from = request.args.get('timeFrom')
     time_to = request.args.get('timeTo')
-    limit = request.args.get('limit', 100, type=int)
-
-    webhooks = get_webhooks_by_filter(
-        date=date, 
-        hook_type=hook_type, 
-        time_point=time_point, 
-        time_from=time_from, 
-        time_to=time_to, 
-        limit=limit
+    limit = min(max(request.args.get('limit', 100, type=int), 1), WEBHOOKS_MAX_PAGE)
+
+    invalid = invalid_time_filter(request.args)
+    if invalid:
+        return jsonify({"error": f"{invalid} must be a time HH:MM (00:00-23:59)"}), 400
+
+    fields = DEFAULT_WEBHOOK_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(request.args['fields'].split(','))
+        unknown = [field for field in fields if field not in WEBHOOK_FIELDS]
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    after = None
+    if request.args.get('cursor'):
+        after = parse_webhooks_cursor(request.args['cursor'])
+        if after is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    # Undated time filters apply to the current processing day, so a cached
+    # page goes stale when the day rolls over even if nothing was written
+    if date:
+        validators = cache_validators(to_day_key(date))
+    else:
+        validators = cache_validators(None, to_day_key(get_processing_date()))
+    if is_not_modified(validators):
+        return not_modified(validators)
+
+    query, params = webhooks_query(date, hook_type, time_point, time_from, time_to, fields, after, limit)
+    # Run the query and serialize its first rows before the response starts,
+    # so failures there can still be answered with a 500
+    cursor = None
+    try:
+        cursor = db_pool.reader().execute(query, params)
+        first_chunk = first_webhooks_chunk(cursor, fields)
+    except Exception as e:
+        logger.error(f"Error querying webhooks: {str(e)}")
+        logger.error(traceback.format_exc())
+        if cursor is not None:
+            cursor.close()
+        return jsonify({"error": str(e)}), 500
+    response = Response(stream_webhooks_page(cursor, first_chunk, fields, limit), mimetype='application/json')
+    return with_validators(response, validators)
+
+
+@bp.route('/api/webhooks/<int:webhook_id>', methods=['GET'])
+def api_webhook(webhook_id):
+    """API endpoint to get one webhook including its raw data"""
+    columns = webhook_select(WEBHOOK_FIELDS)
+    row = db_pool.reader().execute(f"SELECT {columns} FROM webhooks WHERE id = ?", (webhook_id,)).fetchone()
+    if row is None:
+        row = find_archived_webhook(webhook_id)
+    if row is None:
+        return jsonify({"error": "Webhook not found"}), 404
+    return jsonify({"webhook": webhook_item(row, WEBHOOK_FIELDS)})
+
+
+def compact_json(payload):
+    """Serialize a cached API payload without whitespace or escaped Cyrillic"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+
+def resolve_stage(stage):
+    """Stage number from a /api/deals/<stage> number or (case-insensitive) name, None if unknown"""
+    if stage.isdigit():
+        hook_num = int(stage)
+        return hook_num if 1 <= hook_num <= HOOK_COUNT else None
+    wanted = stage.strip().casefold()
+    for hook_num, name in kpi_engine.stage_names.items():
+        if name.casefold() == wanted:
+            return hook_num
+    return None
+
+
+def build_stage_stats(date):
+    """
+    {stages: [{hook, stage, count, total_summa}], kpis: [{name, title, label,
+    format, value}]} for a processing day: every stage plus the kpis.json
+    KPIs, in config order
+    """
+    stats_dict = get_stats_for_date(date) or build_stats_dict(date, [])
+    kpis = calculate_kpis(stats_dict)
+    return {
+        'stages': [
+            {'hook': hook_num, 'stage': name,
+             'count': stats_dict[COUNT_KEYS[hook_num]], 'total_summa': stats_dict[SUM_KEYS[hook_num]]}
+            for hook_num, name in kpi_engine.stage_names.items()
+        ],
+        'kpis': [
+            {'name': kpi['name'], 'title': kpi['title'], 'label': kpi['label'], 'format': kpi['format'],
+             'value': kpis[kpi['name']]}
+            for kpi in kpi_engine.kpis
+        ],
+    }
+
+
+def build_stage_deals(day, hook_num, limit):
+    """[{name, summa, timestamp}] of one stage and processing day, newest first"""
+    rows = db_pool.reader().execute(
+        f"SELECT name, amount_int, ts FROM {webhooks_source(day)} WHERE processing_day = ? AND hook_type = ? "
+        "ORDER BY ts DESC, id DESC LIMIT ?",
+        (day, f"hook{hook_num}_count", limit)
     )
+    return [
+        {'name': name or '', 'summa': amount, 'timestamp': datetime.fromtimestamp(ts, moscow_tz).isoformat()}
+        for name, amount, ts in rows
+    ]
+
+
+def cached_json_response(key, validators, builder):
+    """200 JSON response with the cached (or freshly built) body for the day version"""
+    body = response_cache.get(key, validators['version'], lambda: compact_json(builder()))
+    return with_validators(Response(body, mimetype='application/json'), validators)
+
+
+@bp.route('/api/stats', methods=['GET'])
+def api_stats():
+    """Per-stage counts and sums and the KPIs of a processing day, for date switching without a page render"""
+    try:
+        day = to_day_key(request.args.get('date') or get_processing_date())
+        validators = cache_validators(day)
+        if is_not_modified(validators):
+            return not_modified(validators)
+        return cached_json_response(('stats', day), validators, lambda: build_stage_stats(day))
+    except Exception as e:
+        logger.error(f"Error in stats API: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
 
-    return jsonify({"webhooks": webhooks})
+@bp.route('/api/deals/<stage>', methods=['GET'])
+def api_deals(stage):
+    """
+    Deals that reached a stage (number or name) on a processing day, newest
+    first, at most WEBHOOKS_MAX_PAGE of them
+    """
+    hook_num = resolve_stage(stage)
+    if hook_num is None:
+        return jsonify({"error": "Unknown stage"}), 404
+    try:
+        day = to_day_key(request.args.get('date') or get_processing_date())
+        validators = cache_validators(day)
+        if is_not_modified(validators):
+            return not_modified(validators)
+        return cached_json_response(('deals', day, hook_num), validators,
+                                    lambda: build_stage_deals(day, hook_num, WEBHOOKS_MAX_PAGE))
+    except Exception as e:
+        logger.error(f"Error in deals API: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
 
 
 # API endpoint for KPIs
-@app.route('/api/kpis', methods=['GET'])
+@bp.route('/api/kpis', methods=['GET'])
 def api_kpis():
     """API endpoint to get KPIs for a specific date"""
     date = request.args.get('date')
     if not date:
         date = get_processing_date()
 
+    validators = cache_validators(to_day_key(date))
+    if is_not_modified(validators):
+        return not_modified(validators)
+
     stats_dict = get_stats_for_date(date)
     kpis = calculate_kpis(stats_dict)
 
-    return jsonify({"kpis": kpis, "date": date})
+    return with_validators(jsonify({"kpis": kpis, "date": date}), validators)
+
+
+@bp.route('/api/kpis/range', methods=['GET'])
+def api_kpis_range():
+    """
+    API endpoint for KPI time series over a date range:
+    ?from=&to= (YYYY-MM-DD or dd.mm.YYYY) and granularity=day|week|month
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in KPI_GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of {', '.join(KPI_GRANULARITIES)}"}), 400
+    try:
+        first_day = date_cls.fromisoformat(to_day_key(request.args.get('from', '')))
+        last_day = date_cls.fromisoformat(to_day_key(request.args.get('to', '')))
+    except ValueError:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD or dd.mm.YYYY)"}), 400
+    if first_day > last_day or (last_day - first_day).days >= KPI_RANGE_MAX_DAYS:
+        return jsonify({"error": f"Invalid range (from <= to, at most {KPI_RANGE_MAX_DAYS} days)"}), 400
+
+    validators = cache_validators(None)
+    if is_not_modified(validators):
+        return not_modified(validators)
+
+    try:
+        return with_validators(jsonify(calculate_kpis_for_range(first_day, last_day, granularity)), validators)
+    except Exception as e:
+        logger.error(f"Error calculating KPI range: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
 
 
 # API endpoint for current Moscow time
-@app.route('/api/moscow-time', methods=['GET'])
+@bp.route('/api/moscow-time', methods=['GET'])
 def api_moscow_time():
     """API endpoint to get current Moscow time"""
     moscow_now = get_moscow_now()
@@ -736,89 +2779,343 @@ def api_moscow_time():
     })
 
 
-@app.route('/hook<int:hook_num>/<path:path>', methods=['GET', 'POST'])
+def format_recent_webhooks(webhooks):
+    """
+    (hook_num, stage name, name, received at, summa) rows of the dashboard's
+    recent webhooks table from webhook dicts or prepared records
+    """
+    rows = []
+    for webhook in webhooks:
+        hook_type = webhook.get('hook_type', '')
+        hook_num = ''
+        # Extract hook number for sorting/display
+        if hook_type and hook_type.startswith('hook') and '_count' in hook_type:
+            try:
+                hook_num = int(hook_type.replace('hook', '').replace('_count', ''))
+            except ValueError:
+                hook_num = 0
+        rows.append((
+            hook_num,
+            WEBHOOK_TYPES.get(hook_type, "Неизвестная стадия"),
+            webhook.get('name', 'Без названия'),
+            webhook.get('received_at', webhook.get('received_at_moscow', '')),
+            webhook.get('summa', 0)
+        ))
+    return rows
+
+
+def stats_payload(stats_dict, hook_nums):
+    """Counters of the given hooks plus day totals and KPIs, as sent to live dashboards"""
+    return {
+        'hooks': [{'hook': i, 'count': stats_dict[f"hook{i}_count"], 'sum': stats_dict[f"hook{i}_sum"]}
+                  for i in hook_nums],
+        'total_count': stats_dict['total_count'],
+        'total_sum': stats_dict['total_sum'],
+        'kpis': calculate_kpis(stats_dict),
+    }
+
+
+def dashboard_snapshot(date):
+    """Full live-dashboard state of a processing date: every counter and the recent rows"""
+    version = load_day_version(to_day_key(date))
+    payload = stats_payload(get_stats_for_date(date), range(1, HOOK_COUNT + 1))
+    payload['version'] = version
+    payload['date'] = date
+    payload['recent'] = format_recent_webhooks(get_webhooks_by_filter(date=date, limit=RECENT_WEBHOOKS_LIMIT))
+    return payload
+
+
+def publish_stats_update(records, increments, versions):
+    """
+    Send a delta event to live dashboards watching a day written by a
+    committed batch: the changed hooks' new counters and increments, totals,
+    KPIs and the batch's rows, newest first. Called after stats_cache has
+    applied the batch, so the counters are normally served from memory.
+    """
+    try:
+        for day in stats_broadcaster.watched_days().intersection(versions or ()):
+            day_records = [r for r in records if r['processing_day'] == day]
+            date = day_records[0]['processing_date']
+            added = {hook_num: value for (d, hook_num), value in increments.items() if d == day}
+
+            payload = stats_payload(get_stats_for_date(date), sorted(added))
+            for hook in payload['hooks']:
+                hook['added_count'], hook['added_sum'] = added[hook['hook']]
+            payload['version'] = versions[day]
+            payload['date'] = date
+            payload['recent'] = format_recent_webhooks(reversed(day_records[-RECENT_WEBHOOKS_LIMIT:]))
+            stats_broadcaster.publish(day, payload)
+    except Exception as e:
+        logger.error(f"Error publishing stats update: {str(e)}")
+        logger.error(traceback.format_exc())
+
+
+def sse_event(event, data, event_id=None):
+    """Encode one Server-Sent Events message"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@bp.route('/api/stream', methods=['GET'])
+def api_stream():
+    """
+    Server-Sent Events stream of a processing date's stats. Sends a
+    'snapshot' when the client's version (Last-Event-ID or ?version=) is not
+    current, then a 'delta' per committed batch, and a 'tick' heartbeat with
+    the current processing date. A version gap (writes by another process,
+    a lagging client) is answered with a new snapshot.
+    """
+    date = request.args.get('date') or get_processing_date()
+    day = to_day_key(date)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('version', '')
+    client_version = int(last_event_id) if last_event_id.isdigit() else None
+
+    subscriber = stats_broadcaster.subscribe(day)
+    if subscriber is None:
+        return jsonify({"error": "Too many live dashboards"}), 503
+
+    def generate():
+        version = client_version
+        check_version = True  # start by comparing the client's version with the database
+        yield "retry: 5000\n\n"
+        while True:
+            if subscriber.lagging or (check_version and load_day_version(day) != version):
+                subscriber.lagging = False
+                while not subscriber.events.empty():
+                    subscriber.events.get_nowait()
+                snapshot = dashboard_snapshot(date)
+                version = snapshot['version']
+                yield sse_event('snapshot', snapshot, version)
+            elif check_version:
+                yield sse_event('tick', {'processing_date': get_processing_date()})
+            check_version = False
+
+            try:
+                event = subscriber.events.get(timeout=STREAM_HEARTBEAT_SECONDS)
+            except Empty:
+                check_version = True
+                continue
+            if event is None or event['version'] <= version:
+                continue
+            if event['version'] == version + 1:
+                version = event['version']
+                yield sse_event('delta', event, version)
+            else:
+                subscriber.lagging = True
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: stats_broadcaster.unsubscribe(subscriber))
+    return response
+
+
+@bp.route('/hook<int:hook_num>/<path:path>', methods=['GET', 'POST'])
 def handle_webhook(hook_num, path):
     """Generic handler for all webhook types"""
-    # Log the full request URL
-    logger.info(f"Full request URL: {request.url}")
-    logger.info(f"Hook number: {hook_num}")
-    logger.info(f"Path parameter: {path}")
+    started = time_module.perf_counter()
+    trace = logger.isEnabledFor(logging.DEBUG)
+    if trace:
+        # Log the full request URL
+        logger.debug(f"Full request URL: {request.url}")
+        logger.debug(f"Hook number: {hook_num}")
+        logger.debug(f"Path parameter: {path}")
     
-    if hook_num < 1 or hook_num > 25:
+    if hook_num < 1 or hook_num > HOOK_COUNT:
+        log_event('webhook', hook=hook_num, status='invalid')
+        WEBHOOK_REQUESTS.inc('invalid', 'invalid')
         return jsonify({"error": "Invalid webhook number"}), 400
 
     hook_type = f"hook{hook_num}_count"
-    
-    # Initialize parameters
-    name = ''
-    summa = ''
-    raw_data = ''
-    
-    # Check if we have query parameters (old format with ?)
-    if request.args:
-        logger.info(f"Query parameters detected: {dict(request.args)}")
-        name = request.args.get('name', '')
-        summa = request.args.get('summa', '')
-        raw_data = str(dict(request.args))
-        logger.info(f"Using query parameters: name='{name}', summa='{summa}'")
-    
-    # If no query parameters or they're empty, try path format
-    if not name and not summa and path:
-        logger.info(f"Attempting to parse parameters from path: {path}")
-        # Split the path by '/'
-        path_parts = path.split('/')
-        
-        # The last part should contain our parameters
-        if path_parts:
-            last_part = path_parts[-1]
-            logger.info(f"Parsing parameters from: {last_part}")
-            
-            # Split by '&' to get individual parameters
-            param_pairs = last_part.split('&')
-            
-            params = {}
-            for pair in param_pairs:
-                if '=' in pair:
-                    key, value = pair.split('=', 1)  # Split only on first '='
-                    params[key] = value
-            
-            logger.info(f"Parsed parameters: {params}")
-            name = params.get('name', '')
-            summa = params.get('summa', '')
-            raw_data = str(params)
-            logger.info(f"Using path parameters: name='{name}', summa='{summa}'")
-    
-    # If still no parameters and it's a POST request
-    if not name and not summa and request.method == 'POST':
-        logger.info("Checking POST data")
-        if request.is_json:
-            data = request.get_json()
-            name = data.get('name', '')
-            summa = data.get('summa', '')
-            raw_data = str(data)
-            logger.info(f"Using JSON data: name='{name}', summa='{summa}'")
-        else:
-            name = request.form.get('name', '')
-            summa = request.form.get('summa', '')
-            raw_data = str(dict(request.form))
-            logger.info(f"Using form data: name='{name}', summa='{summa}'")
+    hook_label = str(hook_num)
+
+    multipart = request.method == 'POST' and request.mimetype == 'multipart/form-data'
+    try:
+        event = parse_hook_request(
+            hook_num, path,
+            query_string=request.query_string,
+            raw_uri=request.environ.get('RAW_URI') or request.environ.get('REQUEST_URI'),
+            method=request.method,
+            content_type=request.content_type or '',
+            body=request.get_data() if request.method == 'POST' and not multipart else b'',
+            form=request.form if multipart else None
+        )
+    except HookParseError as e:
+        log_event('webhook', hook=hook_num, status='invalid', error=str(e))
+        WEBHOOK_REQUESTS.inc(hook_label, 'invalid')
+        return jsonify({"error": str(e)}), 400
+    if trace:
+        logger.debug(f"Parsed {event.source} parameters: {event.raw_data}")
+
+    name = event.name
+    summa = event.summa
+    raw_data = event.raw_data
+    if event.unrendered:
+        # An unrendered Bitrix template ({{Название}}) is not a deal name or
+        # an amount; keep it out of the stored fields (raw_data still has it)
+        if PLACEHOLDER_POLICY == 'reject':
+            log_event('webhook', hook=hook_num, status='unrendered', fields=','.join(event.placeholders))
+            WEBHOOK_REQUESTS.inc(hook_label, 'unrendered')
+            return jsonify({"error": "Unrendered template placeholders",
+                            "fields": list(event.placeholders)}), 422
+        if 'name' in event.placeholders:
+            name = ''
+        if 'summa' in event.placeholders:
+            summa = ''
 
-    logger.info(f"Final parameters: hook_type='{hook_type}', name='{name}', summa='{summa}'")
-    
-    # Process webhook
     try:
-        logger.info(f"Processing webhook: {hook_type}, {name}, {summa}")
-        success = save_webhook(hook_type, name, summa, raw_data)
-        if success:
-            logger.info(f"Successfully processed webhook: {hook_type}")
-            return jsonify({"status": "processed"}), 200
+        record = build_webhook_record(
+            hook_type, name, summa, raw_data,
+            idempotency_key=request.headers.get('Idempotency-Key') or request.args.get('idempotency_key')
+        )
+        if record['delivery_key'] in recent_delivery_keys:
+            status, code = "duplicate", 200
+        elif ASYNC_INGEST:
+            enqueue_webhook(record)
+            status, code = "queued", 202
+        elif not save_webhooks_batch([record]):
+            status, code = "failed", 500
+        elif record['duplicate']:
+            status, code = "duplicate", 200
         else:
-            logger.error(f"Failed to process webhook: {hook_type}")
-            return jsonify({"status": "failed"}), 500
+            status, code = "processed", 200
+    except SpoolFull as e:
+        log_event('webhook', hook=hook_num, status='throttled', error=str(e))
+        WEBHOOK_REQUESTS.inc(hook_label, 'throttled')
+        return jsonify({"status": "busy", "message": str(e)}), 429, {'Retry-After': '1'}
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
         logger.error(traceback.format_exc())
+        log_event('webhook', hook=hook_num, status='error', error=str(e))
+        WEBHOOK_REQUESTS.inc(hook_label, 'error')
         return jsonify({"status": "error", "message": str(e)}), 500
+
+    elapsed = time_module.perf_counter() - started
+    WEBHOOK_REQUESTS.inc(hook_label, status)
+    WEBHOOK_REQUEST_SECONDS.observe(elapsed)
+    log_event(
+        'webhook', hook=hook_num, status=status, date=record['processing_day'], name=name, summa=summa,
+        amount=record['summa_int'], ms=f"{elapsed * 1000:.1f}",
+        **({'unrendered': ','.join(event.placeholders)} if event.unrendered else {})
+    )
+    return jsonify({"status": status}), code
+
+
+def parse_batch_body(body):
+    """
+    Decode a /hooks/batch body: a JSON array, or NDJSON with one object per
+    line. Raises ValueError when it is neither.
+    """
+    text = body.decode('utf-8').strip()
+    if text.startswith('['):
+        items = json.loads(text)
+    else:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array or NDJSON")
+    return items
+
+
+def parse_event_time(value):
+    """
+    Aware datetime of a batch record's ts: epoch seconds, or an ISO 8601
+    string (Moscow time when it has no offset). Raises ValueError.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid ts: {value!r}")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, moscow_tz)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        return moscow_tz.localize(parsed) if parsed.tzinfo is None else parsed
+    raise ValueError(f"Invalid ts: {value!r}")
+
+
+def build_batch_record(item):
+    """
+    Validate one {hook, name, summa, ts} batch item and prepare its record.
+    Uses the single-webhook rules: hook in 1..HOOK_COUNT, name and summa as
+    strings, summa parsed by summa_to_int, and PLACEHOLDER_POLICY for
+    unrendered {{...}} fields (blanked, and listed in the record's
+    'unrendered', or rejected). Raises ValueError.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Record must be an object")
+    hook = item.get('hook')
+    if isinstance(hook, str) and hook.isdigit():
+        hook = int(hook)
+    if isinstance(hook, bool) or not isinstance(hook, int) or hook < 1 or hook > HOOK_COUNT:
+        raise ValueError("Invalid webhook number")
+
+    name = item.get('name', '')
+    summa = item.get('summa', '')
+    if isinstance(summa, (int, float)) and not isinstance(summa, bool):
+        summa = str(summa)
+    if not isinstance(name, str) or not isinstance(summa, str):
+        raise ValueError("name and summa must be strings")
+
+    placeholders = placeholder_fields(name, summa)
+    if placeholders:
+        if PLACEHOLDER_POLICY == 'reject':
+            raise ValueError(f"Unrendered template placeholders: {', '.join(placeholders)}")
+        if 'name' in placeholders:
+            name = ''
+        if 'summa' in placeholders:
+            summa = ''
+
+    received_at = parse_event_time(item['ts']) if item.get('ts') is not None else None
+    # Backfills legitimately repeat identical rows; only an explicit
+    # idempotency_key marks a batch item as a retry
+    record = build_webhook_record(f"hook{hook}_count", name, summa, canonical_json(item), received_at,
+                                  item.get('idempotency_key'), derive_key=False)
+    record['unrendered'] = placeholders
+    return record
+
+
+@bp.route('/hooks/batch', methods=['POST'])
+def handle_webhook_batch():
+    """
+    Bulk ingest: a JSON array or NDJSON body of {hook, name, summa, ts}
+    records, validated up front and written in one transaction. Nothing is
+    stored if any record is invalid.
+    """
+    started = time_module.perf_counter()
+    try:
+        items = parse_batch_body(request.get_data())
+    except ValueError as e:
+        log_event('webhook_batch', status='invalid', error=str(e))
+        return jsonify({"error": f"Invalid batch body: {str(e)}"}), 400
+
+    if len(items) > BATCH_INGEST_MAX_RECORDS:
+        log_event('webhook_batch', status='too_large', count=len(items))
+        return jsonify({"error": f"Batch exceeds {BATCH_INGEST_MAX_RECORDS} records"}), 413
+
+    records = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            records.append(build_batch_record(item))
+        except (ValueError, OverflowError, OSError) as e:
+            errors.append({"index": index, "error": str(e)})
+    if errors:
+        log_event('webhook_batch', status='invalid', count=len(items), errors=len(errors))
+        return jsonify({"error": "Invalid records", "records": errors[:100]}), 400
+
+    if records and not save_webhooks_batch(records):
+        log_event('webhook_batch', status='failed', count=len(records))
+        return jsonify({"status": "failed"}), 500
+
+    duplicates = sum(1 for record in records if record['duplicate'])
+    unrendered = sum(1 for record in records if record['unrendered'])
+    log_event(
+        'webhook_batch', status='processed', count=len(records), duplicates=duplicates,
+        days=len({record['processing_day'] for record in records}),
+        ms=f"{(time_module.perf_counter() - started) * 1000:.1f}",
+        **({'unrendered': unrendered} if unrendered else {})
+    )
+    return jsonify({"status": "processed", "count": len(records) - duplicates, "duplicates": duplicates,
+                    "unrendered": unrendered}), 200
 # Create routes for each webhook type
 # Replace your current handle_webhook function with this:
 # @app.route('/hook<int:hook_num>/<path:path>', methods=['GET', 'POST'])
@@ -863,9 +3160,10 @@ def handle_webhook(hook_num, path):
 #         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Main page showing statistics"""
+    started = time_module.perf_counter()
     try:
         # Get date from query parameter or use current processing date
         date_param = request.args.get('date')
@@ -878,8 +3176,16 @@ def index():
         time_point = request.args.get('timePoint')
         time_from = request.args.get('timeFrom')
         time_to = request.args.get('timeTo')
+        invalid = invalid_time_filter(request.args)
+        if invalid:
+            return f"Error: {invalid} must be a time HH:MM (00:00-23:59)", 400
+
+        logger.debug(f"Rendering index page for date: {processing_date}, timePoint: {time_point}, timeRange: {time_from}-{time_to}")
 
-        logger.info(f"Rendering index page for date: {processing_date}, timePoint: {time_point}, timeRange: {time_from}-{time_to}")
+        # Version of the day the page starts from; read before the stats so
+        # the live stream resends anything committed in between. The page is
+        # not revalidated by it: it also shows the queue size and the clock
+        stats_version = load_day_version(to_day_key(processing_date))
 
         # Get statistics based on time filters
         if time_point or (time_from and time_to):
@@ -889,20 +3195,15 @@ def index():
                 time_from=time_from,
                 time_to=time_to
             )
-            logger.info(f"Using time-filtered statistics")
+            logger.debug(f"Using time-filtered statistics")
         else:
             # Get full day statistics from the database
             stats_dict = get_stats_for_date(processing_date)
-            logger.info(f"Using full day statistics")
+            logger.debug(f"Using full day statistics")
 
-        # For template compatibility, ensure all hook counts and sums exist
-        for i in range(1, 26):
-            count_key = f"hook{i}_count"
-            sum_key = f"hook{i}_sum"
-            if count_key not in stats_dict or stats_dict[count_key] is None:
-                stats_dict[count_key] = 0
-            if sum_key not in stats_dict or stats_dict[sum_key] is None:
-                stats_dict[sum_key] = 0
+        # Both loaders return {} on errors; render zero counters instead
+        if not stats_dict:
+            stats_dict = build_stats_dict(processing_date, [])
 
         # Calculate KPIs
         kpis = calculate_kpis(stats_dict)
@@ -913,57 +3214,9 @@ def index():
             time_point=time_point, 
             time_from=time_from, 
             time_to=time_to, 
-            limit=50
+            limit=RECENT_WEBHOOKS_LIMIT
         )
-        
-        # Define webhook stage names
-        webhook_types = {
-            "hook1_count": "1. Все сделки",
-            "hook2_count": "2. Без статуса",
-            "hook3_count": "3. без даты",
-            "hook4_count": "4. без региона",
-            "hook5_count": "5. без суммы",
-            "hook6_count": "6. без адреса",
-            "hook7_count": "7. все готово",
-            "hook8_count": "8. мск",
-            "hook9_count": "9. Спб",
-            "hook10_count": "10. Регион",
-            "hook11_count": "11. ЗВоним без предоплаты",
-            "hook12_count": "12. Звоним без предоплаты несколько товаров",
-            "hook13_count": "13. Подтвердил заказ без предоплаты",
-            "hook14_count": "14. Отменил заказ без предоплаты",
-            "hook15_count": "15. Не взял трубку без предоплаты",
-            "hook16_count": "16. ЗВоним с предоплатой",
-            "hook17_count": "17. Звоним с предоплатой несколько товаров",
-            "hook18_count": "18. Подтвердил заказ с предоплатой",
-            "hook19_count": "19. Отменил заказ с предоплатой",
-            "hook20_count": "20. Не взял трубку с предоплатой",
-            "hook21_count": "21. ЗВоним регион",
-            "hook22_count": "22. Подтвердил заказ регион",
-            "hook23_count": "23. Отменил заказ регион",
-            "hook24_count": "24. Не взял трубку регион",
-            "hook25_count": "25. неопонятно"
-        }
-        
-        # Add stage name to each webhook
-        for webhook in webhooks:
-            hook_type = webhook.get('hook_type', '')
-            webhook['stage_name'] = webhook_types.get(hook_type, "Неизвестная стадия")
-            # Extract hook number for sorting/display
-            if hook_type and hook_type.startswith('hook') and '_count' in hook_type:
-                try:
-                    webhook['hook_num'] = int(hook_type.replace('hook', '').replace('_count', ''))
-                except ValueError:
-                    webhook['hook_num'] = 0
-        
-        # Format webhooks for template
-        recent_webhooks = [(
-            webhook.get('hook_num', ''),
-            webhook.get('stage_name', 'Неизвестная стадия'), 
-            webhook.get('name', 'Без названия'), 
-            webhook.get('received_at', ''), 
-            webhook.get('summa', 0)
-        ) for webhook in webhooks]
+        recent_webhooks = format_recent_webhooks(webhooks)
 
         # Get count of unprocessed webhooks in queue
         queue_size = 0
@@ -976,7 +3229,7 @@ def index():
         current_moscow_time = moscow_now.strftime('%H:%M:%S')
 
         # Передаем параметры фильтра в шаблон
-        return render_template(
+        page = render_template(
             'index.html',
             stats=stats_dict,
             kpis=kpis,
@@ -985,44 +3238,102 @@ def index():
             current_date=current_datetime,
             current_moscow_time=current_moscow_time,
             processing_date=processing_date,
-            webhook_types=webhook_types,
+            webhook_types=WEBHOOK_TYPES,
+            stage_names=kpi_engine.stage_names,
+            kpi_definitions=kpi_engine.kpis,
+            hook_count=HOOK_COUNT,
+            stats_version=stats_version,
+            recent_webhooks_limit=RECENT_WEBHOOKS_LIMIT,
             time_point=time_point,
             time_from=time_from,
             time_to=time_to
         )
+        INDEX_RENDER_SECONDS.observe(time_module.perf_counter() - started,
+                                     '1' if time_point or (time_from and time_to) else '0')
+        return page
     except Exception as e:
         logger.error(f"Error in index route: {str(e)}")
         logger.error(traceback.format_exc())
         return f"Error: {str(e)}", 500
 
 
-@app.route('/reset')
+def queue_oldest_age():
+    """Seconds since the oldest webhook still waiting in webhook_queue arrived"""
+    try:
+        oldest = webhook_queue.queue[0]
+    except IndexError:
+        return 0
+    return max(0.0, time_module.time() - oldest['ts']) if oldest else 0
+
+
+metrics.gauge('webhook_queue_depth', "Webhooks waiting for the background writer", lambda: webhook_queue.qsize())
+metrics.gauge('webhook_queue_oldest_age_seconds', "Age of the oldest queued webhook", queue_oldest_age)
+metrics.gauge('webhook_spool_backlog', "Spooled webhooks not yet committed",
+              lambda: webhook_spool.info()['backlog'])
+metrics.gauge('sqlite_write_lock_waits_total', "Writes that waited for this process's write lock",
+              lambda: db_pool.lock_waits, kind='counter')
+metrics.gauge('sqlite_write_lock_wait_seconds_total', "Time spent waiting for this process's write lock",
+              lambda: db_pool.lock_wait_seconds, kind='counter')
+metrics.gauge('sqlite_busy_waits_total', "BEGIN IMMEDIATE calls that waited for another process",
+              lambda: db_pool.busy_waits, kind='counter')
+metrics.gauge('sqlite_busy_wait_seconds_total', "Time BEGIN IMMEDIATE spent waiting for another process",
+              lambda: db_pool.busy_wait_seconds, kind='counter')
+metrics.gauge('cache_requests_total', "Cache lookups by cache and result",
+              lambda: [(('stats', 'hit'), stats_cache.hits), (('stats', 'miss'), stats_cache.misses),
+                       (('response', 'hit'), response_cache.hits), (('response', 'miss'), response_cache.misses),
+                       (('delivery_keys', 'hit'), recent_delivery_keys.hits)],
+              labels=('cache', 'result'), kind='counter')
+metrics.gauge('stream_clients', "Open /api/stream connections", lambda: stats_broadcaster.info()['streams'])
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of this process's metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/reset')
 def reset_stats():
     """Reset all statistics (for testing purposes)"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)  # Increase timeout to avoid database locks
-        cursor = conn.cursor()
-
-        # Delete all webhook data
-        cursor.execute("DELETE FROM webhooks")
-
-        # Reset all stats
-        cursor.execute("DELETE FROM daily_stats")
-
-        conn.commit()
-        conn.close()
+        # Raw rows go in short transactions so ingest keeps flowing meanwhile
+        delete_in_batches("DELETE FROM webhooks WHERE id IN (SELECT id FROM webhooks LIMIT ?)")
+        delete_in_batches(
+            "DELETE FROM webhook_payloads WHERE webhook_id IN (SELECT webhook_id FROM webhook_payloads LIMIT ?)")
+        delete_in_batches(
+            "DELETE FROM minute_rollup WHERE (processing_day, minute_bucket, hook_num) IN "
+            "(SELECT processing_day, minute_bucket, hook_num FROM minute_rollup LIMIT ?)"
+        )
+        with db_pool.transaction() as cursor:
+            # Reset all stats; versions only move forward so other
+            # processes notice the reset
+            cursor.execute("DELETE FROM hook_stats")
+            cursor.execute("DELETE FROM archived_days")
+            cursor.execute("UPDATE day_versions SET version = version + 1, updated_at = ?",
+                           (int(time_module.time()),))
+        stats_cache.clear()
+        response_cache.clear()
+        # The deleted deliveries are no longer duplicates when resent
+        recent_delivery_keys.clear()
+        stats_broadcaster.resync_all()
+
+        # No reader may keep serving (or holding open) a deleted archive
+        db_pool.detach_readers()
+        if os.path.isdir(ARCHIVE_DIR):
+            for filename in os.listdir(ARCHIVE_DIR):
+                if filename.startswith('webhooks-') and filename.endswith('.db'):
+                    os.remove(os.path.join(ARCHIVE_DIR, filename))
+        incremental_vacuum(None)
 
         logger.info("All statistics reset")
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     except Exception as e:
         logger.error(f"Error resetting stats: {str(e)}")
         logger.error(traceback.format_exc())
-        if 'conn' in locals() and conn:
-            conn.close()
         return f"Error: {str(e)}", 500
 
 
-@app.route('/generate-test-data')
+@bp.route('/generate-test-data')
 def generate_test_data():
     """Generate test data for demonstration"""
     try:
@@ -1037,35 +3348,33 @@ def generate_test_data():
             "Клиент Иванов"
         ]
 
-        # Generate 25 webhooks, one for each type
+        # Generate one webhook for each type
         import random
-        for i in range(1, 26):
+        for i in range(1, HOOK_COUNT + 1):
             hook_type = f"hook{i}_count"
             name = random.choice(deal_names)
             summa = str(random.randint(5000, 50000))
 
             # Add to processing queue
-            webhook_queue.put({
-                'hook_type': hook_type,
-                'name': name,
-                'summa': summa,
-                'raw_data': f"{{'name': '{name}', 'summa': '{summa}'}}"
-            })
-
-        logger.info(f"Generated 25 test webhooks")
-        return redirect(url_for('index'))
+            enqueue_webhook(build_webhook_record(
+                hook_type, name, summa, canonical_json({'name': name, 'summa': summa})
+            ))
+
+        logger.info(f"Generated {HOOK_COUNT} test webhooks")
+        return redirect(url_for('.index'))
+    except SpoolFull as e:
+        return f"Error: {str(e)}", 429
     except Exception as e:
         logger.error(f"Error generating test data: {str(e)}")
         logger.error(traceback.format_exc())
         return f"Error: {str(e)}", 500
 
 
-@app.route('/debug')
+@bp.route('/debug')
 def debug():
     """Debug page to check database and queue status"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)  # Increase timeout to avoid database locks
-        cursor = conn.cursor()
+        cursor = db_pool.reader().cursor()
 
         # Get database info
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -1075,12 +3384,19 @@ def debug():
         cursor.execute("SELECT COUNT(*) FROM webhooks")
         webhook_count = cursor.fetchone()[0]
 
-        cursor.execute("SELECT * FROM webhooks ORDER BY received_at DESC LIMIT 10")
+        # Get column names for webhooks table; payloads are only decompressed
+        # on request (/api/webhooks/<id>)
+        cursor.execute("PRAGMA table_info(webhooks)")
+        webhook_columns = [column[1] for column in cursor.fetchall() if column[1] != 'raw_data']
+
+        cursor.execute(f"SELECT {', '.join(webhook_columns)} FROM webhooks ORDER BY received_at DESC LIMIT 10")
         recent_webhooks = cursor.fetchall()
 
-        # Get column names for webhooks table
-        cursor.execute("PRAGMA table_info(webhooks)")
-        webhook_columns = [column[1] for column in cursor.fetchall()]
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(length(payload)), 0) FROM webhook_payloads")
+        payload_count, payload_bytes = cursor.fetchone()
+
+        cursor.execute("SELECT archive, COUNT(*), MIN(day), MAX(day) FROM archived_days GROUP BY archive")
+        archives = cursor.fetchall()
 
         # Get daily stats data
         cursor.execute("SELECT * FROM daily_stats")
@@ -1090,8 +3406,6 @@ def debug():
         cursor.execute("PRAGMA table_info(daily_stats)")
         stats_columns = [column[1] for column in cursor.fetchall()]
 
-        conn.close()
-
         # Format debug info as HTML
         debug_info = f"""
         <h1>Debug Information</h1>
@@ -1103,7 +3417,21 @@ def debug():
         <h2>Webhook Queue</h2>
         <p>Queue size: {webhook_queue.qsize()}</p>
 
+        <h2>Stats Cache</h2>
+        <p>{''.join(f'{key}: {value}<br>' for key, value in stats_cache.info().items())}</p>
+        <p>{''.join(f'{key}: {value}<br>' for key, value in response_cache.info().items())}</p>
+        <p>{''.join(f'{key}: {value}<br>' for key, value in db_pool.info().items())}</p>
+        <p>{''.join(f'{key}: {value}<br>' for key, value in stats_broadcaster.info().items())}</p>
+        <p>{''.join(f'{key}: {value}<br>' for key, value in recent_delivery_keys.info().items())}</p>
+        <p>{''.join(f'{key}: {value}<br>' for key, value in webhook_spool.info().items())}</p>
+
+        <h2>Archives</h2>
+        <p>Retention: {f'{RETENTION_DAYS} day(s)' if RETENTION_DAYS > 0 else 'off'}</p>
+        <p>{''.join(f'{archive_path(month)}: {days} day(s), {first} .. {last}<br>'
+                    for month, days, first, last in archives)}</p>
+
         <h2>Webhooks Table ({webhook_count} total entries)</h2>
+        <p>Raw payloads: {payload_count} stored compressed in {payload_bytes} bytes; see /api/webhooks/&lt;id&gt;</p>
         <table border="1">
             <tr>
                 {''.join(f'<th>{col}</th>' for col in webhook_columns)}
@@ -1133,43 +3461,157 @@ def debug():
     except Exception as e:
         logger.error(f"Error in debug route: {str(e)}")
         error_traceback = traceback.format_exc()
-        if 'conn' in locals() and conn:
-            conn.close()
         return f"<h1>Error</h1><pre>{str(e)}</pre><h2>Traceback</h2><pre>{error_traceback}</pre>"
 
 
 # Handle favicon requests to prevent 404 errors
-@app.route('/favicon.ico')
+@bp.route('/favicon.ico')
 def favicon():
     return '', 204
 
 
-if __name__ == '__main__':
-    # Initialize database
+def check_minute_rollup(day=None):
+    """
+    Compare minute_rollup with counts recomputed from webhooks. Returns
+    (processing_day, minute_bucket, hook_num, rollup, raw) for every
+    mismatching cell, each side a (count, sum) pair or None. Archived days
+    are skipped.
+    """
+    day_filter = " AND processing_day = ?" if day else ""
+    day_filter += " AND processing_day NOT IN (SELECT day FROM archived_days)"
+    params = [day] if day else []
+    conn = db_pool.reader()
+    conn.execute("BEGIN")
     try:
-        init_db()
-        logger.info("Database initialized successfully")
+        rollup = {
+            tuple(row[:3]): (row[3], row[4])
+            for row in conn.execute(
+                f"SELECT processing_day, minute_bucket, hook_num, count, sum FROM minute_rollup WHERE 1=1{day_filter}",
+                params)
+        }
+        raw = {
+            tuple(row[:3]): (row[3], row[4])
+            for row in conn.execute(f'''
+                SELECT processing_day, ts / 60, CAST(substr(hook_type, 5, length(hook_type) - 10) AS INTEGER),
+                       COUNT(*), SUM(amount_int)
+                FROM webhooks
+                WHERE hook_type LIKE 'hook%\\_count' ESCAPE '\\'{day_filter}
+                GROUP BY processing_day, ts / 60, hook_type
+            ''', params)
+        }
+    finally:
+        conn.rollback()
+    return [key + (rollup.get(key), raw.get(key))
+            for key in sorted(set(rollup) | set(raw)) if rollup.get(key) != raw.get(key)]
+
+
+@bp.cli.command('rebuild-rollup')
+@click.option('--day', help="Processing day (YYYY-MM-DD or dd.mm.YYYY); all days by default")
+def rebuild_rollup_command(day):
+    """Recompute the minute rollup from the raw webhooks table."""
+    day = to_day_key(day) if day else None
+    if day and archived_day(day):
+        raise click.ClickException(f"{day} is archived; its rollup can no longer be rebuilt")
+    with db_pool.transaction() as cursor:
+        rebuild_minute_rollup(cursor, day)
+    click.echo(f"Rebuilt minute rollup for {day or 'all days'}")
+
+
+@bp.cli.command('check-rollup')
+@click.option('--day', help="Processing day (YYYY-MM-DD or dd.mm.YYYY); all days by default")
+def check_rollup_command(day):
+    """Compare the minute rollup with the raw webhooks table."""
+    mismatches = check_minute_rollup(to_day_key(day) if day else None)
+    for processing_day, minute_bucket, hook_num, rollup, raw in mismatches[:50]:
+        minute = datetime.fromtimestamp(minute_bucket * 60, moscow_tz).strftime('%Y-%m-%d %H:%M')
+        click.echo(f"{processing_day} {minute} hook{hook_num}: rollup={rollup} raw={raw}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} mismatching rollup cell(s)")
+    click.echo("Minute rollup matches the webhooks table")
+
+
+@bp.cli.command('archive')
+@click.option('--days', type=click.IntRange(min=1), default=None,
+              help="Processing days of raw webhooks to keep (default: WEBHOOK_RETENTION_DAYS)")
+@click.option('--dry-run', is_flag=True, help="Only list the days that would be archived")
+def archive_command(days, dry_run):
+    """Move raw webhooks older than the retention window into monthly archives."""
+    days = days or RETENTION_DAYS
+    if days <= 0:
+        raise click.ClickException("Retention is off; pass --days or set WEBHOOK_RETENTION_DAYS")
+    if dry_run:
+        for day, rows in retention_candidates(days):
+            click.echo(f"{day}: {rows} webhook(s) -> {archive_path(day[:7])}")
+        return
+    moved = run_retention(days)
+    if moved is None:
+        raise click.ClickException("Another process is archiving")
+    click.echo(f"Archived {sum(moved.values())} webhook(s) from {len(moved)} day(s)")
+
+
+@bp.cli.command('vacuum')
+def vacuum_command():
+    """Switch the database to incremental auto-vacuum (rewrites it once) and compact it."""
+    with db_pool.transaction() as cursor:
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("VACUUM")
+    mode = db_pool.reader().execute("PRAGMA auto_vacuum").fetchone()[0]
+    click.echo(f"Vacuumed {DB_PATH} (auto_vacuum={mode})")
+
+
+def _reset_after_fork():
+    """Drop per-process state inherited from the parent by a forked worker"""
+    global webhook_queue, _writer_thread, _writer_lock, _retention_thread, _retention_lock
+    restart_log_listener()
+    db_pool.reset_after_fork()
+    metrics.reset_after_fork()
+    stats_cache.reset_after_fork()
+    response_cache.reset_after_fork()
+    stats_broadcaster.reset_after_fork()
+    recent_delivery_keys.reset_after_fork()
+    webhook_spool.reset_after_fork()
+    webhook_queue = Queue()
+    _writer_thread = None
+    _writer_lock = threading.Lock()
+    _retention_thread = None
+    _retention_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def create_app():
+    """
+    Application factory. Initializes the database (idempotent: migrations
+    are serialized by SQLite's write lock and keyed by user_version) and
+    registers the routes.
+
+    Under a pre-forking server load the app in the master (gunicorn's
+    preload_app) so init_db runs exactly once; connections, caches and the
+    log listener are reset in each forked worker. Every process that
+    queues webhooks owns its own background writer, started lazily on the
+    first enqueue, because webhook_queue is in-process memory.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(bp)
 
-        # Test database connection
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
-        logger.info(f"Database tables: {[table[0] for table in tables]}")
-        conn.close()
-    except Exception as e:
-        logger.error(f"Database initialization error: {str(e)}")
-        logger.error(traceback.format_exc())
+    init_db()
+    return app
 
-    # Create templates directory if it doesn't exist
-    os.makedirs('templates', exist_ok=True)
 
-    # Start webhook processor thread
-    processor_thread = threading.Thread(target=webhook_processor)
-    processor_thread.daemon = True
-    processor_thread.start()
-    logger.info("Webhook processor thread started")
+if __name__ == '__main__':
+    # Development server; production runs wsgi:app under gunicorn
+    app = create_app()
+
+    # Test database connection
+    cursor = db_pool.reader().cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    tables = cursor.fetchall()
+    logger.info(f"Database tables: {[table[0] for table in tables]}")
+
+    if ASYNC_INGEST:
+        start_webhook_processor()
 
     # Start Flask app
     logger.info("Starting Flask application on port 5001")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    app.run(host='0.0.0.0', port=5001, debug=os.environ.get('FLASK_DEBUG') == '1')